@@ -197,6 +197,11 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 # Настройки REST Framework
 REST_FRAMEWORK = {
+    # orjson-рендерер (shop/renderers.py) с откатом на стандартный JSONRenderer
+    'DEFAULT_RENDERER_CLASSES': (
+        'shop.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
     'DEFAULT_PAGINATION_CLASS': None,  # Отключаем пагинацию по умолчанию
     'PAGE_SIZE': None,
     'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -204,6 +209,41 @@ REST_FRAMEWORK = {
     ),
 }
 
+# Каталог: максимум результатов полнотекстового поиска (?q=), которые сортируются по релевантности
+CATALOG_SEARCH_MAX_RESULTS = int(os.getenv('CATALOG_SEARCH_MAX_RESULTS', '500'))
+# Общий кэш для всех воркеров gunicorn (кэш ответов каталога, поколение каталога).
+# По умолчанию — файловый кэш на диске; для Redis/Memcached укажите свой backend и location.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('DJANGO_CACHE_LOCATION', os.path.join(BASE_DIR, 'var', 'cache')),
+    }
+}
+# Время жизни закэшированного ответа каталога (сек); 0 — кэш ответов выключен
+CATALOG_RESPONSE_CACHE_SECONDS = int(os.getenv('CATALOG_RESPONSE_CACHE_SECONDS', '300'))
+
+# Фасеты каталога: границы корзин гистограммы цен и время жизни кэша ответа (сек)
+CATALOG_FACET_PRICE_BUCKETS = os.getenv('CATALOG_FACET_PRICE_BUCKETS', '500,1000,2000,3000,5000,10000')
+CATALOG_FACETS_CACHE_SECONDS = int(os.getenv('CATALOG_FACETS_CACHE_SECONDS', '60'))
+# Как часто воркер пересобирает индекс подсказок поиска (сек), если не сменилось поколение каталога
+SUGGEST_INDEX_TTL_SECONDS = int(os.getenv('SUGGEST_INDEX_TTL_SECONDS', '300'))
+# Колоночный снимок каталога в памяти (NumPy) для фильтров, сортировки, price-range и фасетов
+CATALOG_ENGINE_ENABLED = os.getenv('CATALOG_ENGINE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Статический экспорт каталога (JSON + .gz/.br + manifest.json) после синков для раздачи nginx
+CATALOG_EXPORT_ENABLED = os.getenv('CATALOG_EXPORT_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+CATALOG_EXPORT_DIR = os.getenv('CATALOG_EXPORT_DIR', os.path.join(BASE_DIR, 'var', 'catalog-export'))
+# Префикс абсолютных URL картинок в экспорте (например https://api.kokossimo.ru); пусто — относительные
+CATALOG_EXPORT_BASE_URL = os.getenv('CATALOG_EXPORT_BASE_URL', '').rstrip('/')
+# Дисковый LRU-кэш картинок прокси /api/products/<id>/image/; 0 байт — кэш выключен
+IMAGE_PROXY_CACHE_DIR = os.getenv('IMAGE_PROXY_CACHE_DIR', os.path.join(BASE_DIR, 'var', 'image-cache'))
+IMAGE_PROXY_CACHE_MAX_BYTES = int(os.getenv('IMAGE_PROXY_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+# Сколько ждать (сек), пока другой воркер докачает ту же картинку, прежде чем качать самому
+IMAGE_PROXY_LOCK_TIMEOUT_SECONDS = float(os.getenv('IMAGE_PROXY_LOCK_TIMEOUT_SECONDS', '30'))
+# Сколько секунд прокси сразу отдаёт плейсхолдер после неудачи с фото товара (0 — без негативного кэша)
+IMAGE_PROXY_NEGATIVE_TTL_SECONDS = int(os.getenv('IMAGE_PROXY_NEGATIVE_TTL_SECONDS', '900'))
+# Ширины уменьшенных WebP/JPEG-копий фото товаров для srcset (px, через запятую); пусто — выключено
+PRODUCT_IMAGE_VARIANT_WIDTHS = os.getenv('PRODUCT_IMAGE_VARIANT_WIDTHS', '200,400,800')
+
 # Email (SMTP) settings
 EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
 EMAIL_HOST = os.getenv('EMAIL_HOST', '')
@@ -234,6 +274,15 @@ MOYSKLAD_PASSWORD = os.getenv('MOYSKLAD_PASSWORD', '')
 MOYSKLAD_TIMEOUT_SECONDS = int(os.getenv('MOYSKLAD_TIMEOUT_SECONDS', '15'))
 MOYSKLAD_MAX_RETRIES = int(os.getenv('MOYSKLAD_MAX_RETRIES', '3'))
 MOYSKLAD_RETRY_DELAY_SECONDS = float(os.getenv('MOYSKLAD_RETRY_DELAY_SECONDS', '1.5'))
+# Сколько простаивающих keep-alive соединений к API МойСклад держать на процесс (0 — новое соединение на каждый запрос)
+MOYSKLAD_HTTP_POOL_SIZE = int(os.getenv('MOYSKLAD_HTTP_POOL_SIZE', '8'))
+# Бюджет запросов к API МойСклад: столько запросов за окно в секундах (0 — без ограничителя), уточняется по X-RateLimit-*
+MOYSKLAD_RATE_LIMIT_REQUESTS = int(os.getenv('MOYSKLAD_RATE_LIMIT_REQUESTS', '45'))
+MOYSKLAD_RATE_LIMIT_INTERVAL_SECONDS = float(os.getenv('MOYSKLAD_RATE_LIMIT_INTERVAL_SECONDS', '3'))
+# Не больше стольких одновременных запросов к API МойСклад из процесса
+MOYSKLAD_MAX_PARALLEL_REQUESTS = int(os.getenv('MOYSKLAD_MAX_PARALLEL_REQUESTS', '5'))
+# Делить бюджет запросов между процессами через кэш Django
+MOYSKLAD_RATE_LIMIT_SHARED = os.getenv('MOYSKLAD_RATE_LIMIT_SHARED', 'false').lower() in ('1', 'true', 'yes')
 MOYSKLAD_SITE_SYNC_ENABLED = os.getenv('MOYSKLAD_SITE_SYNC_ENABLED', 'true').lower() in ('1', 'true', 'yes')
 MOYSKLAD_SITE_CATEGORY_NAME = os.getenv('MOYSKLAD_SITE_CATEGORY_NAME', 'САЙТ КОКОССИМО')
 MOYSKLAD_SITE_CATEGORY_SLUG = os.getenv('MOYSKLAD_SITE_CATEGORY_SLUG', 'site-kokossimo')
@@ -247,11 +296,33 @@ MOYSKLAD_RELAX_FOLDER_FILTER = os.getenv('MOYSKLAD_RELAX_FOLDER_FILTER', 'true')
 MOYSKLAD_STRICT_CATEGORY_ONLY = os.getenv('MOYSKLAD_STRICT_CATEGORY_ONLY', 'true').lower() in ('1', 'true', 'yes')
 MOYSKLAD_IMAGE_META_FETCH = os.getenv('MOYSKLAD_IMAGE_META_FETCH', 'true').lower() in ('1', 'true', 'yes')
 MOYSKLAD_IMAGE_PROXY_REDIRECT_ONLY = os.getenv('MOYSKLAD_IMAGE_PROXY_REDIRECT_ONLY', 'false').lower() in ('1', 'true', 'yes')
+# Сколько секунд помнить сработавшую стратегию скачивания картинок МойСклад (0 — не запоминать)
+MOYSKLAD_DOWNLOAD_STRATEGY_TTL_SECONDS = int(os.getenv('MOYSKLAD_DOWNLOAD_STRATEGY_TTL_SECONDS', '86400'))
 MOYSKLAD_SYNC_SAVE_LOCAL_IMAGES = os.getenv('MOYSKLAD_SYNC_SAVE_LOCAL_IMAGES', 'false').lower() in ('1', 'true', 'yes')
+# Потоков параллельной загрузки локальных фото в синке товаров
+MOYSKLAD_SYNC_IMAGE_WORKERS = int(os.getenv('MOYSKLAD_SYNC_IMAGE_WORKERS', '4'))
+# Сколько товаров запрашивать одним запросом в синке остатков (filter=id=a;id=b;...), не больше 100
+MOYSKLAD_STOCK_BATCH_SIZE = int(os.getenv('MOYSKLAD_STOCK_BATCH_SIZE', '100'))
 MOYSKLAD_SYNC_PAGE_SIZE = int(os.getenv('MOYSKLAD_SYNC_PAGE_SIZE', '50'))
 MOYSKLAD_USE_SEARCH_FILTER = os.getenv('MOYSKLAD_USE_SEARCH_FILTER', 'true').lower() in ('1', 'true', 'yes')
 MOYSKLAD_SITE_SEARCH_QUERY = os.getenv('MOYSKLAD_SITE_SEARCH_QUERY', '')
 MOYSKLAD_SYNC_MAX_PAGES = int(os.getenv('MOYSKLAD_SYNC_MAX_PAGES', '500'))
+# Инкрементальный синк переходит в полный, если полной сверки (с удалением устаревших) не было столько часов
+MOYSKLAD_FULL_RECONCILE_HOURS = float(os.getenv('MOYSKLAD_FULL_RECONCILE_HOURS', '24'))
+# Запас окна updated>= инкрементального синка назад от начала прошлого синка, секунд
+MOYSKLAD_DELTA_OVERLAP_SECONDS = int(os.getenv('MOYSKLAD_DELTA_OVERLAP_SECONDS', '60'))
+# Часовой пояс аккаунта МойСклад для фильтров по датам (updated>=)
+MOYSKLAD_TIMEZONE = os.getenv('MOYSKLAD_TIMEZONE', 'Europe/Moscow')
+# Секрет в адресе вебхуков МойСклад (?secret=...); пусто — приём вебхуков выключен
+MOYSKLAD_WEBHOOK_SECRET = os.getenv('MOYSKLAD_WEBHOOK_SECRET', '')
+# Сколько секунд помнить доставленные события вебхуков, чтобы отбрасывать повторы
+MOYSKLAD_WEBHOOK_DEDUP_SECONDS = int(os.getenv('MOYSKLAD_WEBHOOK_DEDUP_SECONDS', '86400'))
+# Пауза после последнего события по товару перед применением (серия правок — один upsert)
+MOYSKLAD_WEBHOOK_DEBOUNCE_SECONDS = float(os.getenv('MOYSKLAD_WEBHOOK_DEBOUNCE_SECONDS', '2'))
+# Обрабатывать очередь вебхуков в фоне процесса, принявшего вебхук (иначе — только process_moysklad_webhooks)
+MOYSKLAD_WEBHOOK_PROCESS_INLINE = os.getenv('MOYSKLAD_WEBHOOK_PROCESS_INLINE', 'true').lower() in ('1', 'true', 'yes')
+# После стольких неудачных попыток событие отбрасывается (его подберёт ближайший синк)
+MOYSKLAD_WEBHOOK_MAX_ATTEMPTS = int(os.getenv('MOYSKLAD_WEBHOOK_MAX_ATTEMPTS', '5'))
 
 # OpenAI для категоризации товаров (подкатегория по названию/описанию)
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
@@ -33,6 +33,7 @@ from shop.views import (
     product_image_proxy,
     moysklad_status,
     moysklad_assortment,
+    moysklad_webhook,
     delivery_cities_config,
 )
 
@@ -139,6 +140,7 @@ urlpatterns = [
     path('api/products/<int:product_id>/rate/', rate_product),
     path('api/integrations/moysklad/status/', moysklad_status),
     path('api/integrations/moysklad/assortment/', moysklad_assortment),
+    path('api/integrations/moysklad/webhook/', moysklad_webhook),
     path('api/legal/<str:slug>/', legal_document_view),
     path('api/delivery/cities/', delivery_cities_config),
 ]
@@ -11,9 +11,12 @@ from django.urls import path, reverse
 from django.utils.html import format_html
 import threading
 import time
-from .models import Category, Product, ProductSubcategory, Profile, Order, OrderItem, ProductRating, Feedback, SyncLog
+from .models import Category, Product, ProductSubcategory, Profile, Order, OrderItem, ProductRating, Feedback, SyncLog, MoySkladWebhookItem
 from .moysklad import MoySkladConfigError, MoySkladError
 from .moysklad_sync import sync_product_stocks, sync_single_product, sync_site_products, SyncStoppedError
+from .search import refresh_search_index
+from .catalog_cache import bump_catalog_generation
+from . import image_cache
 
 _MAX_SYNC_LOG_OUTPUT_CHARS = 200000
 
@@ -106,7 +109,9 @@ class ProductAdmin(admin.ModelAdmin):
     fieldsets = (
         (None, {"fields": ("name", "category", "product_subcategory", "description", "composition", "usage_instructions", "price", "image")}),
         ("Главная страница", {"fields": ("is_bestseller", "is_new", "discount")}),
+        ("Оценки", {"fields": ("rating_avg", "rating_count", "rating_histogram")}),
     )
+    readonly_fields = ("rating_avg", "rating_count", "rating_histogram")
 
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         if db_field.name == "category" and getattr(settings, "MOYSKLAD_SITE_SYNC_ENABLED", False):
@@ -115,12 +120,19 @@ class ProductAdmin(admin.ModelAdmin):
             )
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        refresh_search_index([obj.id])
+        bump_catalog_generation()
+
     def get_urls(self):
         urls = super().get_urls()
         custom_urls = [
             path("sync/full/", self.admin_site.admin_view(self.sync_full_view), name="shop_product_sync_full"),
             path("sync/full-no-openai/", self.admin_site.admin_view(self.sync_full_no_openai_view), name="shop_product_sync_full_no_openai"),
+            path("sync/delta/", self.admin_site.admin_view(self.sync_delta_view), name="shop_product_sync_delta"),
             path("sync/stocks/", self.admin_site.admin_view(self.sync_stocks_view), name="shop_product_sync_stocks"),
+            path("image-failures/", self.admin_site.admin_view(self.image_failures_view), name="shop_product_image_failures"),
             path("<path:object_id>/resync/", self.admin_site.admin_view(self.resync_single_product_view), name="shop_product_resync"),
         ]
         return custom_urls + urls
@@ -129,7 +141,9 @@ class ProductAdmin(admin.ModelAdmin):
         extra_context = extra_context or {}
         extra_context["sync_full_url"] = reverse("admin:shop_product_sync_full")
         extra_context["sync_full_no_openai_url"] = reverse("admin:shop_product_sync_full_no_openai")
+        extra_context["sync_delta_url"] = reverse("admin:shop_product_sync_delta")
         extra_context["sync_stocks_url"] = reverse("admin:shop_product_sync_stocks")
+        extra_context["image_failures_url"] = reverse("admin:shop_product_image_failures")
         return super().changelist_view(request, extra_context=extra_context)
 
     def change_view(self, request, object_id, form_url="", extra_context=None):
@@ -137,6 +151,26 @@ class ProductAdmin(admin.ModelAdmin):
         extra_context["sync_single_url"] = reverse("admin:shop_product_resync", args=[object_id])
         return super().change_view(request, object_id, form_url=form_url, extra_context=extra_context)
 
+    def image_failures_view(self, request):
+        """Отчёт по негативному кэшу прокси фото: какие товары показывают плейсхолдер и почему."""
+        if request.method == "POST":
+            removed = image_cache.clear_negative()
+            self.message_user(request, f"Негативный кэш фото очищен: {removed} записей.", level=messages.INFO)
+            return HttpResponseRedirect(reverse("admin:shop_product_image_failures"))
+        entries = image_cache.negative_entries()
+        names = dict(Product.objects.filter(id__in=[entry["product_id"] for entry in entries]).values_list("id", "name"))
+        for entry in entries:
+            entry["name"] = names.get(entry["product_id"], "")
+            entry["change_url"] = reverse("admin:shop_product_change", args=[entry["product_id"]])
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "entries": entries,
+            "ttl_seconds": image_cache.negative_ttl(),
+            "title": "Битые фото товаров",
+        }
+        return render(request, "admin/shop/product/image_failures.html", context)
+
     def _redirect_to_changelist(self):
         return HttpResponseRedirect(reverse("admin:shop_product_changelist"))
 
@@ -190,6 +224,24 @@ class ProductAdmin(admin.ModelAdmin):
 
         return self._start_sync_job(request, "full_sync_no_openai", target)
 
+    def sync_delta_view(self, request):
+        def target(sync_log):
+            def run():
+                should_stop = _build_stop_checker(sync_log.id)
+                sync_site_products(
+                    force=True,
+                    run_openai_enrichment=False,
+                    sync_source="admin",
+                    initiated_by=getattr(request.user, "username", ""),
+                    progress_callback=lambda msg: _append_sync_log_output(sync_log.id, msg),
+                    should_stop=should_stop,
+                    sync_log=sync_log,
+                    incremental=True,
+                )
+            return run
+
+        return self._start_sync_job(request, "delta_sync", target)
+
     def sync_stocks_view(self, request):
         def target(sync_log):
             def run():
@@ -345,6 +397,34 @@ class SyncLogAdmin(admin.ModelAdmin):
         return HttpResponseRedirect(reverse("admin:shop_synclog_monitor", args=[object_id]))
 
 
+@admin.register(MoySkladWebhookItem)
+class MoySkladWebhookItemAdmin(admin.ModelAdmin):
+    """Очередь вебхуков МойСклад только для просмотра: строки удаляет обработчик после применения."""
+
+    list_display = ("key", "entity_type", "action", "events", "first_received_at", "received_at", "attempts", "last_error")
+    list_filter = ("entity_type", "action")
+    search_fields = ("key",)
+    readonly_fields = (
+        "key",
+        "entity_type",
+        "action",
+        "report_url",
+        "events",
+        "first_received_at",
+        "received_at",
+        "locked_until",
+        "attempts",
+        "last_error",
+    )
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
     list_display = ("user", "last_name", "first_name", "birth_date", "phone", "city")
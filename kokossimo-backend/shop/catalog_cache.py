@@ -0,0 +1,172 @@
+"""
+Кэш ответов публичного каталога с версионированием.
+
+Ключ ответа = поколение каталога + путь/хост + нормализованная строка запроса. Поколение —
+одно число в общем кэше (CACHES["default"], общий для всех воркеров gunicorn); любое изменение
+каталога (синки МойСклад, сохранение в админке, списание остатков заказом, новая оценка)
+вызывает bump_catalog_generation(), и все старые ключи просто перестают читаться.
+
+Поколение — метка времени изменения в микросекундах (монотонно растёт), поэтому его же
+можно отдавать как Last-Modified.
+
+В кэше лежит уже отрендеренный JSON. Персональные поля (user_rating) в кэш не попадают:
+для авторизованного пользователя тело берётся из кэша и дополняется его оценками.
+
+Условные GET (conditional_response): ETag/Last-Modified считаются до сериализации,
+совпавший If-None-Match/If-Modified-Since сразу получает 304 без тела.
+"""
+import hashlib
+import json
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from .renderers import FastJSONRenderer
+from rest_framework.response import Response
+
+GENERATION_KEY = "catalog:generation"
+
+
+def get_catalog_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # Кэш пуст (перезапуск/очистка) — начинаем новое поколение от текущего времени.
+        generation = int(time.time() * 1_000_000)
+        if not cache.add(GENERATION_KEY, generation, None):
+            generation = cache.get(GENERATION_KEY, generation)
+    return int(generation)
+
+
+def bump_catalog_generation():
+    """Инвалидирует все закэшированные ответы каталога. Внутри транзакции — после коммита."""
+
+    def _bump():
+        current = cache.get(GENERATION_KEY) or 0
+        cache.set(GENERATION_KEY, max(int(time.time() * 1_000_000), int(current) + 1), None)
+
+    transaction.on_commit(_bump)
+
+
+def catalog_last_modified():
+    """Момент последнего изменения каталога (по поколению)."""
+    return datetime.fromtimestamp(get_catalog_generation() / 1_000_000, tz=dt_timezone.utc)
+
+
+def normalized_query(request, exclude=()):
+    """Строка запроса с отсортированными параметрами и значениями (порядок в URL не важен)."""
+    items = []
+    for key in sorted(request.query_params.keys()):
+        if key in exclude:
+            continue
+        values = sorted(value.strip() for value in request.query_params.getlist(key))
+        items.append([key, values])
+    return json.dumps(items, ensure_ascii=False, separators=(",", ":"))
+
+
+def response_cache_key(request, namespace, generation=None):
+    if generation is None:
+        generation = get_catalog_generation()
+    raw = "|".join(
+        [
+            request.scheme,
+            request.get_host(),
+            request.path,
+            normalized_query(request),
+        ]
+    )
+    digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    return f"catalog-response:{generation}:{namespace}:{digest}"
+
+
+def cached_catalog_response(request, namespace, build, anonymize=None, personalize=None):
+    """
+    build() -> Response DRF; кэшируются только 200-ответы JSON.
+    anonymize(data) — убирает персональные поля перед сохранением (для авторизованных),
+    personalize(data, request) — возвращает их в тело из кэша.
+    """
+    renderer = getattr(request, "accepted_renderer", None)
+    timeout = int(getattr(settings, "CATALOG_RESPONSE_CACHE_SECONDS", 300))
+    if timeout <= 0 or (renderer is not None and getattr(renderer, "format", "") != "json"):
+        return build()
+
+    is_authenticated = bool(getattr(request, "user", None) and request.user.is_authenticated)
+    key = response_cache_key(request, namespace)
+    body = cache.get(key)
+    cache_status = "hit"
+    if body is None:
+        response = build()
+        if response.status_code != 200 or response.exception:
+            return response
+        data = response.data
+        if is_authenticated and anonymize is not None:
+            data = anonymize(json.loads(FastJSONRenderer().render(data)))
+        body = FastJSONRenderer().render(data)
+        cache.set(key, body, timeout)
+        if is_authenticated and anonymize is not None:
+            return response
+        cache_status = "miss"
+    elif is_authenticated and personalize is not None:
+        return Response(personalize(json.loads(body), request))
+
+    http_response = HttpResponse(body, content_type="application/json")
+    http_response["X-Catalog-Cache"] = cache_status
+    return http_response
+
+
+def make_etag(*parts):
+    """Сильный ETag из произвольных частей (поколение, путь, параметры, пользователь…)."""
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+    return f'"{digest}"'
+
+
+def catalog_etag(request, namespace, personal=False):
+    """ETag ответа каталога: меняется вместе с поколением; personal — ещё и по пользователю."""
+    renderer = getattr(request, "accepted_renderer", None)
+    user_part = ""
+    if personal and getattr(request, "user", None) and request.user.is_authenticated:
+        user_part = f"user:{request.user.pk}"
+    return make_etag(
+        get_catalog_generation(),
+        namespace,
+        request.get_host(),
+        request.path,
+        normalized_query(request),
+        getattr(renderer, "format", ""),
+        user_part,
+    )
+
+
+def conditional_response(request, build, etag, last_modified=None, personal=False):
+    """
+    304 Not Modified по If-None-Match / If-Modified-Since до вызова build(),
+    иначе ответ build() с ETag, Last-Modified и Cache-Control: no-cache (всегда ревалидировать).
+    """
+    timestamp = int(last_modified.timestamp()) if last_modified is not None else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = build()
+        if response.status_code != 200:
+            return response
+    response["ETag"] = etag
+    if timestamp is not None:
+        response["Last-Modified"] = http_date(timestamp)
+    response["Cache-Control"] = "private, no-cache" if personal else "no-cache"
+    if personal:
+        patch_vary_headers(response, ("Authorization",))
+    return response
+
+
+def conditional_catalog_response(request, namespace, build, personal=False):
+    """conditional_response с ETag/Last-Modified от поколения каталога."""
+    return conditional_response(
+        request,
+        build,
+        etag=catalog_etag(request, namespace, personal=personal),
+        last_modified=catalog_last_modified(),
+        personal=personal,
+    )
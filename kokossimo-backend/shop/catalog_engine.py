@@ -0,0 +1,287 @@
+"""
+Колоночный снимок каталога в памяти процесса (NumPy) для горячего пути чтения.
+
+Каталог витрины невелик, поэтому все поля, по которым фильтруют и сортируют, держатся
+массивами: цена (в копейках), остаток, created_at, индексы подкатегории/родителя/категории,
+флаги и рейтинг. Фильтры ProductViewSet превращаются в булевы маски, сортировка — в lexsort,
+price-range и фасеты — в агрегаты по маске. Из БД потом читается только страница по первичным ключам.
+
+Снимок пересобирается одним запросом, когда меняется поколение каталога (shop/catalog_cache.py).
+Без NumPy или при CATALOG_ENGINE_ENABLED=false get_catalog_engine() возвращает None,
+и вызывающий код работает через SQL.
+"""
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import ROUND_CEILING, ROUND_FLOOR, Decimal
+
+from django.conf import settings
+
+from .catalog_cache import get_catalog_generation
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy необязателен
+    np = None
+
+_engine = None
+_engine_lock = threading.Lock()
+
+ORDERING_FIELDS = ("price", "created_at", "id", "is_new", "is_bestseller")
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _cents(value, rounding):
+    return int((Decimal(value) * 100).to_integral_value(rounding=rounding))
+
+
+def _micros(value):
+    # Точно, без float: порядок по created_at должен совпадать с SQL до микросекунды.
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt_timezone.utc)
+    return (value - _EPOCH) // timedelta(microseconds=1)
+
+
+def _format_cents(value):
+    return f"{Decimal(int(value)) / 100:.2f}"
+
+
+class CatalogEngine:
+    def __init__(self, rows, generation):
+        """rows — кортежи из Product.values_list(*CatalogEngine.COLUMNS)."""
+        self.generation = generation
+        codes = {}
+        parents = {}
+        categories = {}
+
+        def _index(mapping, key):
+            if key is None or key == "":
+                return -1
+            return mapping.setdefault(key, len(mapping))
+
+        ids, price, stock, created, sub_idx, parent_idx, category_idx = [], [], [], [], [], [], []
+        is_new, is_bestseller, rating_avg, rating_count = [], [], [], []
+        for row in rows:
+            (pk, row_price, row_stock, row_created, code, parent_code, slug,
+             row_new, row_bestseller, row_rating_avg, row_rating_count) = row
+            ids.append(pk)
+            price.append(_cents(row_price or 0, ROUND_FLOOR))
+            stock.append(int(row_stock or 0))
+            created.append(_micros(row_created))
+            sub_idx.append(_index(codes, code))
+            parent_idx.append(_index(parents, parent_code) if code else -1)
+            category_idx.append(_index(categories, slug))
+            is_new.append(bool(row_new))
+            is_bestseller.append(bool(row_bestseller))
+            rating_avg.append(float("nan") if row_rating_avg is None else float(row_rating_avg))
+            rating_count.append(int(row_rating_count or 0))
+
+        self.ids = np.array(ids, dtype=np.int64)
+        self.price = np.array(price, dtype=np.int64)
+        self.stock = np.array(stock, dtype=np.int64)
+        self.created_at = np.array(created, dtype=np.int64)
+        self.subcategory = np.array(sub_idx, dtype=np.int32)
+        self.parent = np.array(parent_idx, dtype=np.int32)
+        self.category = np.array(category_idx, dtype=np.int32)
+        self.is_new = np.array(is_new, dtype=bool)
+        self.is_bestseller = np.array(is_bestseller, dtype=bool)
+        self.rating_avg = np.array(rating_avg, dtype=np.float64)
+        self.rating_count = np.array(rating_count, dtype=np.int64)
+        self.subcategory_codes = list(codes)
+        self.parent_codes = list(parents)
+        self.category_slugs = categories
+        # Родитель каждой подкатегории (для фасетов).
+        self.subcategory_parent = {}
+        for code_index, parent_index in zip(self.subcategory.tolist(), self.parent.tolist()):
+            if code_index >= 0:
+                self.subcategory_parent[code_index] = parent_index
+
+    COLUMNS = (
+        "id",
+        "price",
+        "stock",
+        "created_at",
+        "product_subcategory__code",
+        "product_subcategory__parent_code",
+        "category__slug",
+        "is_new",
+        "is_bestseller",
+        "rating_avg",
+        "rating_count",
+    )
+
+    @classmethod
+    def from_db(cls):
+        from .models import Product
+
+        generation = get_catalog_generation()
+        queryset = Product.objects.all()
+        if getattr(settings, "MOYSKLAD_SITE_SYNC_ENABLED", False):
+            queryset = queryset.filter(
+                moysklad_id__isnull=False,
+                category__slug=getattr(settings, "MOYSKLAD_SITE_CATEGORY_SLUG", "site-kokossimo"),
+            )
+        return cls(queryset.order_by().values_list(*cls.COLUMNS).iterator(chunk_size=2000), generation)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # --- маски фильтров ----------------------------------------------------------------
+
+    def _code_mask(self, column, mapping, values):
+        indexes = [mapping[value] for value in values if value in mapping]
+        if not indexes:
+            return np.zeros(len(self.ids), dtype=bool)
+        return np.isin(column, np.array(indexes, dtype=np.int32))
+
+    def masks(self, filters, ranked_ids=None):
+        """
+        Маски по измерениям: base (категория, поиск) и по одной на каждый фильтр-фасет.
+        Логика совпадает с ProductViewSet._filtered_queryset.
+        """
+        size = len(self.ids)
+        everything = np.ones(size, dtype=bool)
+        base = everything.copy()
+        if not getattr(settings, "MOYSKLAD_SITE_SYNC_ENABLED", False) and filters["category_slugs"]:
+            base &= self._code_mask(self.category, self.category_slugs, filters["category_slugs"])
+        if ranked_ids is not None:
+            base &= np.isin(self.ids, np.array(ranked_ids, dtype=np.int64))
+
+        if filters["subcategory_codes"]:
+            codes = {code: index for index, code in enumerate(self.subcategory_codes)}
+            category = self._code_mask(self.subcategory, codes, filters["subcategory_codes"])
+        elif filters["parent_codes"]:
+            parents = {code: index for index, code in enumerate(self.parent_codes)}
+            category = self._code_mask(self.parent, parents, filters["parent_codes"])
+        else:
+            category = everything
+
+        price = everything
+        if filters["price_min"] is not None:
+            price = price & (self.price >= _cents(filters["price_min"], ROUND_CEILING))
+        if filters["price_max"] is not None:
+            price = price & (self.price <= _cents(filters["price_max"], ROUND_FLOOR))
+
+        return {
+            "base": base,
+            "category": category,
+            "in_stock": self.stock > 0 if filters["in_stock"] else everything,
+            "is_new": self.is_new if filters["is_new"] else everything,
+            "is_bestseller": self.is_bestseller if filters["is_bestseller"] else everything,
+            "price": price,
+        }
+
+    @staticmethod
+    def combine(masks, skip=None):
+        result = masks["base"].copy()
+        for name, mask in masks.items():
+            if name not in ("base", skip):
+                result &= mask
+        return result
+
+    # --- выборки -----------------------------------------------------------------------
+
+    def _ordering_keys(self, ordering):
+        keys = []
+        for part in (p.strip() for p in (ordering or "").split(",")):
+            if not part:
+                continue
+            desc = part.startswith("-")
+            name = part[1:] if desc else part
+            if name not in ORDERING_FIELDS:
+                continue
+            column = {
+                "price": self.price,
+                "created_at": self.created_at,
+                "id": self.ids,
+                "is_new": self.is_new.astype(np.int8),
+                "is_bestseller": self.is_bestseller.astype(np.int8),
+            }[name]
+            keys.append(-column if desc else column)
+        return keys
+
+    def ordered_ids(self, filters, ranked_ids=None):
+        """Id товаров выборки в порядке, как у ProductViewSet (ordering / релевантность / новые первыми)."""
+        selected = np.flatnonzero(self.combine(self.masks(filters, ranked_ids)))
+        keys = self._ordering_keys(filters["ordering"])
+        ids = self.ids[selected]
+        if keys:
+            # lexsort: последний ключ — главный; id по убыванию — для устойчивого порядка при равенстве.
+            order = np.lexsort([-ids] + [key[selected] for key in reversed(keys)])
+        elif ranked_ids is not None and not filters["ordering"]:
+            position = {pk: index for index, pk in enumerate(ranked_ids)}
+            rank = np.array([position.get(pk, len(position)) for pk in ids.tolist()], dtype=np.int64)
+            order = np.lexsort([-ids, rank])
+        else:
+            order = np.lexsort([-ids, -self.created_at[selected]])
+        return ids[order].tolist()
+
+    def price_range(self, filters, ranked_ids=None):
+        mask = self.combine(self.masks(filters, ranked_ids))
+        if not mask.any():
+            return None, None
+        prices = self.price[mask]
+        return _format_cents(prices.min()), _format_cents(prices.max())
+
+    def facets(self, filters, ranked_ids, bounds):
+        """Тот же ответ, что shop.facets.build_facets, но по маскам снимка."""
+        masks = self.masks(filters, ranked_ids)
+        total = int(self.combine(masks).sum())
+
+        category_scope = self.combine(masks, skip="category")
+        subcategories = []
+        sub_counts = np.bincount(
+            self.subcategory[category_scope & (self.subcategory >= 0)],
+            minlength=len(self.subcategory_codes),
+        )
+        parents = {}
+        for code_index, count in enumerate(sub_counts.tolist()):
+            if not count:
+                continue
+            parent_index = self.subcategory_parent.get(code_index, -1)
+            parent_code = self.parent_codes[parent_index] if parent_index >= 0 else ""
+            subcategories.append(
+                {"code": self.subcategory_codes[code_index], "parent_code": parent_code, "count": count}
+            )
+            if parent_code:
+                parents[parent_code] = parents.get(parent_code, 0) + count
+
+        price_scope = self.combine(masks, skip="price")
+        bucket_edges = np.array([_cents(bound, ROUND_CEILING) for bound in bounds], dtype=np.int64)
+        buckets = np.bincount(
+            np.searchsorted(bucket_edges, self.price[price_scope], side="right"),
+            minlength=len(bounds) + 1,
+        )
+        prices = self.price[price_scope]
+        edges = [None] + [str(bound) for bound in bounds] + [None]
+        return {
+            "total": total,
+            "parents": [{"code": code, "count": count} for code, count in sorted(parents.items())],
+            "subcategories": sorted(subcategories, key=lambda item: item["code"]),
+            "in_stock": int((self.combine(masks, skip="in_stock") & (self.stock > 0)).sum()),
+            "is_new": int((self.combine(masks, skip="is_new") & self.is_new).sum()),
+            "is_bestseller": int((self.combine(masks, skip="is_bestseller") & self.is_bestseller).sum()),
+            "price": {
+                "min_price": _format_cents(prices.min()) if len(prices) else None,
+                "max_price": _format_cents(prices.max()) if len(prices) else None,
+                "histogram": [
+                    {"from": edges[index], "to": edges[index + 1], "count": int(count)}
+                    for index, count in enumerate(buckets.tolist())
+                ],
+            },
+        }
+
+
+def get_catalog_engine():
+    """Актуальный снимок каталога (пересборка при смене поколения) или None, если движок выключен."""
+    global _engine
+    if np is None or not getattr(settings, "CATALOG_ENGINE_ENABLED", True):
+        return None
+    engine = _engine
+    if engine is not None and engine.generation == get_catalog_generation():
+        return engine
+    with _engine_lock:
+        engine = _engine
+        if engine is None or engine.generation != get_catalog_generation():
+            engine = CatalogEngine.from_db()
+            _engine = engine
+    return engine
@@ -0,0 +1,169 @@
+"""
+Статический экспорт публичного каталога для раздачи через nginx без gunicorn.
+
+После синка МойСклад (товары/остатки) в CATALOG_EXPORT_DIR пишутся готовые JSON:
+products.json (карточки товаров, как в списке каталога, без user_rating), subcategory-tree.json,
+categories.json, delivery-cities.json — каждый с вариантами .gz и .br (если установлен brotli)
+для gzip_static/brotli_static. Последним пишется manifest.json с sha256 и размерами файлов:
+фронтенд берёт хэш из манифеста как версию (?v=<sha256>) и кэширует файлы надолго.
+
+Запись атомарная (временный файл + os.replace); файлы с неизменившимся содержимым не переписываются.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from django.utils import timezone
+
+from .catalog_cache import get_catalog_generation
+from .delivery_cities import DELIVERY_CITIES
+from .fast_serializers import ProductRowSerializer
+from .models import Category, Product
+from .renderers import FastJSONRenderer
+from .serializers import CategorySerializer, ProductCardSerializer, build_subcategory_tree
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli необязателен
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+# Экспорт пишется синхронно в конце синка: quality 11 на мегабайтном products.json стоит секунды,
+# а 9 сжимает почти так же при многократно меньшем времени.
+BROTLI_QUALITY = 9
+
+
+def _site_mode():
+    return getattr(settings, "MOYSKLAD_SITE_SYNC_ENABLED", False)
+
+
+def _site_slug():
+    return getattr(settings, "MOYSKLAD_SITE_CATEGORY_SLUG", "site-kokossimo")
+
+
+def _products_payload(base_url):
+    fields = [name for name in ProductCardSerializer.Meta.fields if name != "user_rating"]
+    row_serializer = ProductRowSerializer(fields, base_url=base_url)
+    queryset = Product.objects.all()
+    if _site_mode():
+        queryset = queryset.filter(moysklad_id__isnull=False, category__slug=_site_slug())
+    return row_serializer.serialize(row_serializer.values(queryset.order_by("-created_at", "-id")))
+
+
+def _categories_payload(base_url):
+    queryset = Category.objects.all()
+    if _site_mode():
+        queryset = queryset.filter(slug=_site_slug())
+    return CategorySerializer(queryset.order_by("id"), many=True, context={"base_url": base_url}).data
+
+
+def _write_atomic(path, content):
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(content)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _write_variants(output_dir, name, body, previous):
+    """Пишет name, name.gz, name.br; возвращает запись манифеста."""
+    digest = hashlib.sha256(body).hexdigest()
+    path = os.path.join(output_dir, name)
+    variants = {"gzip": f"{name}.gz", "brotli": f"{name}.br"}
+    unchanged = (
+        previous.get("sha256") == digest
+        and os.path.exists(path)
+        and all(os.path.exists(os.path.join(output_dir, previous[key])) for key in variants if previous.get(key))
+        and bool(previous.get("brotli")) == (brotli is not None)
+    )
+    if unchanged:
+        return dict(previous, changed=False)
+
+    entry = {"path": name, "sha256": digest, "size": len(body), "changed": True}
+    _write_atomic(path, body)
+    # mtime=0 — одинаковое содержимое даёт одинаковый .gz.
+    compressed = gzip.compress(body, compresslevel=9, mtime=0)
+    _write_atomic(os.path.join(output_dir, variants["gzip"]), compressed)
+    entry.update(gzip=variants["gzip"], gzip_size=len(compressed))
+    if brotli is not None:
+        compressed = brotli.compress(body, quality=BROTLI_QUALITY)
+        _write_atomic(os.path.join(output_dir, variants["brotli"]), compressed)
+        entry.update(brotli=variants["brotli"], brotli_size=len(compressed))
+    elif os.path.exists(os.path.join(output_dir, variants["brotli"])):
+        # Старый .br больше не соответствует файлу — nginx не должен его отдавать.
+        os.remove(os.path.join(output_dir, variants["brotli"]))
+    return entry
+
+
+def _read_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), "rb") as manifest_file:
+            return json.loads(manifest_file.read()).get("files") or {}
+    except (OSError, ValueError):
+        return {}
+
+
+def export_static_catalog(output_dir=None, base_url=None):
+    """
+    Пишет статический экспорт каталога и возвращает манифест.
+    base_url — префикс абсолютных URL картинок (по умолчанию CATALOG_EXPORT_BASE_URL).
+    """
+    if not output_dir:
+        output_dir = getattr(settings, "CATALOG_EXPORT_DIR", os.path.join(settings.BASE_DIR, "var", "catalog-export"))
+    if base_url is None:
+        base_url = getattr(settings, "CATALOG_EXPORT_BASE_URL", "")
+    os.makedirs(output_dir, exist_ok=True)
+
+    generation = get_catalog_generation()
+    products = _products_payload(base_url)
+    payloads = {
+        "products": ("products.json", products),
+        "subcategory_tree": ("subcategory-tree.json", build_subcategory_tree()),
+        "categories": ("categories.json", _categories_payload(base_url)),
+        "delivery_cities": ("delivery-cities.json", DELIVERY_CITIES),
+    }
+
+    previous = _read_manifest(output_dir)
+    renderer = FastJSONRenderer()
+    files = {}
+    for key, (name, data) in payloads.items():
+        files[key] = _write_variants(output_dir, name, renderer.render(data), previous.get(key) or {})
+    files["products"]["count"] = len(products)
+
+    manifest = {
+        "generated_at": timezone.now().isoformat(),
+        "generation": generation,
+        "files": files,
+    }
+    _write_atomic(os.path.join(output_dir, MANIFEST_NAME), renderer.render(manifest))
+    return manifest
+
+
+def export_static_catalog_after_sync(progress=None):
+    """Шаг после синка: экспорт, если CATALOG_EXPORT_ENABLED. Ошибка экспорта не ломает синк."""
+    if not getattr(settings, "CATALOG_EXPORT_ENABLED", False):
+        return None
+    try:
+        manifest = export_static_catalog()
+    except Exception:
+        logger.exception("Не удалось записать статический экспорт каталога")
+        return None
+    changed = [entry["path"] for entry in manifest["files"].values() if entry["changed"]]
+    if progress:
+        progress(
+            f"Статический экспорт каталога: товаров {manifest['files']['products']['count']}, "
+            f"обновлено файлов {len(changed)} из {len(manifest['files'])}."
+        )
+    return manifest
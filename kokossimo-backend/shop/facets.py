@@ -0,0 +1,169 @@
+"""
+Фасеты каталога (/api/products/facets/) за один сгруппированный запрос.
+
+Выборка берётся без фильтров-фасетов (подкатегории, наличие, новинки/бестселлеры, цена) и
+группируется по всем этим измерениям сразу. Строк немного (подкатегории × флаги × корзины цен),
+поэтому выбранные пользователем фильтры применяются к ним уже в Python. Счётчик каждого фасета
+учитывает все выбранные фильтры, кроме своего собственного: так UI показывает, сколько товаров
+станет, если переключить значение.
+"""
+import hashlib
+import json
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import BooleanField, Case, Count, IntegerField, Max, Min, Q, Value, When
+
+
+def price_bucket_bounds():
+    """Границы корзин гистограммы цен из CATALOG_FACET_PRICE_BUCKETS (по возрастанию)."""
+    raw = getattr(settings, "CATALOG_FACET_PRICE_BUCKETS", "500,1000,2000,3000,5000,10000")
+    bounds = []
+    for part in str(raw or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            bounds.append(Decimal(part))
+        except ArithmeticError:
+            continue
+    return sorted(set(bounds))
+
+
+def _price_str(value):
+    """Цена с копейками, как у снимка каталога: на SQLite Min/Max по DecimalField приходят без квантования."""
+    return str(Decimal(value).quantize(Decimal("0.01"))) if value is not None else None
+
+
+def _decimal_key(value):
+    return format(value.normalize(), "f") if value is not None else None
+
+
+def filter_signature(filters):
+    """Стабильный ключ набора фильтров: порядок параметров, повторы и запись чисел не влияют на кэш."""
+    normalized = {
+        "subcategory": sorted(set(filters["subcategory_codes"])),
+        "parent": sorted(set(filters["parent_codes"])),
+        "category": sorted(set(filters["category_slugs"])),
+        "price_min": _decimal_key(filters["price_min"]),
+        "price_max": _decimal_key(filters["price_max"]),
+        "q": " ".join(filters["search_q"].lower().split()),
+        "is_new": filters["is_new"],
+        "is_bestseller": filters["is_bestseller"],
+        "in_stock": filters["in_stock"],
+    }
+    raw = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _grouped_rows(queryset, filters, bounds):
+    bucket = Case(
+        *[When(price__lt=bound, then=Value(index)) for index, bound in enumerate(bounds)],
+        default=Value(len(bounds)),
+        output_field=IntegerField(),
+    )
+    price_q = Q()
+    if filters["price_min"] is not None:
+        price_q &= Q(price__gte=filters["price_min"])
+    if filters["price_max"] is not None:
+        price_q &= Q(price__lte=filters["price_max"])
+    in_price = (
+        Case(When(price_q, then=Value(True)), default=Value(False), output_field=BooleanField())
+        if price_q
+        else Value(True, output_field=BooleanField())
+    )
+    return (
+        queryset.order_by()
+        .annotate(
+            facet_in_stock=Case(
+                When(stock__gt=0, then=Value(True)), default=Value(False), output_field=BooleanField()
+            ),
+            facet_price_bucket=bucket,
+            facet_in_price=in_price,
+        )
+        .values(
+            "product_subcategory__code",
+            "product_subcategory__parent_code",
+            "is_new",
+            "is_bestseller",
+            "facet_in_stock",
+            "facet_price_bucket",
+            "facet_in_price",
+        )
+        .annotate(n=Count("id"), min_price=Min("price"), max_price=Max("price"))
+    )
+
+
+def _matches(row, filters, skip):
+    if "category" not in skip:
+        if filters["subcategory_codes"]:
+            if row["product_subcategory__code"] not in filters["subcategory_codes"]:
+                return False
+        elif filters["parent_codes"]:
+            if row["product_subcategory__parent_code"] not in filters["parent_codes"]:
+                return False
+    if "in_stock" not in skip and filters["in_stock"] and not row["facet_in_stock"]:
+        return False
+    if "is_new" not in skip and filters["is_new"] and not row["is_new"]:
+        return False
+    if "is_bestseller" not in skip and filters["is_bestseller"] and not row["is_bestseller"]:
+        return False
+    if "price" not in skip and not row["facet_in_price"]:
+        return False
+    return True
+
+
+def build_facets(queryset, filters):
+    """
+    queryset — выборка каталога без фильтров-фасетов, filters — результат разбора параметров.
+    Возвращает dict, готовый к отдаче в JSON.
+    """
+    bounds = price_bucket_bounds()
+    rows = list(_grouped_rows(queryset, filters, bounds))
+
+    total = 0
+    parents = {}
+    subcategories = {}
+    flags = {"in_stock": 0, "is_new": 0, "is_bestseller": 0}
+    buckets = [0] * (len(bounds) + 1)
+    min_price = None
+    max_price = None
+
+    for row in rows:
+        n = row["n"]
+        if _matches(row, filters, ()):
+            total += n
+        if _matches(row, filters, ("category",)) and row["product_subcategory__code"]:
+            code = row["product_subcategory__code"]
+            parent_code = row["product_subcategory__parent_code"] or ""
+            subcategories.setdefault(code, {"code": code, "parent_code": parent_code, "count": 0})
+            subcategories[code]["count"] += n
+            if parent_code:
+                parents[parent_code] = parents.get(parent_code, 0) + n
+        for flag, row_key in (("in_stock", "facet_in_stock"), ("is_new", "is_new"), ("is_bestseller", "is_bestseller")):
+            if row[row_key] and _matches(row, filters, (flag,)):
+                flags[flag] += n
+        if _matches(row, filters, ("price",)):
+            buckets[row["facet_price_bucket"]] += n
+            if min_price is None or row["min_price"] < min_price:
+                min_price = row["min_price"]
+            if max_price is None or row["max_price"] > max_price:
+                max_price = row["max_price"]
+
+    edges = [None] + [str(bound) for bound in bounds] + [None]
+    return {
+        "total": total,
+        "parents": [{"code": code, "count": count} for code, count in sorted(parents.items())],
+        "subcategories": sorted(subcategories.values(), key=lambda item: item["code"]),
+        "in_stock": flags["in_stock"],
+        "is_new": flags["is_new"],
+        "is_bestseller": flags["is_bestseller"],
+        "price": {
+            "min_price": _price_str(min_price),
+            "max_price": _price_str(max_price),
+            "histogram": [
+                {"from": edges[index], "to": edges[index + 1], "count": count}
+                for index, count in enumerate(buckets)
+            ],
+        },
+    }
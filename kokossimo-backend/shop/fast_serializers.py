@@ -0,0 +1,164 @@
+"""
+Быстрая сериализация товаров для горячих эндпоинтов (список каталога, корзина, избранное).
+
+Вместо ModelSerializer + SerializerMethodField на каждый объект: строки берутся через .values()
+(без создания моделей), абсолютные префиксы URL считаются один раз на запрос, каждое поле —
+заранее выбранная маленькая функция от строки. Результат совпадает с ProductSerializer
+(проверка — команда benchmark_product_serialization).
+"""
+from django.conf import settings
+
+from .image_variants import variants_are_current
+from .models import Product, ProductRating
+
+_IMAGE_FIELD = Product._meta.get_field("image")
+
+
+def _price(value):
+    # Как DecimalField DRF: строка с фиксированными двумя знаками.
+    return None if value is None else f"{value:.2f}"
+
+
+class ProductImageUrls:
+    """
+    Абсолютные URL фото товара с префиксами, посчитанными один раз на запрос.
+    base_url — префикс без запроса (статический экспорт каталога).
+    """
+
+    def __init__(self, request, base_url=None):
+        self.request = request
+        if base_url is not None:
+            self.base = base_url.rstrip("/")
+        else:
+            self.base = request.build_absolute_uri("/")[:-1] if request is not None else ""
+        self.absolute = request is not None or base_url is not None
+
+    def media(self, name):
+        if not self.absolute:
+            return f"{settings.MEDIA_URL}{name}"
+        url = _IMAGE_FIELD.storage.url(name)
+        return f"{self.base}{url}" if url.startswith("/") else url
+
+    def image(self, product_id, image_name, external_image_url):
+        if image_name:
+            return self.media(image_name)
+        if external_image_url:
+            return f"{self.base}/api/products/{product_id}/image/"
+        return None
+
+    def srcset(self, image_name, external_image_url, variants):
+        """{"webp": "url 200w, url 400w", "jpeg": "..."} из Product.image_variants или None."""
+        if not variants_are_current(variants, image_name, external_image_url):
+            return None
+        result = {}
+        for key in ("webp", "jpeg"):
+            names = variants.get(key) or {}
+            if names:
+                result[key] = ", ".join(
+                    f"{self.media(names[width])} {width}w" for width in sorted(names, key=int)
+                )
+        return result or None
+
+
+# Поле ответа -> колонки .values(), которые ему нужны.
+PRODUCT_FIELD_COLUMNS = {
+    "id": ("id",),
+    "name": ("name",),
+    "description": ("description",),
+    "composition": ("composition",),
+    "usage_instructions": ("usage_instructions",),
+    "price": ("price",),
+    "stock": ("stock",),
+    "is_in_stock": ("stock",),
+    "image": ("id", "image", "external_image_url"),
+    "image_srcset": ("image", "external_image_url", "image_variants"),
+    "category_slug": ("category__slug",),
+    "product_subcategory_code": ("product_subcategory__code",),
+    "product_subcategory_name": ("product_subcategory__name",),
+    "is_bestseller": ("is_bestseller",),
+    "is_new": ("is_new",),
+    "discount": ("discount",),
+    "rating_avg": ("rating_avg",),
+    "rating_count": ("rating_count",),
+    "rating_histogram": ("rating_histogram",),
+    "user_rating": ("id",),
+}
+
+
+class ProductRowSerializer:
+    """
+    fields — поля ответа в нужном порядке (как Meta.fields у ProductSerializer/ProductCardSerializer).
+    Использование: rows = serializer.values(queryset)[...]; data = serializer.serialize(rows).
+    """
+
+    def __init__(self, fields, request=None, base_url=None):
+        self.fields = [name for name in fields if name in PRODUCT_FIELD_COLUMNS]
+        self.request = request
+        self.urls = ProductImageUrls(request, base_url=base_url)
+        columns = []
+        for name in self.fields:
+            for column in PRODUCT_FIELD_COLUMNS[name]:
+                if column not in columns:
+                    columns.append(column)
+        self.columns = columns
+
+    def values(self, queryset, extra_columns=()):
+        """Строки для serialize(); extra_columns — дополнительные колонки (например, для курсора)."""
+        extra = [column for column in extra_columns if column not in self.columns]
+        return queryset.values(*self.columns, *extra)
+
+    def _user_ratings(self, rows):
+        request = self.request
+        if "user_rating" not in self.fields or request is None or not request.user.is_authenticated:
+            return {}
+        return dict(
+            ProductRating.objects.filter(
+                user_id=request.user.id,
+                product_id__in=[row["id"] for row in rows],
+            ).values_list("product_id", "rating")
+        )
+
+    def serialize(self, rows):
+        rows = list(rows)
+        user_ratings = self._user_ratings(rows)
+        image = self.urls.image
+        srcset = self.urls.srcset
+        getters = {
+            "price": lambda row: _price(row["price"]),
+            "stock": lambda row: int(row["stock"] or 0),
+            "is_in_stock": lambda row: int(row["stock"] or 0) > 0,
+            "image": lambda row: image(row["id"], row["image"], row["external_image_url"]),
+            "image_srcset": lambda row: srcset(row["image"], row["external_image_url"], row["image_variants"]),
+            "category_slug": lambda row: row["category__slug"],
+            "product_subcategory_code": lambda row: row["product_subcategory__code"],
+            "product_subcategory_name": lambda row: row["product_subcategory__name"],
+            "rating_avg": lambda row: None if row["rating_avg"] is None else float(row["rating_avg"]),
+            "user_rating": lambda row: user_ratings.get(row["id"]),
+        }
+        plan = [
+            (name, getters.get(name) or (lambda row, column=name: row[column]))
+            for name in self.fields
+        ]
+        return [{name: getter(row) for name, getter in plan} for row in rows]
+
+
+# Колонки товара, нужные корзине и избранному (через связь product__).
+CART_PRODUCT_COLUMNS = (
+    "product__name",
+    "product__price",
+    "product__discount",
+    "product__stock",
+    "product__image",
+    "product__external_image_url",
+    "product__image_variants",
+)
+FAVORITE_PRODUCT_COLUMNS = (
+    "product__name",
+    "product__price",
+    "product__discount",
+    "product__is_new",
+    "product__description",
+    "product__image",
+    "product__external_image_url",
+    "product__image_variants",
+)
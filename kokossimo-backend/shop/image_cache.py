@@ -0,0 +1,356 @@
+"""
+Дисковый LRU-кэш картинок прокси /api/products/<id>/image/.
+
+Ключ — sha256 от external_image_url (адресация по содержимому ссылки): смена ссылки в синке
+даёт новый ключ, старая запись удаляется через discard(). Файлы лежат в IMAGE_PROXY_CACHE_DIR
+как <ключ[:2]>/<ключ> (тело) и <ключ>.type (Content-Type). Время последнего доступа — mtime
+тела (обновляется при попадании), при превышении IMAGE_PROXY_CACHE_MAX_BYTES удаляются самые
+давно читанные записи до 90% лимита. Превышение put() определяет по оценке размера, а не обходом
+каталога на каждую запись. Общий для всех воркеров gunicorn на одной машине.
+
+fill_lock() — single-flight между воркерами: пока один процесс скачивает картинку, остальные
+ждут на файловой блокировке (flock на .<ключ>.lock) и затем читают готовый файл из кэша.
+Владелец удаляет файл блокировки перед её снятием, поэтому на диске остаются только занятые блокировки.
+
+Негативный кэш: если у товара нет фото или МойСклад не отдал картинку, в negative/<id товара>
+пишется JSON со ссылкой и причиной, и IMAGE_PROXY_NEGATIVE_TTL_SECONDS прокси сразу отдаёт
+плейсхолдер (без запроса к БД и цепочки повторов). Запись удаляется, когда синк меняет ссылку
+на фото или фото товара сохраняют в админке; список записей — отчёт «Битые фото» в админке.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: блокировки между процессами нет
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Не обновлять mtime чаще раза в минуту на запись — меньше лишних записей метаданных на диск.
+_TOUCH_INTERVAL_SECONDS = 60
+# Размер кэша по последнему обходу плюс записанное этим процессом; обход не чаще раза в 5 минут, пока лимит не превышен.
+_RESCAN_INTERVAL_SECONDS = 300
+_size_lock = threading.Lock()
+_size_estimate = {"bytes": None, "at": 0.0}
+
+
+def cache_dir():
+    return getattr(settings, "IMAGE_PROXY_CACHE_DIR", os.path.join(settings.BASE_DIR, "var", "image-cache"))
+
+
+def max_bytes():
+    return int(getattr(settings, "IMAGE_PROXY_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+def is_enabled():
+    return max_bytes() > 0
+
+
+def cache_key(url):
+    return hashlib.sha256((url or "").encode("utf-8")).hexdigest()
+
+
+def _paths(url):
+    key = cache_key(url)
+    directory = os.path.join(cache_dir(), key[:2])
+    body = os.path.join(directory, key)
+    return key, directory, body, f"{body}.type"
+
+
+def get(url):
+    """
+    (открытый файл тела, content_type, ключ) или None; файл закрывает вызывающий.
+    Тело открывается сразу: вытеснение другим воркером может удалить запись в любой момент,
+    а открытый дескриптор дочитает файл и после удаления. Пропавший файл — промах.
+    Попадание обновляет время доступа (LRU).
+    """
+    if not url or not is_enabled():
+        return None
+    key, _directory, body, type_path = _paths(url)
+    try:
+        body_file = open(body, "rb")
+    except OSError:
+        return None
+    try:
+        stat = os.fstat(body_file.fileno())
+        with open(type_path, encoding="utf-8") as type_file:
+            content_type = type_file.read().strip() or "application/octet-stream"
+    except OSError:
+        body_file.close()
+        return None
+    if time.time() - stat.st_mtime > _TOUCH_INTERVAL_SECONDS:
+        try:
+            os.utime(body)
+        except OSError:
+            pass
+    return body_file, content_type, key
+
+
+def put(url, payload, content_type):
+    """Сохраняет картинку (атомарно) и при необходимости вытесняет старые записи."""
+    if not url or not payload or not is_enabled():
+        return None
+    key, directory, body, type_path = _paths(url)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        for path, content in ((type_path, (content_type or "").encode("utf-8")), (body, payload)):
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as tmp:
+                    tmp.write(content)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+    except OSError:
+        logger.warning("Не удалось записать картинку в дисковый кэш прокси", exc_info=True)
+        return None
+    _evict_if_needed(len(payload))
+    return body
+
+
+def _evict_if_needed(written):
+    """
+    Полный обход кэша — только когда оценка размера превысила лимит или устарела.
+    Оценка своя у каждого процесса и не видит записи других воркеров,
+    поэтому раз в _RESCAN_INTERVAL_SECONDS она пересчитывается по диску.
+    """
+    with _size_lock:
+        stale = _size_estimate["bytes"] is None or time.monotonic() - _size_estimate["at"] > _RESCAN_INTERVAL_SECONDS
+        if not stale:
+            _size_estimate["bytes"] += written
+            if _size_estimate["bytes"] <= max_bytes():
+                return
+    evict()
+
+
+@contextmanager
+def fill_lock(url, timeout=None):
+    """
+    Эксклюзивная блокировка заполнения записи для ссылки (между процессами и потоками).
+    Отдаёт True, если блокировка взята, False — если не дождались за timeout
+    (IMAGE_PROXY_LOCK_TIMEOUT_SECONDS) или блокировки недоступны; тогда вызывающий качает сам.
+    """
+    if not url or fcntl is None or not is_enabled():
+        yield False
+        return
+    if timeout is None:
+        timeout = float(getattr(settings, "IMAGE_PROXY_LOCK_TIMEOUT_SECONDS", 30))
+    key, directory, _body, _type_path = _paths(url)
+    lock_path = os.path.join(directory, f".{key}.lock")
+    deadline = time.monotonic() + timeout
+    fd = None
+    acquired = False
+    try:
+        while True:
+            try:
+                os.makedirs(directory, exist_ok=True)
+                fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            except OSError:
+                fd = None
+                break
+            acquired = _flock(fd, deadline)
+            if not acquired or _is_current_lock(fd, lock_path):
+                break
+            # Пока ждали, владелец удалил файл блокировки — блокируемся на новом файле.
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+            fd = None
+            acquired = False
+        yield acquired
+    finally:
+        if acquired:
+            # Файл удаляется под блокировкой, чтобы .lock не копились; ожидающие заметят смену inode.
+            try:
+                os.remove(lock_path)
+            except OSError:
+                pass
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        if fd is not None:
+            os.close(fd)
+
+
+def _flock(fd, deadline):
+    while True:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+
+
+def _is_current_lock(fd, lock_path):
+    """Открытый файл блокировки всё ещё лежит по своему пути (его не удалил предыдущий владелец)."""
+    try:
+        return os.path.samestat(os.fstat(fd), os.stat(lock_path))
+    except OSError:
+        return False
+
+
+def discard(url):
+    """Удаляет запись для ссылки (например, когда синк сменил external_image_url товара)."""
+    if not url:
+        return
+    _key, _directory, body, type_path = _paths(url)
+    for path in (body, type_path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _entries():
+    root = cache_dir()
+    try:
+        shards = list(os.scandir(root))
+    except OSError:
+        return []
+    entries = []
+    for shard in shards:
+        # Тела картинок лежат только в двухсимвольных шардах (negative/ — негативный кэш).
+        if len(shard.name) != 2 or not shard.is_dir():
+            continue
+        for entry in os.scandir(shard.path):
+            if entry.name.startswith(".") or entry.name.endswith(".type"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+
+def stats():
+    entries = _entries()
+    return {"entries": len(entries), "bytes": sum(size for _mtime, size, _path in entries), "max_bytes": max_bytes()}
+
+
+def evict(limit=None):
+    """Удаляет давно читанные записи, пока размер кэша больше лимита (до 90% лимита). Возвращает число удалённых."""
+    limit = max_bytes() if limit is None else limit
+    entries = _entries()
+    total = sum(size for _mtime, size, _path in entries)
+    if total <= limit:
+        _remember_size(total)
+        return 0
+    target = int(limit * 0.9)
+    removed = 0
+    for _mtime, size, path in sorted(entries):
+        if total <= target:
+            break
+        for victim in (path, f"{path}.type"):
+            try:
+                os.remove(victim)
+            except OSError:
+                pass
+        total -= size
+        removed += 1
+    _remember_size(total)
+    return removed
+
+
+def _remember_size(total):
+    with _size_lock:
+        _size_estimate["bytes"] = total
+        _size_estimate["at"] = time.monotonic()
+
+
+def negative_ttl():
+    return int(getattr(settings, "IMAGE_PROXY_NEGATIVE_TTL_SECONDS", 900))
+
+
+def _negative_path(product_id):
+    return os.path.join(cache_dir(), "negative", str(int(product_id)))
+
+
+def _read_negative(path):
+    try:
+        with open(path, encoding="utf-8") as entry_file:
+            entry = json.load(entry_file)
+        entry["age_seconds"] = max(0, int(time.time() - os.stat(path).st_mtime))
+    except (OSError, ValueError):
+        return None
+    return entry if isinstance(entry, dict) else None
+
+
+def get_negative(product_id):
+    """Свежая запись негативного кэша товара ({url, reason, failed_at, failures, age_seconds}) или None."""
+    ttl = negative_ttl()
+    if ttl <= 0:
+        return None
+    entry = _read_negative(_negative_path(product_id))
+    if entry is None or entry["age_seconds"] >= ttl:
+        return None
+    return entry
+
+
+def put_negative(product_id, url, reason):
+    """Запоминает, что фото товара (по ссылке url) сейчас отдать нельзя. failures копится между записями."""
+    if negative_ttl() <= 0:
+        return
+    path = _negative_path(product_id)
+    previous = _read_negative(path) or {}
+    failures = int(previous.get("failures") or 0) if previous.get("url") == (url or "") else 0
+    entry = {
+        "product_id": int(product_id),
+        "url": url or "",
+        "reason": reason,
+        "failed_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "failures": failures + 1,
+    }
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        with os.fdopen(fd, "w", encoding="utf-8") as tmp:
+            json.dump(entry, tmp, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError:
+        logger.warning("Не удалось записать негативный кэш фото товара %s", product_id, exc_info=True)
+
+
+def discard_negative(product_id):
+    try:
+        os.remove(_negative_path(product_id))
+    except (OSError, TypeError, ValueError):
+        pass
+
+
+def negative_entries():
+    """Все записи негативного кэша (в том числе истёкшие) для отчёта в админке, сначала свежие."""
+    directory = os.path.join(cache_dir(), "negative")
+    try:
+        names = [entry.name for entry in os.scandir(directory) if entry.name.isdigit()]
+    except OSError:
+        return []
+    ttl = negative_ttl()
+    entries = []
+    for name in names:
+        entry = _read_negative(os.path.join(directory, name))
+        if entry is not None:
+            entry["active"] = entry["age_seconds"] < ttl
+            entries.append(entry)
+    entries.sort(key=lambda entry: entry["age_seconds"])
+    return entries
+
+
+def clear_negative():
+    """Удаляет весь негативный кэш. Возвращает число удалённых записей."""
+    removed = 0
+    for entry in negative_entries():
+        discard_negative(entry.get("product_id"))
+        removed += 1
+    return removed
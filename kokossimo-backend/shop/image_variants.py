@@ -0,0 +1,227 @@
+"""
+Уменьшенные варианты фото товара (WebP + JPEG для старых браузеров) для srcset в карточках.
+
+Для каждого товара с фото (Product.image или external_image_url из МойСклад) строятся копии
+шириной PRODUCT_IMAGE_VARIANT_WIDTHS (без увеличения маленьких оригиналов) и сохраняются в
+медиа-хранилище: product-variants/<хэш источника>/<ширина>.webp|.jpg — их раздаёт nginx как /media/.
+
+В Product.image_variants лежит {"source": <имя файла или ссылка>, "webp": {ширина: имя}, "jpeg": {...}}.
+Если источник фото сменился, а варианты ещё не пересобраны, srcset не отдаётся (source не совпадает).
+
+Когда строятся: в фоне после сохранения товара с новым Product.image (сигнал) и при первом
+обращении к прокси фото МойСклад, а также командой build_product_image_variants для всего каталога.
+Файлы вариантов прежнего источника удаляются, когда записаны новые.
+"""
+import hashlib
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+
+from . import image_cache
+from .catalog_cache import bump_catalog_generation
+from .models import Product
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - Pillow есть в requirements (ImageField)
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+VARIANT_FORMATS = (("webp", "WEBP", "webp"), ("jpeg", "JPEG", "jpg"))
+
+# Фоновые сборки из прокси фото: небольшой общий пул и ограниченная очередь (в ней держатся байты оригиналов).
+BACKGROUND_WORKERS = 2
+BACKGROUND_MAX_PENDING = 32
+_background_lock = threading.Lock()
+_background_pending = set()
+_executor = None
+
+
+def variant_widths():
+    raw = getattr(settings, "PRODUCT_IMAGE_VARIANT_WIDTHS", "200,400,800")
+    widths = set()
+    for part in str(raw or "").split(","):
+        part = part.strip()
+        if part.isdigit() and int(part) > 0:
+            widths.add(int(part))
+    return sorted(widths)
+
+
+def is_enabled():
+    return Image is not None and bool(variant_widths())
+
+
+def image_source(image_name, external_image_url):
+    """Что считается источником фото товара: локальный файл важнее внешней ссылки (как в get_image)."""
+    return str(image_name or "") or (external_image_url or "")
+
+
+def variants_are_current(variants, image_name, external_image_url):
+    source = image_source(image_name, external_image_url)
+    return bool(source) and bool(variants) and variants.get("source") == source
+
+
+def build_variants(source, payload):
+    """Пересобирает варианты из байтов оригинала и возвращает значение для Product.image_variants."""
+    with Image.open(io.BytesIO(payload)) as opened:
+        opened.load()
+        original = ImageOps.exif_transpose(opened)
+    prefix = f"product-variants/{hashlib.sha256(source.encode('utf-8')).hexdigest()[:24]}"
+    result = {"source": source}
+    built_widths = []
+    for width in variant_widths():
+        target_width = min(width, original.width)
+        if target_width in built_widths:
+            continue
+        built_widths.append(target_width)
+        height = max(1, round(original.height * target_width / original.width))
+        resized = original.resize((target_width, height), Image.LANCZOS) if target_width != original.width else original
+        for key, pil_format, extension in VARIANT_FORMATS:
+            image = resized
+            if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+                # У JPEG нет прозрачности — подкладываем белый фон, как у карточек на сайте.
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                rgba = image.convert("RGBA")
+                background.paste(rgba, mask=rgba.getchannel("A"))
+                image = background
+            elif pil_format == "WEBP" and image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "A" in image.getbands() or image.mode == "P" else "RGB")
+            buffer = io.BytesIO()
+            if pil_format == "JPEG":
+                image.save(buffer, pil_format, quality=82, optimize=True, progressive=True)
+            else:
+                image.save(buffer, pil_format, quality=80, method=4)
+            name = f"{prefix}/{target_width}.{extension}"
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            result.setdefault(key, {})[str(target_width)] = default_storage.save(name, ContentFile(buffer.getvalue()))
+    return result
+
+
+def delete_superseded_variants(previous, source, product_id):
+    """Удаляет файлы вариантов прежнего источника фото (каталог product-variants/<старый хэш>/)."""
+    previous_source = (previous or {}).get("source") or ""
+    if not previous_source or previous_source == source:
+        return
+    # Та же картинка может быть у другого товара (одна ссылка МойСклад) — тогда файлы ещё нужны.
+    if Product.objects.filter(image_variants__source=previous_source).exclude(id=product_id).exists():
+        return
+    delete_variant_files(previous)
+
+
+def delete_variant_files(variants):
+    """Удаляет файлы вариантов из значения image_variants и опустевший каталог хэша. В БД не ходит."""
+    directories = set()
+    for key, _pil_format, _extension in VARIANT_FORMATS:
+        for name in ((variants or {}).get(key) or {}).values():
+            try:
+                default_storage.delete(name)
+            except OSError:
+                logger.warning("Не удалось удалить вариант фото %s", name, exc_info=True)
+            directories.add(os.path.dirname(name))
+    for directory in directories:
+        try:
+            # Только локальное хранилище: пустой каталог хэша остаётся после удаления файлов.
+            os.rmdir(default_storage.path(directory))
+        except (NotImplementedError, OSError):
+            pass
+
+
+def _load_source_bytes(product, client=None):
+    """Байты оригинала: локальный файл, дисковый кэш прокси или загрузка из МойСклад."""
+    if product.image:
+        with default_storage.open(product.image.name, "rb") as image_file:
+            return image_file.read()
+    url = product.external_image_url
+    if not url:
+        return None
+    cached = image_cache.get(url)
+    if cached is None:
+        with image_cache.fill_lock(url):
+            cached = image_cache.get(url)
+            if cached is None:
+                from .moysklad import MoySkladClient
+
+                payload, content_type = (client or MoySkladClient()).download_binary(url)
+                image_cache.put(url, payload, content_type)
+                return payload
+    with cached[0] as cached_file:
+        return cached_file.read()
+
+
+def ensure_product_variants(product_id, payload=None, force=False, client=None, bump_generation=True):
+    """
+    Строит варианты для товара, если их нет или источник сменился.
+    payload — уже скачанный оригинал (прокси), иначе читается из хранилища/кэша/МойСклад.
+    bump_generation=False — не сбрасывать кэш каталога (массовая сборка сбрасывает его один раз в конце).
+    Возвращает True, если варианты пересобраны.
+    """
+    if not is_enabled():
+        return False
+    product = Product.objects.filter(id=product_id).only("id", "image", "external_image_url", "image_variants").first()
+    if product is None:
+        return False
+    image_name = product.image.name if product.image else ""
+    source = image_source(image_name, product.external_image_url)
+    if not source:
+        return False
+    if not force and variants_are_current(product.image_variants, image_name, product.external_image_url):
+        return False
+    if payload is None:
+        payload = _load_source_bytes(product, client=client)
+    if not payload:
+        return False
+    variants = build_variants(source, payload)
+    Product.objects.filter(id=product_id).update(image_variants=variants)
+    delete_superseded_variants(product.image_variants, source, product_id)
+    if bump_generation:
+        # srcset попадает в закэшированные ответы каталога.
+        bump_catalog_generation()
+    return True
+
+
+def _background_executor():
+    global _executor
+    with _background_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix="image-variants")
+        return _executor
+
+
+def ensure_product_variants_in_background(product_id, payload=None):
+    """
+    Для прокси фото и сохранения товара: ответ не ждёт ресайза. payload — уже скачанный оригинал, если есть.
+    Сборки идут в общем пуле из BACKGROUND_WORKERS потоков; товар, который уже в очереди,
+    и запросы сверх BACKGROUND_MAX_PENDING пропускаются — варианты достроит следующий промах или команда.
+    """
+    if not is_enabled():
+        return
+    with _background_lock:
+        if product_id in _background_pending or len(_background_pending) >= BACKGROUND_MAX_PENDING:
+            return
+        _background_pending.add(product_id)
+
+    def worker():
+        try:
+            ensure_product_variants(product_id, payload=payload)
+        except Exception:
+            logger.warning("Не удалось построить варианты фото товара %s", product_id, exc_info=True)
+        finally:
+            with _background_lock:
+                _background_pending.discard(product_id)
+            connection.close()
+
+    try:
+        _background_executor().submit(worker)
+    except RuntimeError:
+        # Пул остановлен (завершение процесса).
+        with _background_lock:
+            _background_pending.discard(product_id)
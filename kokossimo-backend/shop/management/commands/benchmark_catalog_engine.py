@@ -0,0 +1,189 @@
+"""
+Паритет и скорость колоночного снимка каталога (shop/catalog_engine.py) против SQL-пути ProductViewSet.
+Запуск: python manage.py benchmark_catalog_engine [--iterations 50] [--synthetic 5000]
+
+Для набора фильтров (подкатегории, родители, флаги, цена, сортировки) сравниваются порядок id,
+price-range и фасеты; затем замеряется время ответа на эти запросы из снимка и из БД.
+--synthetic N создаёт N временных товаров внутри транзакции и откатывает её в конце.
+"""
+import random
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, Min
+
+from shop.catalog_cache import bump_catalog_generation
+from shop.catalog_engine import CatalogEngine, np
+from shop.facets import build_facets, price_bucket_bounds
+from shop.models import Category, Product, ProductSubcategory
+from shop.views import ProductViewSet
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _filters(**overrides):
+    filters = {
+        "subcategory_codes": [],
+        "parent_codes": [],
+        "category_slugs": [],
+        "price_min": None,
+        "price_max": None,
+        "search_q": "",
+        "ordering": "",
+        "is_new": False,
+        "is_bestseller": False,
+        "in_stock": False,
+    }
+    filters.update(overrides)
+    return filters
+
+
+def _price(value):
+    return None if value is None else f"{value:.2f}"
+
+
+class Command(BaseCommand):
+    help = "Сравнивает ответы колоночного снимка каталога с SQL-путём (паритет и скорость)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=50, help="Повторов каждого замера (по умолчанию 50)")
+        parser.add_argument(
+            "--synthetic",
+            type=int,
+            default=0,
+            help="Создать N временных товаров (транзакция откатывается после замеров)",
+        )
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError("NumPy не установлен — снимок каталога недоступен.")
+        iterations = max(1, options["iterations"])
+        synthetic = max(0, options["synthetic"])
+        try:
+            with transaction.atomic():
+                if synthetic:
+                    self._create_synthetic(synthetic)
+                self._run(iterations)
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+    def _create_synthetic(self, count):
+        slug = (
+            getattr(settings, "MOYSKLAD_SITE_CATEGORY_SLUG", "site-kokossimo")
+            if getattr(settings, "MOYSKLAD_SITE_SYNC_ENABLED", False)
+            else "benchmark-tmp"
+        )
+        category, _ = Category.objects.get_or_create(slug=slug, defaults={"name": "benchmark"})
+        subcategories = [
+            ProductSubcategory.objects.get_or_create(
+                code=f"bench.{parent}.{index}",
+                defaults={"name": f"bench {parent}.{index}", "parent_code": f"bench.{parent}"},
+            )[0]
+            for parent in range(3)
+            for index in range(4)
+        ]
+        rng = random.Random(42)
+        Product.objects.bulk_create(
+            [
+                Product(
+                    category=category,
+                    moysklad_id=f"bench-{index}",
+                    name=f"Тестовый товар {index}",
+                    price=Decimal(rng.randint(5000, 1500000)) / 100,
+                    stock=rng.choice((0, 0, 1, 3, 10)),
+                    is_new=rng.random() < 0.2,
+                    is_bestseller=rng.random() < 0.1,
+                    product_subcategory=rng.choice(subcategories + [None]),
+                )
+                for index in range(count)
+            ],
+            batch_size=1000,
+        )
+
+    def _cases(self):
+        codes = list(
+            ProductSubcategory.objects.exclude(code="").order_by("code").values_list("code", flat=True)[:3]
+        )
+        parents = sorted({code.rsplit(".", 1)[0] for code in codes if "." in code})[:2]
+        cases = [
+            _filters(),
+            _filters(in_stock=True),
+            _filters(is_new=True, ordering="price"),
+            _filters(is_bestseller=True, ordering="-price"),
+            _filters(price_min=Decimal("500"), price_max=Decimal("3000"), ordering="-created_at"),
+            _filters(in_stock=True, price_min=Decimal("1000.5"), ordering="price,-id"),
+        ]
+        if codes:
+            cases.append(_filters(subcategory_codes=codes[:2], in_stock=True))
+        if parents:
+            cases.append(_filters(parent_codes=parents, ordering="-is_new,price"))
+        return cases
+
+    def _sql(self, view, filters):
+        queryset = view._filtered_queryset(filters)
+        if filters["ordering"]:
+            # У SQL порядок при равных ключах не определён — добавляем тот же разрыв ничьих, что у снимка.
+            queryset = queryset.order_by(*queryset.query.order_by, "-id")
+        ids = list(queryset.values_list("id", flat=True))
+        agg = queryset.aggregate(min_price=Min("price"), max_price=Max("price"))
+        facets = build_facets(view._filtered_queryset(filters, facet_filters=False), filters)
+        facets["price"]["min_price"] = _price(facets["price"]["min_price"] and Decimal(facets["price"]["min_price"]))
+        facets["price"]["max_price"] = _price(facets["price"]["max_price"] and Decimal(facets["price"]["max_price"]))
+        return ids, (_price(agg["min_price"]), _price(agg["max_price"])), facets
+
+    def _run(self, iterations):
+        bump_catalog_generation()
+        view = ProductViewSet()
+        started = time.perf_counter()
+        engine = CatalogEngine.from_db()
+        build_ms = (time.perf_counter() - started) * 1000
+        if not len(engine):
+            raise CommandError("В каталоге нет товаров — запустите синк или используйте --synthetic N.")
+        self.stdout.write(f"Снимок: {len(engine)} товаров, сборка {build_ms:.1f} мс")
+
+        bounds = price_bucket_bounds()
+        cases = self._cases()
+        for filters in cases:
+            ids, price_range, facets = self._sql(view, filters)
+            if engine.ordered_ids(filters) != ids:
+                raise CommandError(f"Паритет нарушен (порядок id): {filters}")
+            if engine.price_range(filters) != price_range:
+                raise CommandError(f"Паритет нарушен (price-range): {filters}")
+            if engine.facets(filters, None, bounds) != facets:
+                raise CommandError(f"Паритет нарушен (фасеты): {filters}")
+        self.stdout.write(self.style.SUCCESS(f"Паритет OK: {len(cases)} наборов фильтров"))
+
+        def sql_all():
+            for filters in cases:
+                queryset = view._filtered_queryset(filters)
+                list(queryset.values_list("id", flat=True)[:30])
+                queryset.count()
+                queryset.aggregate(min_price=Min("price"), max_price=Max("price"))
+                build_facets(view._filtered_queryset(filters, facet_filters=False), filters)
+
+        def engine_all():
+            for filters in cases:
+                engine.ordered_ids(filters)[:30]
+                engine.price_range(filters)
+                engine.facets(filters, None, bounds)
+
+        sql_ms = self._measure(sql_all, iterations) / len(cases)
+        engine_ms = self._measure(engine_all, iterations) / len(cases)
+        self.stdout.write(
+            f"страница + count + price-range + фасеты на набор фильтров: SQL {sql_ms:.2f} мс, "
+            f"снимок {engine_ms:.2f} мс (x{sql_ms / engine_ms if engine_ms else 0:.1f})"
+        )
+
+    @staticmethod
+    def _measure(func, iterations):
+        func()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        return (time.perf_counter() - started) * 1000 / iterations
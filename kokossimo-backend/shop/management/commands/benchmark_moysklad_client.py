@@ -0,0 +1,146 @@
+"""
+Бенчмарк HTTP-клиента МойСклад: скорость sync_product_stocks без keep-alive и с пулом соединений.
+Запуск: python manage.py benchmark_moysklad_client [--products 300] [--handshake-ms 0] [--batch-size 1]
+
+Поднимается локальный сервер-заглушка API МойСклад (HTTP/1.1, gzip-ответы как у /entity/assortment),
+клиент направляется на него через MOYSKLAD_API_BASE_URL, и sync_product_stocks дважды проходит по
+--products временным товарам: с MOYSKLAD_HTTP_POOL_SIZE=0 (новое соединение на запрос) и с пулом.
+--handshake-ms добавляет задержку на каждое новое соединение — так имитируется TCP+TLS до api.moysklad.ru.
+--batch-size задаёт MOYSKLAD_STOCK_BATCH_SIZE (1 — по запросу на товар; 100 — как в рабочем синке).
+Товары создаются в транзакции, которая откатывается в конце.
+"""
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from shop.models import Category, Product
+from shop.moysklad import close_http_pool, http_pool_stats
+from shop.moysklad_sync import sync_product_stocks
+
+
+class _Rollback(Exception):
+    pass
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Заголовки и тело уходят отдельными write — без TCP_NODELAY keep-alive упирается в задержку ACK.
+    disable_nagle_algorithm = True
+    handshake_seconds = 0.0
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with self.lock:
+            type(self).connections += 1
+        if self.handshake_seconds:
+            time.sleep(self.handshake_seconds)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        external_ids = [part.split("=", 1)[-1] for part in (query.get("filter") or [""])[0].split(";") if part]
+        rows = [
+            {"id": external_id, "name": f"Товар {external_id}", "stock": 7, "salePrices": [{"value": 10000}]}
+            for external_id in external_ids
+        ]
+        body = gzip.compress(json.dumps({"meta": {"size": len(rows)}, "rows": rows}).encode("utf-8"))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json;charset=utf-8")
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Command(BaseCommand):
+    help = "Сравнивает скорость sync_product_stocks с keep-alive пулом и без него на локальной заглушке МойСклад."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=300, help="Временных товаров (по умолчанию 300)")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1,
+            help="MOYSKLAD_STOCK_BATCH_SIZE на время замера (по умолчанию 1 — запрос на товар, как меряется транспорт)",
+        )
+        parser.add_argument(
+            "--handshake-ms",
+            type=float,
+            default=0,
+            help="Задержка на новое соединение, имитация TCP+TLS (по умолчанию 0)",
+        )
+
+    def handle(self, *args, **options):
+        _StandInHandler.handshake_seconds = max(0.0, options["handshake_ms"]) / 1000
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}/api/remap/1.2"
+        self.stdout.write(f"Заглушка МойСклад: {base_url}, товаров: {options['products']}")
+        try:
+            with transaction.atomic():
+                self._create_products(max(1, options["products"]))
+                self.batch_size = max(1, options["batch_size"])
+                results = [
+                    self._run("без keep-alive (MOYSKLAD_HTTP_POOL_SIZE=0)", base_url, 0),
+                    self._run("пул keep-alive", base_url, max(1, int(getattr(settings, "MOYSKLAD_HTTP_POOL_SIZE", 8)))),
+                ]
+                raise _Rollback()
+        except _Rollback:
+            pass
+        finally:
+            server.shutdown()
+            server.server_close()
+            close_http_pool(reset_stats=True)
+
+        baseline, pooled = results
+        speedup = pooled / baseline if baseline else 0
+        self.stdout.write(self.style.SUCCESS(f"Ускорение с пулом: x{speedup:.2f}"))
+
+    def _create_products(self, count):
+        slug = getattr(settings, "MOYSKLAD_SITE_CATEGORY_SLUG", "site-kokossimo")
+        category, _ = Category.objects.get_or_create(slug=slug, defaults={"name": "benchmark"})
+        Product.objects.bulk_create(
+            [
+                Product(category=category, name=f"Бенчмарк {index}", price=100, stock=0, moysklad_id=f"bench-{index}")
+                for index in range(count)
+            ]
+        )
+
+    def _run(self, label, base_url, pool_size):
+        close_http_pool(reset_stats=True)
+        _StandInHandler.connections = 0
+        overrides = {
+            "MOYSKLAD_API_BASE_URL": base_url,
+            "MOYSKLAD_TOKEN": "benchmark",
+            "MOYSKLAD_HTTP_POOL_SIZE": pool_size,
+            "MOYSKLAD_MAX_RETRIES": 0,
+            # У заглушки нет лимитов МойСклад — меряем сам транспорт, без ограничителя частоты.
+            "MOYSKLAD_RATE_LIMIT_REQUESTS": 0,
+            "CATALOG_EXPORT_ENABLED": False,
+            "MOYSKLAD_STOCK_BATCH_SIZE": self.batch_size,
+        }
+        with override_settings(**overrides):
+            started = time.monotonic()
+            result = sync_product_stocks(sync_source="benchmark")
+            elapsed = time.monotonic() - started
+        rate = result["requests"] / elapsed if elapsed else 0
+        self.stdout.write(
+            f"{label}: {result['processed']} товаров, {result['requests']} запросов за {elapsed:.2f} с — "
+            f"{rate:.1f} запросов/с, ошибок {result['errors']}, новых соединений на сервере {_StandInHandler.connections}"
+        )
+        if pool_size:
+            self.stdout.write(f"  пул: {http_pool_stats()}")
+        return rate
@@ -0,0 +1,123 @@
+"""
+Бенчмарк сериализации страницы каталога: DRF ProductSerializer против быстрого пути
+shop/fast_serializers.py + FastJSONRenderer.
+Запуск: python manage.py benchmark_product_serialization [--page-size 60] [--iterations 50] [--synthetic 200]
+
+Сначала проверяется паритет (одинаковый JSON для карточки списка и полного набора полей),
+затем замеряется время «сериализация + рендер JSON» и «запрос к БД + сериализация + рендер».
+--synthetic N создаёт N временных товаров внутри транзакции и откатывает её в конце.
+"""
+import json
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+
+from shop.fast_serializers import ProductRowSerializer
+from shop.models import Category, Product
+from shop.renderers import FastJSONRenderer, orjson
+from shop.serializers import ProductCardSerializer, ProductSerializer
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Сравнивает DRF-сериализацию страницы каталога с быстрым путём (паритет и скорость)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--page-size", type=int, default=60, help="Товаров на странице (по умолчанию 60)")
+        parser.add_argument("--iterations", type=int, default=50, help="Повторов каждого замера (по умолчанию 50)")
+        parser.add_argument(
+            "--synthetic",
+            type=int,
+            default=0,
+            help="Создать N временных товаров (транзакция откатывается после замеров)",
+        )
+
+    def handle(self, *args, **options):
+        page_size = max(1, options["page_size"])
+        iterations = max(1, options["iterations"])
+        synthetic = max(0, options["synthetic"])
+        try:
+            with transaction.atomic():
+                if synthetic:
+                    self._create_synthetic(synthetic)
+                self._run(page_size, iterations)
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+    def _create_synthetic(self, count):
+        category, _ = Category.objects.get_or_create(slug="benchmark-tmp", defaults={"name": "benchmark"})
+        Product.objects.bulk_create(
+            [
+                Product(
+                    category=category,
+                    name=f"Тестовый товар {index}",
+                    description="Описание товара для бенчмарка. " * 20,
+                    composition="Состав. " * 30,
+                    price=Decimal("100.00") + index,
+                    stock=index % 7,
+                    external_image_url=f"https://example.com/{index}.jpg" if index % 2 else None,
+                    rating_avg=4.5 if index % 3 else None,
+                    rating_count=index % 11,
+                    rating_histogram=[0, 0, 1, 2, index % 11 - 3] if index % 11 > 3 else [0, 0, 0, 0, index % 11],
+                )
+                for index in range(count)
+            ]
+        )
+
+    def _run(self, page_size, iterations):
+        request = RequestFactory().get("/api/products/", HTTP_HOST="localhost")
+        request.user = AnonymousUser()
+        queryset = Product.objects.select_related("category", "product_subcategory").order_by("-created_at", "-id")
+        if not queryset.exists():
+            raise CommandError("В БД нет товаров — запустите синк или используйте --synthetic N.")
+
+        self.stdout.write(f"JSON-рендерер быстрого пути: {'orjson' if orjson else 'стандартный (orjson не установлен)'}")
+        for label, serializer_class in (("карточка списка", ProductCardSerializer), ("полный набор", ProductSerializer)):
+            fields = list(serializer_class.Meta.fields)
+            row_serializer = ProductRowSerializer(fields, request)
+
+            def drf_serialize(objects):
+                return JSONRenderer().render(serializer_class(objects, many=True, context={"request": request}).data)
+
+            def fast_serialize(rows):
+                return FastJSONRenderer().render(row_serializer.serialize(rows))
+
+            objects = list(queryset[:page_size])
+            rows = list(row_serializer.values(queryset)[:page_size])
+            drf_body = drf_serialize(objects)
+            fast_body = fast_serialize(rows)
+            if json.loads(drf_body) != json.loads(fast_body):
+                raise CommandError(f"Паритет нарушен ({label}): ответы DRF и быстрого пути различаются.")
+
+            drf_ms = self._measure(lambda: drf_serialize(objects), iterations)
+            fast_ms = self._measure(lambda: fast_serialize(rows), iterations)
+            drf_full_ms = self._measure(lambda: drf_serialize(list(queryset[:page_size])), iterations)
+            fast_full_ms = self._measure(lambda: fast_serialize(row_serializer.values(queryset)[:page_size]), iterations)
+
+            self.stdout.write(self.style.SUCCESS(f"\n[{label}] паритет OK, товаров на странице: {len(objects)}"))
+            self.stdout.write(
+                f"  сериализация + JSON: DRF {drf_ms:.2f} мс, быстрый путь {fast_ms:.2f} мс "
+                f"(x{drf_ms / fast_ms if fast_ms else 0:.1f})"
+            )
+            self.stdout.write(
+                f"  с запросом к БД:     DRF {drf_full_ms:.2f} мс, быстрый путь {fast_full_ms:.2f} мс "
+                f"(x{drf_full_ms / fast_full_ms if fast_full_ms else 0:.1f})"
+            )
+            self.stdout.write(f"  размер ответа: {len(fast_body)} байт")
+
+    @staticmethod
+    def _measure(func, iterations):
+        func()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        return (time.perf_counter() - started) * 1000 / iterations
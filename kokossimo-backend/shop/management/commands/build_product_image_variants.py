@@ -0,0 +1,90 @@
+"""
+Досборка уменьшенных WebP/JPEG-вариантов фото для всего каталога (shop/image_variants.py).
+Запуск: python manage.py build_product_image_variants [--workers 4] [--force] [--limit N]
+
+Обрабатываются товары с Product.image или external_image_url, у которых вариантов нет
+или источник фото сменился (--force — пересобрать все). Загрузка из МойСклад и ресайз идут
+в пуле потоков; после завершения сбрасывается кэш ответов каталога, чтобы появился image_srcset.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+
+from shop.catalog_cache import bump_catalog_generation
+from shop.image_variants import ensure_product_variants, is_enabled, variants_are_current
+from shop.models import Product
+from shop.moysklad import MoySkladClient, MoySkladConfigError
+
+
+class Command(BaseCommand):
+    help = "Строит уменьшенные WebP/JPEG-варианты фото товаров для srcset (параллельно)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Потоков загрузки и ресайза (по умолчанию 4)")
+        parser.add_argument("--force", action="store_true", help="Пересобрать варианты даже если они актуальны")
+        parser.add_argument("--limit", type=int, default=0, help="Обработать не больше N товаров")
+
+    def handle(self, *args, **options):
+        if not is_enabled():
+            raise CommandError("Варианты выключены (PRODUCT_IMAGE_VARIANT_WIDTHS пуст) или не установлен Pillow.")
+        force = options["force"]
+        rows = (
+            Product.objects.filter(Q(image__gt="") | Q(external_image_url__gt=""))
+            .values_list("id", "image", "external_image_url", "image_variants")
+            .order_by("id")
+        )
+        product_ids = [
+            product_id
+            for product_id, image_name, external_image_url, variants in rows
+            if force or not variants_are_current(variants, image_name, external_image_url)
+        ]
+        if options["limit"] > 0:
+            product_ids = product_ids[: options["limit"]]
+        if not product_ids:
+            self.stdout.write(self.style.SUCCESS("Все варианты фото актуальны."))
+            return
+
+        workers = max(1, options["workers"])
+        self.stdout.write(f"К обработке товаров: {len(product_ids)}, потоков: {workers}")
+        local = threading.local()
+
+        def build(product_id):
+            try:
+                if not hasattr(local, "client"):
+                    try:
+                        local.client = MoySkladClient()
+                    except MoySkladConfigError:
+                        local.client = None
+                return ensure_product_variants(product_id, force=force, client=local.client, bump_generation=False)
+            finally:
+                connection.close()
+
+        built = failed = skipped = 0
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(build, product_id): product_id for product_id in product_ids}
+            for index, future in enumerate(as_completed(futures), start=1):
+                try:
+                    if future.result():
+                        built += 1
+                    else:
+                        skipped += 1
+                except Exception as exc:
+                    failed += 1
+                    self.stdout.write(self.style.WARNING(f"  товар {futures[future]}: {str(exc)[:120]}"))
+                if index % 50 == 0:
+                    self.stdout.write(f"  обработано {index}/{len(product_ids)}")
+
+        if built:
+            bump_catalog_generation()
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Готово за {elapsed:.1f} с: построено {built}, пропущено {skipped}, ошибок {failed} "
+                f"({len(product_ids) / elapsed if elapsed else 0:.1f} товаров/с)."
+            )
+        )
@@ -2,12 +2,70 @@
 Диагностика загрузки изображений товаров из МойСклад.
 Запуск: python manage.py check_product_image [product_id]
 Если product_id не указан — проверяется первый товар с moysklad_id.
+
+Аудит всего каталога: python manage.py check_product_image --all [--workers 8] [--format csv|json]
+[--output путь] [--prewarm] [--limit N]
+Скачивает фото всех товаров с moysklad_id или external_image_url в пуле потоков, пишет отчёт
+(статус, класс ошибки, задержка, Content-Type, байты, число HTTP-запросов) и сводку p50/p95 —
+по ней подбираются IMAGE_PROXY_CACHE_MAX_BYTES и MOYSKLAD_TIMEOUT_SECONDS. --prewarm кладёт
+скачанные картинки в дисковый кэш прокси.
 """
-from django.core.management.base import BaseCommand
+import csv
+import json
+import math
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
 
+from shop import image_cache
 from shop.models import Product
 from shop.moysklad import MoySkladClient, MoySkladError, MoySkladConfigError
 
+REPORT_FIELDS = [
+    "product_id",
+    "name",
+    "source",
+    "status",
+    "failure_class",
+    "latency_ms",
+    "content_type",
+    "bytes",
+    "attempts",
+    "strategy",
+    "url",
+    "error",
+]
+
+
+def _failure_class(message):
+    """Класс ошибки для сводки: http_<код>, network, timeout, bad_content_type или error."""
+    text = str(message or "")
+    match = re.search(r"HTTP (\d{3})", text)
+    if match:
+        return "bad_content_type" if "content-type" in text else f"http_{match.group(1)}"
+    lowered = text.lower()
+    if "timed out" in lowered or "timeout" in lowered:
+        return "timeout"
+    if "сети" in lowered:
+        return "network"
+    return "error"
+
+
+def _percentile(values, fraction):
+    """Перцентиль по ближайшему рангу (values отсортированы)."""
+    if not values:
+        return 0
+    index = max(0, min(len(values) - 1, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
 
 class Command(BaseCommand):
     help = "Проверяет, почему не загружается изображение товара из МойСклад (пошаговая диагностика)."
@@ -19,8 +77,16 @@ class Command(BaseCommand):
             type=int,
             help="ID товара в вашей БД (если не указан — первый товар с moysklad_id)",
         )
+        parser.add_argument("--all", action="store_true", help="Проверить фото всех товаров с moysklad_id или external_image_url")
+        parser.add_argument("--workers", type=int, default=8, help="Потоков загрузки в режиме --all (по умолчанию 8)")
+        parser.add_argument("--format", choices=("csv", "json"), default="csv", help="Формат отчёта --all (по умолчанию csv)")
+        parser.add_argument("--output", default="", help="Файл отчёта --all (по умолчанию analytics/product_images_<время>.<формат>)")
+        parser.add_argument("--prewarm", action="store_true", help="Положить скачанные картинки в дисковый кэш прокси")
+        parser.add_argument("--limit", type=int, default=0, help="Проверить не больше N товаров")
 
     def handle(self, *args, **options):
+        if options["all"]:
+            return self._audit_all(options)
         product_id = options.get("product_id")
         if product_id:
             product = Product.objects.filter(id=product_id).first()
@@ -153,12 +219,147 @@ class Command(BaseCommand):
             try:
                 payload, content_type = client.download_binary(url)
                 self.stdout.write(self.style.SUCCESS(f"   Успех ({kind}): {len(payload)} байт, Content-Type: {content_type}"))
+                self.stdout.write(
+                    f"   HTTP-запросов: {client.last_download_attempts}, стратегия: {client.last_download_strategy}"
+                )
                 self.stdout.write("   Итог: изображение можно загрузить. Если на сайте всё ещё показывается плейсхолдер — проверьте логи runserver при запросе /api/products/<id>/image/.\n")
                 return
             except MoySkladError as e:
-                self.stdout.write(self.style.ERROR(f"   Ошибка ({kind}): {e}"))
+                self.stdout.write(self.style.ERROR(f"   Ошибка ({kind}, HTTP-запросов: {client.last_download_attempts}): {e}"))
 
         self.stdout.write("")
         self.stdout.write(self.style.ERROR("   Все кандидаты не удалось скачать."))
         self.stdout.write("   Возможные причины: блокировка порта 8080, истёкшая подпись URL, сетевая ошибка до хранилища МойСклад.")
         self.stdout.write("   Проверьте с сервера: доступ к api.moysklad.ru и к домену хранилища (storage.*), файрвол.\n")
+
+    def _audit_all(self, options):
+        rows = list(
+            Product.objects.filter(
+                (Q(moysklad_id__isnull=False) & ~Q(moysklad_id="")) | Q(external_image_url__gt="")
+            )
+            .order_by("id")
+            .values_list("id", "name", "image", "external_image_url")
+        )
+        if options["limit"] > 0:
+            rows = rows[: options["limit"]]
+        if not rows:
+            raise CommandError("Нет товаров с moysklad_id или external_image_url.")
+        try:
+            MoySkladClient()
+        except MoySkladConfigError as exc:
+            raise CommandError(str(exc))
+
+        workers = max(1, options["workers"])
+        prewarm = options["prewarm"]
+        local = threading.local()
+        self.stdout.write(f"К проверке товаров: {len(rows)}, потоков: {workers}{', с прогревом кэша' if prewarm else ''}")
+
+        def check(row):
+            product_id, name, image_name, url = row
+            record = {field: "" for field in REPORT_FIELDS}
+            record.update({"product_id": product_id, "name": name, "url": url or "", "bytes": 0, "attempts": 0})
+            if image_name:
+                # Локальное фото отдаёт nginx — проверяем только наличие файла.
+                record["source"] = "local"
+                try:
+                    record["bytes"] = default_storage.size(image_name)
+                    record["status"] = "ok"
+                except OSError as exc:
+                    record.update(status="error", failure_class="local_missing", error=str(exc)[:200])
+                return record
+            if not url:
+                record.update(source="none", status="no_image", failure_class="no_external_image_url")
+                return record
+            record["source"] = "moysklad"
+            if not hasattr(local, "client"):
+                local.client = MoySkladClient()
+            started = time.monotonic()
+            try:
+                payload, content_type = local.client.download_binary(url)
+            except MoySkladError as exc:
+                record.update(status="error", failure_class=_failure_class(exc), error=str(exc)[:200])
+            else:
+                record.update(status="ok", content_type=content_type, bytes=len(payload))
+                if prewarm:
+                    image_cache.put(url, payload, content_type)
+                    image_cache.discard_negative(product_id)
+            record["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+            record["attempts"] = local.client.last_download_attempts
+            record["strategy"] = local.client.last_download_strategy
+            return record
+
+        records = []
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(check, row) for row in rows]
+            for index, future in enumerate(as_completed(futures), start=1):
+                records.append(future.result())
+                if index % 50 == 0:
+                    self.stdout.write(f"  проверено {index}/{len(rows)}")
+        elapsed = time.monotonic() - started
+        records.sort(key=lambda record: record["product_id"])
+
+        output = self._write_report(records, options)
+        self._print_summary(records, elapsed)
+        self.stdout.write(self.style.SUCCESS(f"Отчёт: {output}"))
+
+    def _write_report(self, records, options):
+        report_format = options["format"]
+        if options["output"]:
+            output = Path(options["output"]).resolve()
+        else:
+            repo_dir = Path(__file__).resolve().parents[4]
+            ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+            output = (repo_dir / "analytics" / f"product_images_{ts}.{report_format}").resolve()
+        output.parent.mkdir(parents=True, exist_ok=True)
+        if report_format == "json":
+            with output.open("w", encoding="utf-8") as report_file:
+                json.dump({"items": records, "summary": self._summary(records)}, report_file, ensure_ascii=False, indent=2)
+        else:
+            with output.open("w", encoding="utf-8-sig", newline="") as report_file:
+                writer = csv.DictWriter(report_file, fieldnames=REPORT_FIELDS)
+                writer.writeheader()
+                writer.writerows(records)
+        return output
+
+    def _summary(self, records):
+        downloaded = [record for record in records if record["source"] == "moysklad"]
+        latencies = sorted(record["latency_ms"] for record in downloaded if record["status"] == "ok")
+        sizes = sorted(record["bytes"] for record in downloaded if record["status"] == "ok")
+        attempts = [record["attempts"] for record in downloaded]
+        return {
+            "total": len(records),
+            "statuses": dict(Counter(f"{record['source']}:{record['status']}" for record in records)),
+            "failure_classes": dict(Counter(record["failure_class"] for record in records if record["failure_class"])),
+            "latency_ms": {
+                "p50": _percentile(latencies, 0.5),
+                "p95": _percentile(latencies, 0.95),
+                "max": latencies[-1] if latencies else 0,
+            },
+            "bytes": {
+                "total": sum(sizes),
+                "p50": _percentile(sizes, 0.5),
+                "p95": _percentile(sizes, 0.95),
+            },
+            "attempts_per_image": round(sum(attempts) / len(attempts), 2) if attempts else 0,
+        }
+
+    def _print_summary(self, records, elapsed):
+        summary = self._summary(records)
+        latency = summary["latency_ms"]
+        sizes = summary["bytes"]
+        self.stdout.write(f"\nПроверено {summary['total']} товаров за {elapsed:.1f} с.")
+        for key, count in sorted(summary["statuses"].items()):
+            self.stdout.write(f"  {key}: {count}")
+        if summary["failure_classes"]:
+            self.stdout.write("Классы ошибок:")
+            for key, count in sorted(summary["failure_classes"].items(), key=lambda item: -item[1]):
+                self.stdout.write(f"  {key}: {count}")
+        self.stdout.write(
+            f"Загрузка из МойСклад: p50 {latency['p50']} мс, p95 {latency['p95']} мс, max {latency['max']} мс; "
+            f"HTTP-запросов на фото {summary['attempts_per_image']}."
+        )
+        self.stdout.write(
+            f"Размер фото: p50 {sizes['p50']} Б, p95 {sizes['p95']} Б, всего {sizes['total']} Б "
+            f"(IMAGE_PROXY_CACHE_MAX_BYTES сейчас {image_cache.max_bytes()})."
+        )
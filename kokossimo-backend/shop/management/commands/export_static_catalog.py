@@ -0,0 +1,36 @@
+"""
+Статический экспорт публичного каталога (JSON + .gz/.br + manifest.json) для раздачи nginx.
+Запуск: python manage.py export_static_catalog [--output-dir DIR] [--base-url https://api.example.ru]
+
+После синков МойСклад экспорт пишется автоматически при CATALOG_EXPORT_ENABLED=true;
+команда нужна для первого запуска, ручных правок в админке или смены CATALOG_EXPORT_BASE_URL.
+"""
+from django.core.management.base import BaseCommand
+
+from shop.catalog_export import brotli, export_static_catalog
+
+
+class Command(BaseCommand):
+    help = "Записывает статический экспорт каталога (товары, дерево подкатегорий, категории, города доставки)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output-dir", default="", help="Каталог экспорта (по умолчанию CATALOG_EXPORT_DIR)")
+        parser.add_argument(
+            "--base-url",
+            default=None,
+            help="Префикс абсолютных URL картинок (по умолчанию CATALOG_EXPORT_BASE_URL)",
+        )
+
+    def handle(self, *args, **options):
+        manifest = export_static_catalog(output_dir=options["output_dir"] or None, base_url=options["base_url"])
+        if brotli is None:
+            self.stdout.write(self.style.WARNING("brotli не установлен — варианты .br не записаны."))
+        for key, entry in manifest["files"].items():
+            sizes = f"{entry['size']} байт, gzip {entry['gzip_size']}"
+            if entry.get("brotli_size"):
+                sizes += f", brotli {entry['brotli_size']}"
+            status = "обновлён" if entry["changed"] else "без изменений"
+            self.stdout.write(f"  {entry['path']}: {sizes} ({status})")
+        self.stdout.write(
+            self.style.SUCCESS(f"Готово: товаров {manifest['files']['products']['count']}, поколение {manifest['generation']}.")
+        )
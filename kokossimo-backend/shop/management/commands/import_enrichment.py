@@ -12,6 +12,7 @@ import json
 from django.core.management.base import BaseCommand
 
 from shop.models import Product, ProductSubcategory
+from shop.search import refresh_search_index
 
 
 class Command(BaseCommand):
@@ -57,6 +58,7 @@ class Command(BaseCommand):
 
         updated = 0
         skipped = 0
+        updated_ids = []
         for row in rows:
             moysklad_id = row.get("moysklad_id")
             if not moysklad_id:
@@ -80,10 +82,14 @@ class Command(BaseCommand):
 
             if update_fields and not dry_run:
                 product.save(update_fields=update_fields)
+                updated_ids.append(product.id)
                 updated += 1
             elif update_fields:
                 updated += 1
 
+        if updated_ids:
+            refresh_search_index(updated_ids)
+
         if dry_run:
             self.stdout.write(
                 self.style.SUCCESS(f"Dry-run: было бы обновлено {updated} товаров, пропущено {skipped}.")
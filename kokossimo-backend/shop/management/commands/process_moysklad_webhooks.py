@@ -0,0 +1,41 @@
+"""
+Обработчик очереди вебхуков МойСклад (shop/moysklad_webhooks.py).
+Запуск: python manage.py process_moysklad_webhooks [--loop] [--interval 2]
+
+Без --loop обрабатывает готовые строки очереди один раз (для cron); с --loop работает постоянно —
+для отдельного процесса при MOYSKLAD_WEBHOOK_PROCESS_INLINE=false. Подбирает и повторы после ошибок.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from shop.moysklad import MoySkladConfigError
+from shop.moysklad_webhooks import process_queue
+
+
+class Command(BaseCommand):
+    help = "Применяет изменения товаров и остатков из очереди вебхуков МойСклад."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="Работать постоянно, проверяя очередь каждые --interval секунд")
+        parser.add_argument("--interval", type=float, default=2, help="Пауза между проверками очереди в режиме --loop (по умолчанию 2)")
+        parser.add_argument("--limit", type=int, default=500, help="Строк очереди за проход (по умолчанию 500)")
+
+    def handle(self, *args, **options):
+        def progress(message):
+            self.stdout.write(f"[webhooks] {message}")
+
+        interval = max(0.2, options["interval"])
+        while True:
+            close_old_connections()
+            try:
+                stats = process_queue(limit=options["limit"], progress_callback=progress, sync_source="management_command")
+            except MoySkladConfigError as exc:
+                raise CommandError(str(exc))
+            if not options["loop"]:
+                if not stats["items"]:
+                    self.stdout.write("Очередь вебхуков пуста.")
+                return
+            if stats["items"] < options["limit"]:
+                time.sleep(interval)
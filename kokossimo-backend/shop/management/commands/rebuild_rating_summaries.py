@@ -0,0 +1,30 @@
+"""
+Массовый пересчёт денормализованных агрегатов оценок товаров.
+Запуск: python manage.py rebuild_rating_summaries
+
+Обычно агрегаты поддерживаются сигналами при сохранении/удалении оценки;
+команда нужна после ручных правок в БД, импорта оценок или для проверки расхождений.
+"""
+from django.core.management.base import BaseCommand
+
+from shop.ratings import rebuild_rating_summaries
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает rating_avg / rating_count / гистограмму оценок для всех товаров."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Размер пачки для bulk_update (по умолчанию 500)",
+        )
+
+    def handle(self, *args, **options):
+        stats = rebuild_rating_summaries(batch_size=max(1, options["batch_size"]))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Готово: проверено товаров {stats['checked']}, обновлено {stats['updated']}."
+            )
+        )
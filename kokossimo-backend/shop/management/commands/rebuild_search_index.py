@@ -0,0 +1,20 @@
+"""
+Полная пересборка поискового индекса товаров (PostgreSQL tsvector / SQLite FTS5).
+Запуск: python manage.py rebuild_search_index
+
+Обычно индекс обновляется синком МойСклад и сохранением товара в админке;
+команда нужна после ручных правок в БД или восстановления из бэкапа.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.search import refresh_search_index
+
+
+class Command(BaseCommand):
+    help = "Пересобирает полнотекстовый поисковый индекс товаров каталога."
+
+    def handle(self, *args, **options):
+        indexed = refresh_search_index()
+        if indexed is None:
+            raise CommandError("Поисковый индекс недоступен для текущей БД (см. миграцию 0031_product_search_index).")
+        self.stdout.write(self.style.SUCCESS(f"Готово: проиндексировано товаров {indexed}."))
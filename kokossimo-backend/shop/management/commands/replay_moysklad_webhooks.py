@@ -0,0 +1,241 @@
+"""
+Проигрывание записанных вебхуков МойСклад: проверка приёма, дедупликации и обработчика очереди.
+Запуск: python manage.py replay_moysklad_webhooks [--file payloads.json] [--url http://127.0.0.1:8000/api/integrations/moysklad/webhook/]
+
+Без --url поднимается локальная заглушка API МойСклад (/entity/assortment по filter=id=..., отчёт об остатках),
+клиент направляется на неё через MOYSKLAD_API_BASE_URL, создаются временные товары, вебхуки отправляются
+в эндпоинт тестовым клиентом Django, затем очередь обрабатывается process_queue. Всё идёт в транзакции,
+которая откатывается в конце; ключи дедупликации в кэше удаляются.
+С --url вебхуки отправляются HTTP POST на работающий сервер (секрет — --secret или MOYSKLAD_WEBHOOK_SECRET),
+API МойСклад и база не подменяются.
+
+--file — JSON-список тел вебхуков или JSONL (по телу на строку); по умолчанию — RECORDED_PAYLOADS ниже.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError, URLError
+from urllib.parse import parse_qs, urlencode, urlparse
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+
+from shop.models import Category, MoySkladWebhookItem, Product
+from shop.moysklad_webhooks import dedup_cache_key, parse_events, process_queue
+
+API = "https://api.moysklad.ru/api/remap/1.2"
+EXISTING_IDS = [f"00000000-0000-4000-8000-00000000000{index}" for index in range(1, 5)]
+NEW_ID = "00000000-0000-4000-8000-000000000009"
+
+
+def _entity_event(entity_type, entity_id, action, fields=None):
+    event = {
+        "meta": {"type": entity_type, "href": f"{API}/entity/{entity_type}/{entity_id}"},
+        "action": action,
+        "accountId": "00000000-0000-4000-8000-0000000000aa",
+    }
+    if fields:
+        event["updatedFields"] = fields
+    return event
+
+
+def _audit(audit_id):
+    return {
+        "meta": {"type": "audit", "href": f"{API}/audit/00000000-0000-4000-8000-0000000a{audit_id:04d}"},
+        "uid": "admin@kokossimo",
+        "moment": "2026-10-18 12:00:00",
+    }
+
+
+# Тела вебхуков в формате МойСклад: правка цены (с повторной доставкой), ещё одна правка того же товара,
+# правка модификации, новый товар, удаление и вебхук об остатках.
+RECORDED_PAYLOADS = [
+    {"auditContext": _audit(1), "events": [_entity_event("product", EXISTING_IDS[0], "UPDATE", ["salePrices"])]},
+    {"auditContext": _audit(1), "events": [_entity_event("product", EXISTING_IDS[0], "UPDATE", ["salePrices"])]},
+    {"auditContext": _audit(2), "events": [_entity_event("product", EXISTING_IDS[0], "UPDATE", ["description"])]},
+    {"auditContext": _audit(3), "events": [_entity_event("variant", EXISTING_IDS[1], "UPDATE", ["name"])]},
+    {"auditContext": _audit(4), "events": [_entity_event("product", NEW_ID, "CREATE")]},
+    {"auditContext": _audit(5), "events": [_entity_event("product", EXISTING_IDS[2], "DELETE")]},
+    {
+        "accountId": "00000000-0000-4000-8000-0000000000aa",
+        "stockType": "stock",
+        "reportType": "all",
+        "reportUrl": f"{API}/report/stock/all/current?changedSince=2026-10-18 11:59:00",
+    },
+]
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    category_name = ""
+    deleted_ids = set()
+    stock_ids = []
+    requests = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        type(self).requests.append(parsed.path)
+        if parsed.path.endswith("/report/stock/all/current"):
+            payload = [{"assortmentId": external_id, "stock": 42} for external_id in self.stock_ids]
+        else:
+            query = parse_qs(parsed.query)
+            external_ids = [part.split("=", 1)[-1] for part in (query.get("filter") or [""])[0].split(";") if part]
+            payload = {
+                "meta": {"size": len(external_ids)},
+                "rows": [
+                    {
+                        "id": external_id,
+                        "name": f"Товар {external_id[-4:]} (из вебхука)",
+                        "description": "Описание из МойСклад",
+                        "pathName": self.category_name,
+                        "stock": 5,
+                        "salePrices": [{"value": 123400}],
+                    }
+                    for external_id in external_ids
+                    if external_id not in self.deleted_ids
+                ],
+            }
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json;charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Отправляет записанные вебхуки МойСклад в эндпоинт и проверяет обработку очереди на локальной заглушке API."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--file", default="", help="JSON-список или JSONL с телами вебхуков (по умолчанию — встроенные)")
+        parser.add_argument("--url", default="", help="Отправить на работающий сервер вместо локальной заглушки")
+        parser.add_argument("--secret", default="", help="Секрет для --url (по умолчанию MOYSKLAD_WEBHOOK_SECRET)")
+
+    def handle(self, *args, **options):
+        payloads = self._load_payloads(options["file"]) if options["file"] else RECORDED_PAYLOADS
+        if options["url"]:
+            self._post_remote(payloads, options["url"], options["secret"] or getattr(settings, "MOYSKLAD_WEBHOOK_SECRET", ""))
+            return
+        self._replay_stand_in(payloads)
+
+    def _load_payloads(self, path):
+        try:
+            with open(path, encoding="utf-8") as payload_file:
+                text = payload_file.read().strip()
+        except OSError as exc:
+            raise CommandError(f"Не удалось прочитать {path}: {exc}")
+        try:
+            if text.startswith("["):
+                return json.loads(text)
+            return [json.loads(line) for line in text.splitlines() if line.strip()]
+        except ValueError as exc:
+            raise CommandError(f"Некорректный JSON в {path}: {exc}")
+
+    def _post_remote(self, payloads, url, secret):
+        if not secret:
+            raise CommandError("Нужен --secret или MOYSKLAD_WEBHOOK_SECRET.")
+        target = f"{url}{'&' if '?' in url else '?'}{urlencode({'secret': secret})}"
+        for index, payload in enumerate(payloads, start=1):
+            request = Request(
+                target,
+                data=json.dumps(payload).encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            started = time.monotonic()
+            try:
+                with urlopen(request, timeout=15) as response:
+                    status_code, body = response.status, response.read().decode("utf-8", "replace")
+            except HTTPError as exc:
+                status_code, body = exc.code, exc.read().decode("utf-8", "replace")
+            except URLError as exc:
+                raise CommandError(f"Сервер недоступен: {exc.reason}")
+            elapsed_ms = (time.monotonic() - started) * 1000
+            self.stdout.write(f"#{index}: HTTP {status_code} за {elapsed_ms:.0f} мс — {body[:200]}")
+
+    def _replay_stand_in(self, payloads):
+        category_name = getattr(settings, "MOYSKLAD_SITE_CATEGORY_NAME", "САЙТ КОКОССИМО")
+        _StandInHandler.category_name = category_name
+        _StandInHandler.deleted_ids = {
+            event["key"] for payload in payloads for event in parse_events(payload) if event["action"] == "DELETE"
+        }
+        _StandInHandler.stock_ids = list(EXISTING_IDS)
+        _StandInHandler.requests = []
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}/api/remap/1.2"
+        self.stdout.write(f"Заглушка МойСклад: {base_url}, вебхуков: {len(payloads)}")
+        overrides = {
+            "MOYSKLAD_API_BASE_URL": base_url,
+            "MOYSKLAD_TOKEN": "replay",
+            "MOYSKLAD_MAX_RETRIES": 0,
+            "MOYSKLAD_RATE_LIMIT_REQUESTS": 0,
+            "MOYSKLAD_IMAGE_META_FETCH": False,
+            "MOYSKLAD_SYNC_SAVE_LOCAL_IMAGES": False,
+            "MOYSKLAD_WEBHOOK_SECRET": "replay-secret",
+            "MOYSKLAD_WEBHOOK_PROCESS_INLINE": False,
+            "CATALOG_EXPORT_ENABLED": False,
+            "ALLOWED_HOSTS": [*settings.ALLOWED_HOSTS, "testserver"],
+        }
+        try:
+            with override_settings(**overrides), transaction.atomic():
+                self._create_products(category_name)
+                client = Client()
+                for index, payload in enumerate(payloads, start=1):
+                    started = time.monotonic()
+                    response = client.post(
+                        "/api/integrations/moysklad/webhook/?secret=replay-secret",
+                        data=json.dumps(payload),
+                        content_type="application/json",
+                    )
+                    elapsed_ms = (time.monotonic() - started) * 1000
+                    self.stdout.write(f"#{index}: HTTP {response.status_code} за {elapsed_ms:.1f} мс — {response.content.decode()[:200]}")
+                rejected = client.post(
+                    "/api/integrations/moysklad/webhook/?secret=wrong",
+                    data=json.dumps(payloads[0] if payloads else {}),
+                    content_type="application/json",
+                )
+                self.stdout.write(f"Неверный секрет: HTTP {rejected.status_code}")
+                self.stdout.write(f"В очереди строк: {MoySkladWebhookItem.objects.count()}")
+
+                stats = process_queue(debounce_seconds=0, progress_callback=self.stdout.write, sync_source="replay")
+                self.stdout.write(f"Статистика: {stats}")
+                self.stdout.write(f"Запросы к заглушке: {_StandInHandler.requests}")
+                for product in Product.objects.filter(moysklad_id__in=[*EXISTING_IDS, NEW_ID]).order_by("moysklad_id"):
+                    self.stdout.write(f"  {product.moysklad_id}: {product.name}, цена {product.price}, остаток {product.stock}")
+                self.stdout.write(f"Осталось в очереди: {MoySkladWebhookItem.objects.count()}")
+                raise _Rollback()
+        except _Rollback:
+            pass
+        finally:
+            server.shutdown()
+            server.server_close()
+            for payload in payloads:
+                for event in parse_events(payload):
+                    cache.delete(dedup_cache_key(event))
+        self.stdout.write(self.style.SUCCESS("Готово, изменения откатаны."))
+
+    def _create_products(self, category_name):
+        slug = getattr(settings, "MOYSKLAD_SITE_CATEGORY_SLUG", "site-kokossimo")
+        category, _ = Category.objects.get_or_create(slug=slug, defaults={"name": category_name})
+        Product.objects.bulk_create(
+            [
+                Product(category=category, name=f"Вебхук {index}", price=100, stock=0, moysklad_id=external_id)
+                for index, external_id in enumerate(EXISTING_IDS, start=1)
+            ]
+        )
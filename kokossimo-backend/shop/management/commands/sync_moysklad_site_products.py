@@ -7,6 +7,16 @@ from shop.moysklad_sync import sync_site_products
 class Command(BaseCommand):
     help = "Синхронизирует товары сайта из МойСклад в локальную БД (включая ссылки на изображения)."
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help=(
+                "Только товары, изменённые в МойСклад после прошлого синка (updated>=), без удаления устаревших; "
+                "раз в MOYSKLAD_FULL_RECONCILE_HOURS выполняется полный синк"
+            ),
+        )
+
     def handle(self, *args, **options):
         self.stdout.write("Запуск синхронизации товаров из МойСклад...")
 
@@ -19,6 +29,7 @@ class Command(BaseCommand):
                 progress_callback=progress,
                 sync_source="management_command",
                 initiated_by="sync_moysklad_site_products",
+                incremental=options["incremental"],
             )
         except (MoySkladConfigError, MoySkladError) as exc:
             raise CommandError(str(exc))
@@ -63,6 +74,7 @@ class Command(BaseCommand):
                 f"подготовлено {stats.get('prepared_rows', 0)} из {stats.get('processed_rows', 0)} строк, "
                 f"отфильтровано {stats.get('filtered_out', 0)}, "
                 f"пропущено без id/названия {stats.get('skipped_no_id_or_name', 0)}, с нулевой ценой {stats.get('skipped_zero_price', 0)}, "
-                f"удалено {stats.get('deleted', 0)}."
+                f"удалено {stats.get('deleted', 0)} "
+                f"(режим: {'инкрементальный с ' + stats['delta_since'] if stats.get('mode') == 'delta' else 'полный'})."
             )
         )
@@ -29,6 +29,8 @@ class Command(BaseCommand):
                 f"обновлено {stats.get('updated', 0)}, "
                 f"без изменений {stats.get('unchanged', 0)}, "
                 f"не найдено в МойСклад {stats.get('missing', 0)}, "
-                f"ошибок {stats.get('errors', 0)}."
+                f"ошибок {stats.get('errors', 0)}; "
+                f"запросов к МойСклад {stats.get('requests', 0)} "
+                f"({stats.get('requests_per_product', 0)} на товар) за {stats.get('wall_seconds', 0)} с."
             )
         )
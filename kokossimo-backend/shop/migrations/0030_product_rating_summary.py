@@ -0,0 +1,51 @@
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def forwards(apps, schema_editor):
+    Product = apps.get_model("shop", "Product")
+    ProductRating = apps.get_model("shop", "ProductRating")
+
+    counts_by_product = {}
+    rows = ProductRating.objects.values("product_id", "rating").annotate(n=Count("id")).order_by()
+    for row in rows:
+        counts_by_product.setdefault(row["product_id"], {})[row["rating"]] = row["n"]
+
+    to_update = []
+    for product in Product.objects.filter(id__in=list(counts_by_product.keys())):
+        counts = counts_by_product[product.id]
+        histogram = [int(counts.get(value, 0)) for value in (1, 2, 3, 4, 5)]
+        total = sum(histogram)
+        product.rating_histogram = histogram
+        product.rating_count = total
+        product.rating_avg = (
+            sum(value * n for value, n in zip((1, 2, 3, 4, 5), histogram)) / total if total else None
+        )
+        to_update.append(product)
+    if to_update:
+        Product.objects.bulk_update(to_update, ["rating_avg", "rating_count", "rating_histogram"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0029_order_yookassa_payment_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="rating_avg",
+            field=models.FloatField(blank=True, null=True, verbose_name="Средняя оценка"),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_count",
+            field=models.PositiveIntegerField(default=0, verbose_name="Количество оценок"),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_histogram",
+            field=models.JSONField(blank=True, default=list, verbose_name="Распределение оценок 1–5"),
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
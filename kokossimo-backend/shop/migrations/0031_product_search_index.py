@@ -0,0 +1,52 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute(
+            "CREATE TABLE IF NOT EXISTS shop_product_search ("
+            "product_id bigint PRIMARY KEY, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS shop_product_search_document_gin "
+            "ON shop_product_search USING gin (document)"
+        )
+        schema_editor.execute(
+            "INSERT INTO shop_product_search (product_id, document) "
+            "SELECT id, "
+            "setweight(to_tsvector('russian', translate(coalesce(name, ''), 'ёЁ', 'еЕ')), 'A') || "
+            "setweight(to_tsvector('russian', translate(coalesce(description, ''), 'ёЁ', 'еЕ')), 'B') "
+            "FROM shop_product ON CONFLICT (product_id) DO NOTHING"
+        )
+    elif vendor == "sqlite":
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts "
+            "USING fts5(name, description, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            "INSERT INTO shop_product_fts (rowid, name, description) "
+            "SELECT id, "
+            "replace(replace(coalesce(name, ''), 'ё', 'е'), 'Ё', 'Е'), "
+            "replace(replace(coalesce(description, ''), 'ё', 'е'), 'Ё', 'Е') "
+            "FROM shop_product"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute("DROP TABLE IF EXISTS shop_product_search")
+    elif vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS shop_product_fts")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0030_product_rating_summary"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0031_product_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="image_variants",
+            field=models.JSONField(blank=True, default=dict, verbose_name="Варианты фото"),
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0032_product_image_variants"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="synclog",
+            name="operation",
+            field=models.CharField(
+                choices=[
+                    ("full_sync", "Полный sync"),
+                    ("full_sync_no_openai", "Полный sync без OpenAI"),
+                    ("delta_sync", "Инкрементальный sync"),
+                    ("stock_sync", "Sync остатков"),
+                    ("single_product_sync", "Пересинхронизация товара"),
+                ],
+                max_length=40,
+                verbose_name="Операция",
+            ),
+        ),
+    ]
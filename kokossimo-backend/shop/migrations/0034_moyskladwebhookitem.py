@@ -0,0 +1,47 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0033_synclog_delta_sync"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MoySkladWebhookItem",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("key", models.CharField(max_length=64, unique=True, verbose_name="Ключ")),
+                ("entity_type", models.CharField(max_length=40, verbose_name="Тип сущности")),
+                ("action", models.CharField(blank=True, max_length=20, verbose_name="Последнее действие")),
+                ("report_url", models.TextField(blank=True, verbose_name="Ссылка на отчёт об остатках")),
+                ("events", models.PositiveIntegerField(default=1, verbose_name="Событий")),
+                ("first_received_at", models.DateTimeField(auto_now_add=True, verbose_name="Первое событие")),
+                ("received_at", models.DateTimeField(db_index=True, verbose_name="Последнее событие")),
+                ("locked_until", models.DateTimeField(blank=True, null=True, verbose_name="Занято до")),
+                ("attempts", models.PositiveIntegerField(default=0, verbose_name="Попыток")),
+                ("last_error", models.TextField(blank=True, verbose_name="Ошибка")),
+            ],
+            options={
+                "verbose_name": "Событие вебхука МойСклад",
+                "verbose_name_plural": "Очередь вебхуков МойСклад",
+                "ordering": ["received_at"],
+            },
+        ),
+        migrations.AlterField(
+            model_name="synclog",
+            name="operation",
+            field=models.CharField(
+                choices=[
+                    ("full_sync", "Полный sync"),
+                    ("full_sync_no_openai", "Полный sync без OpenAI"),
+                    ("delta_sync", "Инкрементальный sync"),
+                    ("stock_sync", "Sync остатков"),
+                    ("single_product_sync", "Пересинхронизация товара"),
+                    ("webhook_sync", "Вебхуки МойСклад"),
+                ],
+                max_length=40,
+                verbose_name="Операция",
+            ),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0034_moyskladwebhookitem"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="moysklad_hash",
+            field=models.CharField(blank=True, default="", editable=False, max_length=64, verbose_name="Хэш данных МойСклад"),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0035_product_moysklad_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="sync_generation",
+            field=models.PositiveBigIntegerField(db_index=True, default=0, editable=False, verbose_name="Поколение синка"),
+        ),
+    ]
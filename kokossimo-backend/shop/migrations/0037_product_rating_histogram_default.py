@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+import shop.models
+
+
+def forwards(apps, schema_editor):
+    # Товары без оценок хранили [] (старое значение по умолчанию), а пересчёт пишет пять нулей.
+    Product = apps.get_model("shop", "Product")
+    Product.objects.filter(rating_count=0).exclude(rating_histogram=[0, 0, 0, 0, 0]).update(
+        rating_histogram=[0, 0, 0, 0, 0]
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0036_product_sync_generation"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="product",
+            name="rating_histogram",
+            field=models.JSONField(
+                blank=True, default=shop.models.empty_rating_histogram, verbose_name="Распределение оценок 1–5"
+            ),
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
@@ -30,6 +30,11 @@ class ProductSubcategory(models.Model):
         return f"{self.code} — {self.name}"
 
 
+def empty_rating_histogram():
+    """Гистограмма оценок 1–5 товара без оценок."""
+    return [0, 0, 0, 0, 0]
+
+
 class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="products", verbose_name="Категория")
     product_subcategory = models.ForeignKey(
@@ -48,13 +53,25 @@ class Product(models.Model):
     price = models.DecimalField("Цена", max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField("Остаток", default=0)
     external_image_url = models.URLField("Внешняя ссылка на фото", blank=True, null=True)
+    # Хэш нормализованной строки МойСклад на момент последней записи синком: совпал — синк товар не пишет.
+    moysklad_hash = models.CharField("Хэш данных МойСклад", max_length=64, blank=True, default="", editable=False)
+    # Поколение (id SyncLog) последнего синка, видевшего товар в МойСклад: устаревшие — с меньшим поколением.
+    sync_generation = models.PositiveBigIntegerField("Поколение синка", default=0, db_index=True, editable=False)
     image = models.ImageField("Основное фото", upload_to="products/", blank=True, null=True)
+    # Уменьшенные WebP/JPEG-копии фото для srcset (поддерживаются shop/image_variants.py).
+    image_variants = models.JSONField("Варианты фото", default=dict, blank=True)
     
     # Флаги для главной страницы
     is_bestseller = models.BooleanField("Бестселлер", default=False)
     is_new = models.BooleanField("Новинка", default=True)
     discount = models.PositiveIntegerField("Скидка %", default=0, blank=True)
 
+    # Денормализованные агрегаты оценок (поддерживаются shop/ratings.py),
+    # чтобы каталог не делал JOIN + GROUP BY по ProductRating на каждой странице.
+    rating_avg = models.FloatField("Средняя оценка", null=True, blank=True)
+    rating_count = models.PositiveIntegerField("Количество оценок", default=0)
+    rating_histogram = models.JSONField("Распределение оценок 1–5", default=empty_rating_histogram, blank=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -70,8 +87,10 @@ class SyncLog(models.Model):
     OPERATION_CHOICES = [
         ("full_sync", "Полный sync"),
         ("full_sync_no_openai", "Полный sync без OpenAI"),
+        ("delta_sync", "Инкрементальный sync"),
         ("stock_sync", "Sync остатков"),
         ("single_product_sync", "Пересинхронизация товара"),
+        ("webhook_sync", "Вебхуки МойСклад"),
     ]
     STATUS_CHOICES = [
         ("running", "В процессе"),
@@ -109,6 +128,32 @@ class SyncLog(models.Model):
         return f"{self.get_operation_display()} ({self.get_status_display()})"
 
 
+class MoySkladWebhookItem(models.Model):
+    """
+    Очередь изменений из вебхуков МойСклад: одна строка на товар (или на отчёт об остатках),
+    повторные события по тому же товару только увеличивают счётчик — обработчик делает один upsert.
+    """
+
+    key = models.CharField("Ключ", max_length=64, unique=True)
+    entity_type = models.CharField("Тип сущности", max_length=40)
+    action = models.CharField("Последнее действие", max_length=20, blank=True)
+    report_url = models.TextField("Ссылка на отчёт об остатках", blank=True)
+    events = models.PositiveIntegerField("Событий", default=1)
+    first_received_at = models.DateTimeField("Первое событие", auto_now_add=True)
+    received_at = models.DateTimeField("Последнее событие", db_index=True)
+    locked_until = models.DateTimeField("Занято до", null=True, blank=True)
+    attempts = models.PositiveIntegerField("Попыток", default=0)
+    last_error = models.TextField("Ошибка", blank=True)
+
+    class Meta:
+        verbose_name = "Событие вебхука МойСклад"
+        verbose_name_plural = "Очередь вебхуков МойСклад"
+        ordering = ["received_at"]
+
+    def __str__(self):
+        return f"{self.entity_type} {self.key} ({self.events})"
+
+
 class ProductRating(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="ratings", verbose_name="Товар")
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="product_ratings", verbose_name="Пользователь")
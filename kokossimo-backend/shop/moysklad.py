@@ -1,26 +1,187 @@
 import base64
 import gzip
+import hashlib
+import http.client
 import json
+import os
+import re
 import socket
 import ssl
+import threading
 import time
+import zlib
+from collections import Counter
+from contextlib import nullcontext
 from urllib.parse import urlparse, parse_qs, urljoin, urlunparse
 from urllib.parse import urlencode
-from urllib.request import Request, urlopen, build_opener, HTTPErrorProcessor, HTTPRedirectHandler, HTTPSHandler
+from urllib.request import Request, urlopen, build_opener, getproxies, proxy_bypass
+from urllib.request import HTTPErrorProcessor, HTTPRedirectHandler, HTTPSHandler
 from urllib.error import HTTPError, URLError
 
 from django.conf import settings
+from django.core.cache import cache
+
+from .moysklad_rate_limit import rate_limiter
+
+# Память стратегий скачивания картинок (download_binary) в общем кэше Django.
+DOWNLOAD_STRATEGY_CACHE_PREFIX = "moysklad:download-strategy:"
+_ID_SEGMENT_RE = re.compile(
+    r"^(?:[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|[0-9a-f]{16,}|\d+)(?:\.\w+)?$",
+    re.IGNORECASE,
+)
 
 
 class MoySkladError(Exception):
-    """Ошибка при запросе к API МойСклад."""
+    """Ошибка при запросе к API МойСклад. status — HTTP-код ответа, если ошибку вернул сервер."""
+
+    def __init__(self, message="", status=None):
+        super().__init__(message)
+        self.status = status
 
 
 class MoySkladConfigError(MoySkladError):
     """Ошибка конфигурации интеграции МойСклад."""
 
 
+# Простаивающее соединение старше этого закрываем: сервер МойСклад к этому времени обычно уже закрыл его сам.
+_POOL_IDLE_SECONDS = 30
+_READ_CHUNK_BYTES = 64 * 1024
+
+
+def _read_body(response):
+    """Читает тело ответа кусками и сразу распаковывает gzip (без промежуточной сжатой копии целиком)."""
+    encoding = (response.getheader("Content-Encoding") or "").lower()
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if "gzip" in encoding else None
+    chunks = []
+    while True:
+        chunk = response.read(_READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        chunks.append(decompressor.decompress(chunk) if decompressor else chunk)
+    if decompressor:
+        chunks.append(decompressor.flush())
+    return b"".join(chunks)
+
+
+class _ConnectionPool:
+    """
+    Пул постоянных (keep-alive) HTTP(S)-соединений к API МойСклад, общий для всех клиентов процесса.
+    Соединение в каждый момент принадлежит одному потоку: acquire() забирает его из пула, release()
+    возвращает. SSL-контекст создаётся один раз на процесс (отдельно для verify_ssl=True/False).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._idle = {}
+        self._ssl_contexts = {}
+        self._stats = Counter()
+
+    def ssl_context(self, verify):
+        with self._lock:
+            context = self._ssl_contexts.get(verify)
+            if context is None:
+                context = ssl.create_default_context() if verify else ssl._create_unverified_context()
+                self._ssl_contexts[verify] = context
+            return context
+
+    def acquire(self, scheme, host, port, timeout, verify):
+        key = (scheme, host, port, verify)
+        now = time.monotonic()
+        stale = []
+        connection = None
+        with self._lock:
+            if self._pid != os.getpid():
+                # После fork соединения родителя не используем.
+                self._idle = {}
+                self._pid = os.getpid()
+            idle = self._idle.get(key) or []
+            while idle:
+                candidate, released_at = idle.pop()
+                if now - released_at <= _POOL_IDLE_SECONDS:
+                    connection = candidate
+                    break
+                stale.append(candidate)
+            self._stats["expired"] += len(stale)
+            self._stats["reused" if connection is not None else "created"] += 1
+            self._stats["requests"] += 1
+        for candidate in stale:
+            candidate.close()
+        if connection is not None:
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+            return key, connection, True
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(host, port, timeout=timeout, context=self.ssl_context(verify))
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=timeout)
+        return key, connection, False
+
+    def release(self, key, connection, max_idle):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < max_idle:
+                idle.append((connection, time.monotonic()))
+                return
+            self._stats["discarded"] += 1
+        connection.close()
+
+    def count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._lock:
+            result = {
+                name: self._stats[name]
+                for name in ("requests", "created", "reused", "stale_retries", "expired", "discarded")
+            }
+            result["idle"] = sum(len(idle) for idle in self._idle.values())
+        return result
+
+    def clear(self, reset_stats=False):
+        with self._lock:
+            connections = [connection for idle in self._idle.values() for connection, _released_at in idle]
+            self._idle = {}
+            if reset_stats:
+                self._stats = Counter()
+        for connection in connections:
+            connection.close()
+
+
+_CONNECTION_POOL = _ConnectionPool()
+
+
+def http_pool_stats():
+    """Статистика пула соединений к МойСклад в этом процессе (для мониторинга и бенчмарка)."""
+    return _CONNECTION_POOL.stats()
+
+
+def close_http_pool(reset_stats=False):
+    _CONNECTION_POOL.clear(reset_stats=reset_stats)
+
+
+def download_url_shape(url):
+    """Форма ссылки на картинку: хост + путь, где идентификаторы заменены на {id}, + имена параметров."""
+    parsed = urlparse(url or "")
+    path = "/".join("{id}" if _ID_SEGMENT_RE.match(part) else part for part in (parsed.path or "").split("/"))
+    shape = f"{parsed.netloc.lower()}{path}"
+    if parsed.query:
+        shape = f"{shape}?{'&'.join(sorted(parse_qs(parsed.query, keep_blank_values=True)))}"
+    return shape
+
+
 class MoySkladClient:
+    # id в одном filter=id=a;id=b: с expand МойСклад отдаёт не больше 100 строк, а ~45 символов
+    # на id в адресе держат его в пределах 5 КБ (лимиты длины строки запроса у прокси и сервера).
+    MAX_IDS_PER_REQUEST = 100
+
+    IMAGE_ACCEPT_HEADERS = (
+        "image/*",
+        "image/png, image/jpeg, image/gif, image/webp",
+        "*/*",
+    )
+
     def __init__(self):
         self.base_url = getattr(
             settings,
@@ -34,6 +195,9 @@ class MoySkladClient:
         self.verify_ssl = bool(getattr(settings, "MOYSKLAD_VERIFY_SSL", True))
         self.max_retries = max(0, int(getattr(settings, "MOYSKLAD_MAX_RETRIES", 3)))
         self.retry_delay_seconds = max(0.2, float(getattr(settings, "MOYSKLAD_RETRY_DELAY_SECONDS", 1.5)))
+        self.pool_size = max(0, int(getattr(settings, "MOYSKLAD_HTTP_POOL_SIZE", 8)))
+        # Счётчики последнего download_binary — свои у каждого потока (клиент делят потоки синка фото).
+        self._download_state = threading.local()
         self._basic_auth_header = ""
         if self.login and self.password:
             basic_token = base64.b64encode(f"{self.login}:{self.password}".encode("utf-8")).decode("ascii")
@@ -56,52 +220,98 @@ class MoySkladClient:
         if query:
             url = f"{url}?{urlencode(query)}"
 
-        request = Request(
-            url=url,
-            method=method.upper(),
-            headers={
-                "Authorization": self._auth_header,
-                "Accept-Encoding": "gzip",
-                "Content-Type": "application/json",
-            },
-        )
-
-        ssl_context = ssl.create_default_context() if self.verify_ssl else ssl._create_unverified_context()
+        headers = {
+            "Authorization": self._auth_header,
+            "Accept-Encoding": "gzip",
+            "Content-Type": "application/json",
+        }
 
         attempts = self.max_retries + 1
         for attempt in range(1, attempts + 1):
             try:
-                with urlopen(request, timeout=self.timeout, context=ssl_context) as response:
-                    raw_payload = response.read()
-                    content_encoding = (response.headers.get("Content-Encoding") or "").lower()
-                    if "gzip" in content_encoding:
-                        raw_payload = gzip.decompress(raw_payload)
-
-                    payload = raw_payload.decode("utf-8")
-                    if not payload.strip():
-                        return {}
-                    try:
-                        return json.loads(payload)
-                    except json.JSONDecodeError as exc:
-                        raise MoySkladError("API МойСклад вернул невалидный JSON-ответ.") from exc
-            except HTTPError as exc:
-                body = exc.read().decode("utf-8", errors="ignore")
-                retryable_http = exc.code in (429, 500, 502, 503, 504)
-                if retryable_http and attempt < attempts:
-                    time.sleep(self.retry_delay_seconds * attempt)
-                    continue
-                raise MoySkladError(
-                    f"API МойСклад вернул HTTP {exc.code}: {body or exc.reason}"
-                ) from exc
-            except (URLError, TimeoutError, socket.timeout, ConnectionResetError) as exc:
+                with rate_limiter.slot():
+                    status, reason, response_headers, body = self._send(method.upper(), url, headers)
+            except (OSError, http.client.HTTPException) as exc:
                 if attempt < attempts:
                     time.sleep(self.retry_delay_seconds * attempt)
                     continue
-                reason = getattr(exc, "reason", str(exc))
+                reason = getattr(exc, "reason", None) or str(exc) or exc.__class__.__name__
                 raise MoySkladError(f"Не удалось подключиться к API МойСклад: {reason}") from exc
+            # Заголовки лимитов уточняют бюджет; на 429 все потоки ждут Retry-After в rate_limiter.slot().
+            retry_after = rate_limiter.observe(status, response_headers)
+            if status >= 400:
+                retryable_http = status in (429, 500, 502, 503, 504)
+                if retryable_http and attempt < attempts:
+                    if retry_after is None:
+                        time.sleep(self.retry_delay_seconds * attempt)
+                    continue
+                raise MoySkladError(
+                    f"API МойСклад вернул HTTP {status}: {body.decode('utf-8', errors='ignore') or reason}",
+                    status=status,
+                )
+
+            payload = body.decode("utf-8")
+            if not payload.strip():
+                return {}
+            try:
+                return json.loads(payload)
+            except json.JSONDecodeError as exc:
+                raise MoySkladError("API МойСклад вернул невалидный JSON-ответ.") from exc
+
+    def _uses_pool(self, parsed):
+        if self.pool_size <= 0 or parsed.scheme not in ("http", "https"):
+            return False
+        # Через HTTP(S)-прокси из окружения ходим, как раньше, через urlopen.
+        return not (getproxies().get(parsed.scheme) and not proxy_bypass(parsed.hostname or ""))
+
+    def _send(self, method, url, headers):
+        """Отправляет запрос и возвращает (status, reason, заголовки, тело). HTTP-ошибки не бросает — их разбирает _request."""
+        parsed = urlparse(url)
+        if not self._uses_pool(parsed):
+            request = Request(url=url, method=method, headers=headers)
+            try:
+                with urlopen(request, timeout=self.timeout, context=self._ssl_context()) as response:
+                    return response.status, response.reason, response.headers, _read_body(response)
+            except HTTPError as exc:
+                return exc.code, exc.reason, exc.headers, exc.read()
+
+        target = parsed.path or "/"
+        if parsed.query:
+            target = f"{target}?{parsed.query}"
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        while True:
+            key, connection, reused = _CONNECTION_POOL.acquire(
+                parsed.scheme, parsed.hostname, port, self.timeout, self.verify_ssl
+            )
+            try:
+                connection.request(method, target, headers=headers)
+                response = connection.getresponse()
+                body = _read_body(response)
+            except (ConnectionResetError, BrokenPipeError, http.client.BadStatusLine):
+                connection.close()
+                if reused:
+                    # Сервер закрыл простаивавшее соединение — сразу повторяем на новом, это не сбой сети.
+                    _CONNECTION_POOL.count("stale_retries")
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                _CONNECTION_POOL.release(key, connection, self.pool_size)
+            return response.status, response.reason, response.headers, body
+
+    def _is_api_url(self, url):
+        return urlparse(url or "").hostname == urlparse(self.base_url).hostname
+
+    def _api_slot(self, url):
+        """К хосту API — через общий ограничитель частоты; подписанные ссылки хранилища — без него."""
+        return rate_limiter.slot() if self._is_api_url(url) else nullcontext()
 
     def _ssl_context(self):
-        return ssl.create_default_context() if self.verify_ssl else ssl._create_unverified_context()
+        return _CONNECTION_POOL.ssl_context(self.verify_ssl)
 
     def _absolute_href(self, href):
         parsed = urlparse(href or "")
@@ -153,6 +363,35 @@ class MoySkladClient:
         rows = payload.get("rows", []) or []
         return rows[0] if rows else {}
 
+    def get_assortment_by_ids(self, external_ids, expand=""):
+        """
+        Строки ассортимента для нескольких id: filter=id=a;id=b (условия на одно поле — ИЛИ),
+        по MAX_IDS_PER_REQUEST id на запрос.
+        """
+        external_ids = [str(external_id) for external_id in external_ids if external_id]
+        rows = []
+        for start in range(0, len(external_ids), self.MAX_IDS_PER_REQUEST):
+            chunk = external_ids[start : start + self.MAX_IDS_PER_REQUEST]
+            query = {
+                "filter": ";".join(f"id={external_id}" for external_id in chunk),
+                "limit": len(chunk),
+                "offset": 0,
+            }
+            if expand:
+                query["expand"] = expand
+            payload = self._request("GET", "/entity/assortment", query=query)
+            rows.extend(payload.get("rows", []) or [])
+        return rows
+
+    def get_entity(self, entity_type, external_id):
+        """Сущность /entity/<тип>/<id> (с полем archived); None — МойСклад ответил 404 (сущность удалена)."""
+        try:
+            return self._request("GET", f"/entity/{entity_type}/{external_id}")
+        except MoySkladError as exc:
+            if exc.status == 404:
+                return None
+            raise
+
     def get_product_folders(self, limit=100, offset=0):
         query = {"limit": max(1, min(int(limit), 1000)), "offset": max(0, int(offset))}
         return self._request("GET", "/entity/productfolder", query=query)
@@ -244,17 +483,39 @@ class MoySkladClient:
             query["expand"] = expand
         return self._request("GET", path, query=query if query else None)
 
-    def _download_via_api_download(self, url, auth_headers):
+    def _download_auth_headers(self):
+        """Варианты авторизации для скачивания: [(вид, заголовок)] — основной, Basic как запасной, без auth."""
+        auth_headers = [("primary", self._auth_header)]
+        if self._basic_auth_header and self._basic_auth_header != self._auth_header:
+            auth_headers.append(("basic", self._basic_auth_header))
+        auth_headers.append(("none", ""))
+        return auth_headers
+
+    @property
+    def last_download_attempts(self):
+        """Сколько HTTP-запросов ушло на последний download_binary в этом потоке."""
+        return getattr(self._download_state, "attempts", 0)
+
+    @property
+    def last_download_strategy(self):
+        """Какая стратегия сработала в последнем download_binary в этом потоке (пусто — не скачали)."""
+        return getattr(self._download_state, "strategy", "")
+
+    def _count_download_attempt(self):
+        self._download_state.attempts = self.last_download_attempts + 1
+
+    def _download_via_api_download(self, url, auth_headers, redirect_auths):
         """Запрос к api.moysklad.ru/download/ с Accept: application/json;charset=utf-8.
         Сервер может вернуть 302 на бинарный файл или 200 с JSON с URL.
         Редирект обрабатываем вручную и запрашиваем Location с Accept: image/*.
+        Возвращает (payload, content_type, стратегия) или None.
         """
         class NoRedirect(HTTPRedirectHandler):
             def redirect_request(self, req, fp, code, msg, headers, newurl):
                 return None
 
         ssl_context = self._ssl_context()
-        for auth_header in auth_headers:
+        for auth_kind, auth_header in auth_headers:
             headers = {
                 "Accept": "application/json;charset=utf-8",
                 "Accept-Encoding": "gzip",
@@ -268,9 +529,11 @@ class MoySkladClient:
                     HTTPSHandler(context=ssl_context),
                     HTTPErrorProcessor(),
                 )
-                response = opener.open(request, timeout=self.timeout)
+                self._count_download_attempt()
+                with self._api_slot(url):
+                    response = opener.open(request, timeout=self.timeout)
+                    payload = response.read()
                 content_type = (response.headers.get("Content-Type") or "").split(";")[0].strip().lower()
-                payload = response.read()
                 enc = (response.headers.get("Content-Encoding") or "").lower()
                 if "gzip" in enc and payload:
                     try:
@@ -278,7 +541,11 @@ class MoySkladClient:
                     except Exception:
                         pass
                 if content_type.startswith("image/") and payload:
-                    return payload, response.headers.get("Content-Type", "application/octet-stream")
+                    return (
+                        payload,
+                        response.headers.get("Content-Type", "application/octet-stream"),
+                        f"api-download:{auth_kind}:-",
+                    )
                 if content_type == "application/json" and payload:
                     try:
                         data = json.loads(payload.decode("utf-8", errors="replace"))
@@ -289,9 +556,9 @@ class MoySkladClient:
                             or (data.get("meta") or {}).get("href")
                         )
                         if redirect_url:
-                            out = self._fetch_binary_from_url(redirect_url, auth_headers)
+                            out = self._fetch_binary_from_url(redirect_url, redirect_auths)
                             if out is not None:
-                                return out
+                                return out[0], out[1], f"api-download:{auth_kind}:{out[2]}"
                     except (json.JSONDecodeError, KeyError, TypeError):
                         pass
             except HTTPError as exc:
@@ -299,112 +566,166 @@ class MoySkladClient:
                     location = exc.headers.get("Location")
                     if location:
                         location = urljoin(url, location)
-                        out = self._fetch_binary_from_url(location, auth_headers)
+                        out = self._fetch_binary_from_url(location, redirect_auths)
                         if out is not None:
-                            return out
+                            return out[0], out[1], f"api-download:{auth_kind}:{out[2]}"
                 continue
             except (URLError, TimeoutError, socket.timeout, ConnectionResetError):
                 continue
         return None
 
-    def _fetch_binary_from_url(self, target_url, auth_headers):
+    def _fetch_binary_from_url(self, target_url, redirect_auths):
         """Скачивает бинарный файл по URL (например, после редиректа 302).
-        Временные URL хранилища часто работают только без Authorization — пробуем без auth первым.
+        Временные URL хранилища часто работают только без Authorization — поэтому при поиске
+        стратегии redirect_auths начинается с варианта без auth. Возвращает (payload, content_type, вид auth).
         """
         ssl_context = self._ssl_context()
-        # Сначала без auth (temp URL с подписью), затем с auth
-        order = [""] + [h for h in auth_headers if h]
-        for auth_header in order:
+        for auth_kind, auth_header in redirect_auths:
             headers = {"Accept": "image/*", "Accept-Encoding": "identity"}
             if auth_header:
                 headers["Authorization"] = auth_header
             try:
                 request = Request(target_url, method="GET", headers=headers)
-                with urlopen(request, timeout=self.timeout, context=ssl_context) as response:
+                self._count_download_attempt()
+                with self._api_slot(target_url), urlopen(request, timeout=self.timeout, context=ssl_context) as response:
                     ct = response.headers.get("Content-Type", "application/octet-stream")
                     payload = response.read()
                     if (ct or "").lower().startswith("image/") and payload:
-                        return payload, ct
+                        return payload, ct, auth_kind
             except (HTTPError, URLError, TimeoutError, socket.timeout, ConnectionResetError):
                 continue
         return None
 
+    def _fetch_binary_direct(self, url, auth_header, accept_header):
+        """
+        Прямой GET картинки с повторами при сетевых ошибках.
+        Возвращает ((payload, content_type), http_error, network_error) — заполнен ровно один элемент.
+        """
+        headers = {
+            "Accept": accept_header,
+            # С декабря 2023 api.moysklad.ru требует Accept-Encoding: gzip, иначе 415.
+            "Accept-Encoding": "identity",
+        }
+        if auth_header:
+            headers["Authorization"] = auth_header
+        network_attempts = self.max_retries + 1
+        ssl_context = self._ssl_context()
+        network_error = ""
+        for net_try in range(1, network_attempts + 1):
+            request = Request(
+                url=url,
+                method="GET",
+                headers=headers,
+            )
+            try:
+                self._count_download_attempt()
+                with self._api_slot(url), urlopen(request, timeout=self.timeout, context=ssl_context) as response:
+                    content_type = response.headers.get("Content-Type", "application/octet-stream")
+                    payload = response.read()
+                    enc_resp = (response.headers.get("Content-Encoding") or "").lower()
+                    if "gzip" in enc_resp and payload:
+                        try:
+                            payload = gzip.decompress(payload)
+                        except Exception:
+                            pass
+                    if content_type.lower().startswith("image/") and payload:
+                        return (payload, content_type), None, ""
+                    return None, (415, f"Неверный content-type для media: {content_type}"), ""
+            except HTTPError as exc:
+                body = exc.read().decode("utf-8", errors="ignore")
+                if exc.code == 429 and self._is_api_url(url):
+                    rate_limiter.observe(exc.code, exc.headers)
+                return None, (exc.code, body or exc.reason), ""
+            except (URLError, TimeoutError, socket.timeout, ConnectionResetError) as exc:
+                reason = getattr(exc, "reason", str(exc))
+                network_error = str(reason)
+                if net_try < network_attempts:
+                    time.sleep(self.retry_delay_seconds * net_try)
+        return None, None, network_error
+
+    def _download_strategy_cache_key(self, url):
+        return f"{DOWNLOAD_STRATEGY_CACHE_PREFIX}{hashlib.sha1(download_url_shape(url).encode('utf-8')).hexdigest()}"
+
+    def _replay_download_strategy(self, strategy, urls_to_try, auth_headers):
+        """Повторяет запомненную стратегию одной попыткой (без перебора). None — не сработала."""
+        parts = str(strategy or "").split(":")
+        auth_by_kind = dict(auth_headers)
+        if len(parts) == 3 and parts[0] == "api-download":
+            _kind, auth_kind, redirect_kind = parts
+            url = next((u for u in urls_to_try if "api.moysklad.ru" in u and "/download" in u), "")
+            if not url or auth_kind not in auth_by_kind:
+                return None
+            redirect_auths = [(redirect_kind, auth_by_kind[redirect_kind])] if redirect_kind in auth_by_kind else []
+            out = self._download_via_api_download(url, [(auth_kind, auth_by_kind[auth_kind])], redirect_auths)
+            return (out[0], out[1]) if out is not None else None
+        if len(parts) == 4 and parts[0] == "direct" and parts[1].isdigit() and parts[3].isdigit():
+            _kind, variant, auth_kind, accept_index = parts
+            variant, accept_index = int(variant), int(accept_index)
+            if variant >= len(urls_to_try) or accept_index >= len(self.IMAGE_ACCEPT_HEADERS):
+                return None
+            if auth_kind not in auth_by_kind:
+                return None
+            result, _http_error, _network_error = self._fetch_binary_direct(
+                urls_to_try[variant], auth_by_kind[auth_kind], self.IMAGE_ACCEPT_HEADERS[accept_index]
+            )
+            return result
+        return None
+
     def download_binary(self, href):
+        """
+        Скачивает картинку МойСклад. Сначала пробуется стратегия, которая сработала в прошлый раз
+        для ссылок той же формы (хост + путь без идентификаторов) — она живёт в общем кэше Django
+        MOYSKLAD_DOWNLOAD_STRATEGY_TTL_SECONDS секунд и удаляется при первой неудаче; иначе
+        перебираются ссылки × авторизация × Accept. Число HTTP-запросов — last_download_attempts.
+        """
+        self._download_state.attempts = 0
+        self._download_state.strategy = ""
         if not href:
             raise MoySkladError("Пустая ссылка на изображение.")
 
         urls_to_try = self._binary_url_candidates(href)
-        auth_headers = [self._auth_header]
-        if (
-            self._basic_auth_header
-            and self._basic_auth_header not in auth_headers
-        ):
-            auth_headers.append(self._basic_auth_header)
-        auth_headers.append("")
+        auth_headers = self._download_auth_headers()
+
+        strategy_ttl = int(getattr(settings, "MOYSKLAD_DOWNLOAD_STRATEGY_TTL_SECONDS", 86400))
+        strategy_key = self._download_strategy_cache_key(urls_to_try[0]) if strategy_ttl > 0 else ""
+        remembered = cache.get(strategy_key) if strategy_key else None
+        if remembered:
+            result = self._replay_download_strategy(remembered, urls_to_try, auth_headers)
+            if result is not None:
+                self._download_state.strategy = remembered
+                return result
+            cache.delete(strategy_key)
+
+        def remember(result, strategy):
+            self._download_state.strategy = strategy
+            if strategy_key:
+                cache.set(strategy_key, strategy, strategy_ttl)
+            return result
 
         # Эндпоинт api.moysklad.ru/download/ принимает только Accept: application/json;charset=utf-8.
+        redirect_auths = [("none", "")] + [(kind, header) for kind, header in auth_headers if header]
         for url in urls_to_try:
             if "api.moysklad.ru" in (url or "") and "/download" in (url or ""):
-                result = self._download_via_api_download(url, auth_headers)
+                result = self._download_via_api_download(url, auth_headers, redirect_auths)
                 if result is not None:
-                    return result
+                    return remember((result[0], result[1]), result[2])
                 break
 
-        accept_headers = [
-            "image/*",
-            "image/png, image/jpeg, image/gif, image/webp",
-            "*/*",
-        ]
-        # С декабря 2023 api.moysklad.ru требует Accept-Encoding: gzip, иначе 415.
         last_http_error = None
         last_network_error = ""
-        network_attempts = self.max_retries + 1
-        ssl_context = self._ssl_context()
 
-        for url in urls_to_try:
+        for variant, url in enumerate(urls_to_try):
             if "api.moysklad.ru" in (url or "") and "/download" in (url or ""):
                 continue
-            accept_encoding = "identity"
-            for auth_header in auth_headers:
-                for accept_header in accept_headers:
-                    headers = {
-                        "Accept": accept_header,
-                        "Accept-Encoding": accept_encoding,
-                    }
-                    if auth_header:
-                        headers["Authorization"] = auth_header
-
-                    for net_try in range(1, network_attempts + 1):
-                        request = Request(
-                            url=url,
-                            method="GET",
-                            headers=headers,
-                        )
-                        try:
-                            with urlopen(request, timeout=self.timeout, context=ssl_context) as response:
-                                content_type = response.headers.get("Content-Type", "application/octet-stream")
-                                payload = response.read()
-                                enc_resp = (response.headers.get("Content-Encoding") or "").lower()
-                                if "gzip" in enc_resp and payload:
-                                    try:
-                                        payload = gzip.decompress(payload)
-                                    except Exception:
-                                        pass
-                                if content_type.lower().startswith("image/") and payload:
-                                    return payload, content_type
-                                last_http_error = (415, f"Неверный content-type для media: {content_type}")
-                                break
-                        except HTTPError as exc:
-                            body = exc.read().decode("utf-8", errors="ignore")
-                            last_http_error = (exc.code, body or exc.reason)
-                            break
-                        except (URLError, TimeoutError, socket.timeout, ConnectionResetError) as exc:
-                            reason = getattr(exc, "reason", str(exc))
-                            last_network_error = str(reason)
-                            if net_try < network_attempts:
-                                time.sleep(self.retry_delay_seconds * net_try)
-                                continue
-                            break
+            for auth_kind, auth_header in auth_headers:
+                for accept_index, accept_header in enumerate(self.IMAGE_ACCEPT_HEADERS):
+                    result, http_error, network_error = self._fetch_binary_direct(url, auth_header, accept_header)
+                    if result is not None:
+                        return remember(result, f"direct:{variant}:{auth_kind}:{accept_index}")
+                    if http_error:
+                        last_http_error = http_error
+                    if network_error:
+                        last_network_error = network_error
                     if last_http_error and last_http_error[0] == 415:
                         continue
                     break
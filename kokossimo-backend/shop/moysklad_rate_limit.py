@@ -0,0 +1,194 @@
+"""
+Ограничитель частоты запросов к API МойСклад (token bucket), общий для всех потоков процесса.
+
+МойСклад допускает MOYSKLAD_RATE_LIMIT_REQUESTS запросов за MOYSKLAD_RATE_LIMIT_INTERVAL_SECONDS
+(по умолчанию 45 за 3 с) и не больше MOYSKLAD_MAX_PARALLEL_REQUESTS одновременных запросов.
+Бюджет уточняется по заголовкам ответа: X-RateLimit-Limit, X-Lognex-Retry-TimeInterval (окно, мс),
+X-RateLimit-Remaining (остаток с учётом чужих процессов) и X-Lognex-Reset (до сброса окна, мс).
+На 429 все потоки ждут Retry-After / X-Lognex-Retry-After, а не фиксированную паузу.
+
+При MOYSKLAD_RATE_LIMIT_SHARED=true бюджет окна делится между процессами через кэш Django
+(счётчик запросов текущего окна и общая пауза после 429); для точного счёта нужен кэш
+с атомарным incr (Redis, memcached), файловый кэш даёт приближение.
+
+stats(): сколько запросов сделано, сколько секунд потоки ждали ограничителя (throttled_seconds)
+и сколько шли сами запросы (working_seconds).
+"""
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+_SHARED_WINDOW_KEY = "moysklad:rate-limit:window:"
+_SHARED_BLOCK_KEY = "moysklad:rate-limit:blocked-until"
+
+
+def _int_header(headers, name):
+    try:
+        return int(float((headers.get(name) or "").strip()))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def retry_after_seconds(headers):
+    """Пауза из Retry-After (секунды) или X-Lognex-Retry-After (мс); None — заголовков нет."""
+    if headers is None:
+        return None
+    seconds = _int_header(headers, "Retry-After")
+    if seconds is not None and seconds >= 0:
+        return float(seconds)
+    milliseconds = _int_header(headers, "X-Lognex-Retry-After")
+    if milliseconds is not None and milliseconds >= 0:
+        return milliseconds / 1000
+    return None
+
+
+class RateLimiter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._config = None
+        self._stats = Counter()
+
+    def _configure(self):
+        """Перечитывает настройки; при их смене бюджет и семафор создаются заново."""
+        config = (
+            max(0, int(getattr(settings, "MOYSKLAD_RATE_LIMIT_REQUESTS", 45))),
+            max(0.1, float(getattr(settings, "MOYSKLAD_RATE_LIMIT_INTERVAL_SECONDS", 3))),
+            max(1, int(getattr(settings, "MOYSKLAD_MAX_PARALLEL_REQUESTS", 5))),
+            bool(getattr(settings, "MOYSKLAD_RATE_LIMIT_SHARED", False)),
+        )
+        with self._lock:
+            if config != self._config:
+                self._config = config
+                self.limit, self.interval, parallel, self.shared = config
+                self._tokens = float(self.limit)
+                self._updated = time.monotonic()
+                self._blocked_until = 0.0
+                self._parallel = threading.BoundedSemaphore(parallel)
+        return config
+
+    @property
+    def enabled(self):
+        return self._configure()[0] > 0
+
+    def _take_token(self):
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                rate = self.limit / self.interval
+                self._tokens = min(float(self.limit), self._tokens + (now - self._updated) * rate)
+                self._updated = now
+                delay = self._blocked_until - now
+                if delay <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return waited
+                    delay = (1 - self._tokens) / rate
+            time.sleep(delay)
+            waited += delay
+
+    def _take_shared(self):
+        """Запрос из общего для процессов бюджета текущего окна (фиксированные окна по времени)."""
+        waited = 0.0
+        while True:
+            now = time.time()
+            blocked_until = cache.get(_SHARED_BLOCK_KEY) or 0
+            if blocked_until > now:
+                delay = blocked_until - now
+            else:
+                window = int(now // self.interval)
+                key = f"{_SHARED_WINDOW_KEY}{window}"
+                cache.add(key, 0, timeout=int(self.interval * 2) + 1)
+                try:
+                    used = cache.incr(key)
+                except ValueError:
+                    used = 1
+                if used <= self.limit:
+                    return waited
+                delay = (window + 1) * self.interval - now
+            time.sleep(max(0.01, delay))
+            waited += max(0.01, delay)
+
+    @contextmanager
+    def slot(self):
+        """Ждёт свободный запрос в бюджете и место среди параллельных; считает время ожидания и работы."""
+        if not self.enabled:
+            started = time.monotonic()
+            try:
+                yield
+            finally:
+                self._count(requests=1, working_seconds=time.monotonic() - started)
+            return
+        started = time.monotonic()
+        semaphore = self._parallel
+        semaphore.acquire()
+        try:
+            self._take_token()
+            if self.shared:
+                self._take_shared()
+            working_started = time.monotonic()
+            self._count(throttled_seconds=working_started - started)
+            try:
+                yield
+            finally:
+                self._count(requests=1, working_seconds=time.monotonic() - working_started)
+        finally:
+            semaphore.release()
+
+    def observe(self, status, headers):
+        """
+        Учитывает заголовки лимитов из ответа. Для 429 возвращает паузу (сек), на которую
+        заблокированы все потоки (и процессы при MOYSKLAD_RATE_LIMIT_SHARED), или None.
+        """
+        if headers is None or not self.enabled:
+            return None
+        limit = _int_header(headers, "X-RateLimit-Limit")
+        interval_ms = _int_header(headers, "X-Lognex-Retry-TimeInterval")
+        remaining = _int_header(headers, "X-RateLimit-Remaining")
+        reset_ms = _int_header(headers, "X-Lognex-Reset")
+        retry_after = retry_after_seconds(headers) if status == 429 else None
+        if status == 429 and retry_after is None and reset_ms is not None:
+            retry_after = reset_ms / 1000
+        with self._lock:
+            now = time.monotonic()
+            if limit and interval_ms:
+                self.limit, self.interval = limit, max(0.1, interval_ms / 1000)
+            if remaining is not None:
+                self._tokens = min(self._tokens, float(max(0, remaining)))
+                if remaining <= 0 and reset_ms:
+                    self._blocked_until = max(self._blocked_until, now + reset_ms / 1000)
+            if retry_after is not None:
+                self._tokens = 0.0
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+            if status == 429:
+                self._stats["rate_limited"] += 1
+        if retry_after is not None and self.shared:
+            cache.set(_SHARED_BLOCK_KEY, time.time() + retry_after, timeout=int(retry_after) + 1)
+        return retry_after
+
+    def _count(self, **values):
+        with self._lock:
+            for name, value in values.items():
+                self._stats[name] += value
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": int(self._stats["requests"]),
+                "rate_limited": int(self._stats["rate_limited"]),
+                "throttled_seconds": round(self._stats["throttled_seconds"], 3),
+                "working_seconds": round(self._stats["working_seconds"], 3),
+                "limit": getattr(self, "limit", None),
+                "interval_seconds": getattr(self, "interval", None),
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = Counter()
+
+
+rate_limiter = RateLimiter()
@@ -1,16 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import timedelta
 from decimal import Decimal
+import hashlib
 import json
 import logging
+import threading
+import time
 from urllib.parse import urlparse
+from zoneinfo import ZoneInfo
 from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 
 from django.conf import settings
 from django.utils import timezone
 
-from .models import Category, Product, SyncLog
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from .models import Category, OrderItem, Product, SyncLog
 from .moysklad import MoySkladClient
+from .moysklad_rate_limit import rate_limiter
 from .openai_categorize import enrich_product, needs_description, needs_category
+from .search import refresh_search_index
+from .catalog_cache import bump_catalog_generation
+from .catalog_export import export_static_catalog_after_sync
+from . import image_cache
+from . import image_variants
 
 
 _last_sync_at = None
@@ -91,6 +106,160 @@ def _save_local_product_image(product, client, image_url, force=False):
     return True
 
 
+class _LocalImageStage:
+    """
+    Параллельная загрузка локальных копий фото в sync_site_products (MOYSKLAD_SYNC_SAVE_LOCAL_IMAGES).
+
+    Страница отдаёт товары в пул потоков и сразу идёт за следующей страницей, пока потоки качают.
+    Поток скачивает фото, сравнивает sha256 с текущим файлом (совпало — файл не переписывается),
+    сохраняет файл и строит уменьшенные варианты; в БД потоки не ходят. Поля image/image_variants
+    записываются одним bulk_update в drain() из основного потока, после коммита прежние файлы удаляются.
+
+    Имя файла содержит хэш содержимого (moysklad/<id>-<sha256[:16]>.<ext>): повторная загрузка
+    той же картинки не плодит копии с суффиксами. Файлы, не попавшие в БД из-за остановки
+    или ошибки синка, abort() удаляет.
+    """
+
+    def __init__(self, client, stats, workers):
+        self.client = client
+        self.stats = stats
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="sync-images")
+        self.pending = set()
+        self.started = None
+        self.lock = threading.Lock()
+        for key in (
+            "local_images_saved",
+            "local_images_unchanged",
+            "local_images_failed",
+            "local_images_bytes",
+            "local_images_download_attempts",
+        ):
+            stats.setdefault(key, 0)
+
+    def submit(self, product_id, moysklad_id, image_url, current_image_name):
+        if self.started is None:
+            self.started = time.monotonic()
+        self.pending.add(
+            self.executor.submit(self._download, product_id, moysklad_id, image_url, current_image_name)
+        )
+
+    def _download(self, product_id, moysklad_id, image_url, current_image_name):
+        try:
+            payload, content_type = self.client.download_binary(image_url)
+        finally:
+            with self.lock:
+                self.stats["local_images_download_attempts"] += self.client.last_download_attempts
+        if not payload:
+            raise ValueError("пустой ответ")
+        digest = hashlib.sha256(payload).hexdigest()
+        if current_image_name:
+            try:
+                with default_storage.open(current_image_name, "rb") as current_file:
+                    if hashlib.sha256(current_file.read()).hexdigest() == digest:
+                        return product_id, None, None, len(payload)
+            except OSError:
+                pass
+        filename = _IMAGE_FIELD.generate_filename(
+            None,
+            f"moysklad/{moysklad_id or product_id}-{digest[:16]}.{_file_extension(content_type, image_url)}",
+        )
+        # Файл с этим содержимым уже есть (например, от прерванного синка) — используем его.
+        name = filename if default_storage.exists(filename) else default_storage.save(filename, ContentFile(payload))
+        variants = {}
+        if image_variants.is_enabled():
+            try:
+                variants = image_variants.build_variants(name, payload)
+            except Exception as exc:
+                logger.warning("Failed to build image variants for %s: %s", moysklad_id or product_id, exc)
+        return product_id, name, variants, len(payload)
+
+    def drain(self, block=False):
+        """Забирает готовые загрузки (block=True — дожидается всех) и пишет их в БД одним запросом."""
+        if block and self.pending:
+            wait(self.pending)
+        done = {future for future in self.pending if future.done()}
+        self.pending -= done
+        to_update = []
+        for future in done:
+            try:
+                product_id, name, variants, size = future.result()
+            except Exception as exc:
+                logger.warning("Failed to download product image: %s", exc)
+                self.stats["local_images_failed"] += 1
+                continue
+            self.stats["local_images_bytes"] += size
+            if name is None:
+                self.stats["local_images_unchanged"] += 1
+                continue
+            to_update.append(Product(id=product_id, image=name, image_variants=variants))
+        if to_update:
+            previous = {
+                product_id: (image_name or "", variants)
+                for product_id, image_name, variants in Product.objects.filter(
+                    id__in=[product.id for product in to_update]
+                ).values_list("id", "image", "image_variants")
+            }
+            Product.objects.bulk_update(to_update, ["image", "image_variants"], batch_size=200)
+            for product in to_update:
+                image_cache.discard_negative(product.id)
+            self.stats["local_images_saved"] += len(to_update)
+            replaced = [
+                (product.id, product.image.name, *previous[product.id]) for product in to_update if product.id in previous
+            ]
+            transaction.on_commit(lambda: _delete_superseded_images(replaced))
+
+    def finish(self):
+        self.drain(block=True)
+        self.executor.shutdown(wait=True)
+        elapsed = time.monotonic() - self.started if self.started is not None else 0.0
+        handled = self.stats["local_images_saved"] + self.stats["local_images_unchanged"] + self.stats["local_images_failed"]
+        self.stats["local_images_seconds"] = round(elapsed, 2)
+        self.stats["local_images_per_second"] = round(handled / elapsed, 2) if elapsed else 0.0
+        self.stats["local_images_mb_per_second"] = (
+            round(self.stats["local_images_bytes"] / elapsed / (1024 * 1024), 2) if elapsed else 0.0
+        )
+        self.stats["local_images_attempts_per_image"] = (
+            round(self.stats["local_images_download_attempts"] / handled, 2) if handled else 0.0
+        )
+
+    def abort(self):
+        """Отменяет очередь загрузок; файлы уже скачанных, но не записанных в БД фото удаляются."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        pending, self.pending = self.pending, set()
+        for future in pending:
+            future.add_done_callback(_discard_staged_image)
+
+
+def _discard_staged_image(future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    _product_id, name, variants, _size = future.result()
+    if name is None:
+        return
+    try:
+        default_storage.delete(name)
+    except OSError:
+        logger.warning("Failed to delete staged product image %s", name, exc_info=True)
+    image_variants.delete_variant_files(variants)
+
+
+def _delete_superseded_images(replaced):
+    """Удаляет прежние файлы фото и их варианты после записи новых (если их не использует другой товар)."""
+    for product_id, new_name, previous_name, previous_variants in replaced:
+        image_variants.delete_superseded_variants(previous_variants, new_name, product_id)
+        if not previous_name or previous_name == new_name:
+            continue
+        if Product.objects.filter(image=previous_name).exclude(id=product_id).exists():
+            continue
+        try:
+            default_storage.delete(previous_name)
+        except OSError:
+            logger.warning("Failed to delete superseded product image %s", previous_name, exc_info=True)
+
+
+_IMAGE_FIELD = Product._meta.get_field("image")
+
+
 def _extract_id_from_href(href):
     if not href:
         return ""
@@ -313,6 +482,27 @@ def _extract_image_url(row, client, allow_meta_fetch=False):
     return ""
 
 
+# Меняется при изменении нормализации строки — тогда все товары один раз перезапишутся.
+_ROW_HASH_VERSION = 1
+
+
+def _row_content_hash(category_id, name, description, price, stock, external_image_url):
+    """
+    Хэш нормализованной строки МойСклад (в том виде, в каком синк пишет её в товар).
+    Совпал с Product.moysklad_hash — товар не изменился, запись не нужна.
+    """
+    payload = [
+        _ROW_HASH_VERSION,
+        category_id,
+        name or "",
+        description or "",
+        f"{Decimal(str(price or 0)):.2f}",
+        int(stock or 0),
+        external_image_url or "",
+    ]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
 def _resolve_description_for_update(current_description, incoming_description):
     """
     Не даем пустому описанию из МойСклад затирать уже заполненное описание на сайте.
@@ -341,17 +531,68 @@ def _should_sync():
     return now - _last_sync_at >= timedelta(seconds=interval_seconds)
 
 
+_FULL_SYNC_OPERATIONS = ("full_sync", "full_sync_no_openai")
+
+
+def _last_successful_sync(operations):
+    """Последний успешный (не пропущенный по интервалу) запуск одной из операций."""
+    recent = (
+        SyncLog.objects.filter(operation__in=operations, status="success")
+        .order_by("-started_at")
+        .only("id", "started_at", "stats")[:20]
+    )
+    for sync_log in recent:
+        if not (sync_log.stats or {}).get("skipped"):
+            return sync_log
+    return None
+
+
+def _delta_sync_since():
+    """
+    Начало окна изменений для инкрементального синка (filter=updated>=...) или None,
+    если нужна полная сверка: полного синка ещё не было или он старше MOYSKLAD_FULL_RECONCILE_HOURS.
+    Берётся started_at (а не finished_at) последнего успешного синка минус MOYSKLAD_DELTA_OVERLAP_SECONDS:
+    строки, изменённые в МойСклад во время прошлого прохода, попадут в следующее окно.
+    """
+    last_full = _last_successful_sync(_FULL_SYNC_OPERATIONS)
+    if last_full is None:
+        return None
+    reconcile_hours = float(getattr(settings, "MOYSKLAD_FULL_RECONCILE_HOURS", 24))
+    if reconcile_hours > 0 and timezone.now() - last_full.started_at >= timedelta(hours=reconcile_hours):
+        return None
+    last_sync = _last_successful_sync(_FULL_SYNC_OPERATIONS + ("delta_sync",)) or last_full
+    overlap_seconds = max(0, int(getattr(settings, "MOYSKLAD_DELTA_OVERLAP_SECONDS", 60)))
+    return last_sync.started_at - timedelta(seconds=overlap_seconds)
+
+
+def _moysklad_datetime(value):
+    """Время для фильтров МойСклад: локальное время аккаунта (MOYSKLAD_TIMEZONE), без зоны."""
+    tz = ZoneInfo(getattr(settings, "MOYSKLAD_TIMEZONE", "Europe/Moscow") or "Europe/Moscow")
+    return value.astimezone(tz).strftime("%Y-%m-%d %H:%M:%S")
+
+
 def _start_sync_log(operation, sync_source="", initiated_by="", target_product=None, sync_log=None):
+    sync_log = _start_sync_log_row(operation, sync_source, initiated_by, target_product, sync_log)
+    # Снимок счётчиков ограничителя частоты: в статистику лога пишется разница за время операции.
+    sync_log._rate_limit_snapshot = rate_limiter.stats()
+    return sync_log
+
+
+def _start_sync_log_row(operation, sync_source, initiated_by, target_product, sync_log):
     if sync_log is not None:
         if sync_log.status != "running":
             sync_log.status = "running"
+        # Инкрементальный синк без свежей полной сверки выполняется как полный.
+        sync_log.operation = operation
         sync_log.source = (sync_source or sync_log.source or "").strip()
         sync_log.initiated_by = (initiated_by or sync_log.initiated_by or "").strip()
         if target_product is not None:
             sync_log.target_product = target_product
         sync_log.stop_requested = False
         sync_log.error = ""
-        sync_log.save(update_fields=["status", "source", "initiated_by", "target_product", "stop_requested", "error"])
+        sync_log.save(
+            update_fields=["operation", "status", "source", "initiated_by", "target_product", "stop_requested", "error"]
+        )
         return sync_log
     return SyncLog.objects.create(
         operation=operation,
@@ -371,7 +612,16 @@ def _finish_sync_log(sync_log, status, stats=None, error=""):
     sync_log.status = status
     sync_log.finished_at = finished_at
     sync_log.duration_ms = duration_ms
-    sync_log.stats = _sanitize_for_db(stats or {})
+    stats = dict(stats or {})
+    snapshot = getattr(sync_log, "_rate_limit_snapshot", None)
+    if stats and snapshot is not None:
+        # Счётчики общие для процесса: при параллельных операциях в разницу попадут и чужие запросы.
+        current = rate_limiter.stats()
+        stats["http_requests"] = current["requests"] - snapshot["requests"]
+        stats["http_rate_limited"] = current["rate_limited"] - snapshot["rate_limited"]
+        stats["http_throttled_seconds"] = round(current["throttled_seconds"] - snapshot["throttled_seconds"], 2)
+        stats["http_working_seconds"] = round(current["working_seconds"] - snapshot["working_seconds"], 2)
+    sync_log.stats = _sanitize_for_db(stats)
     sync_log.error = _sanitize_text(error)[:5000]
     sync_log.save(update_fields=["status", "finished_at", "duration_ms", "stats", "error"])
 
@@ -397,18 +647,31 @@ def sync_single_product(
     initiated_by="",
     should_stop=None,
     sync_log=None,
+    row=None,
+    write_log=True,
+    refresh_indexes=True,
+    sync_generation=None,
 ):
+    """
+    Пересинхронизация одного товара по moysklad_id.
+    row — уже загруженная строка ассортимента (с expand=images,productFolder), иначе запрашивается.
+    write_log=False и refresh_indexes=False — для пакетной обработки (вебхуки): лог и обновление
+    поиска/подсказок/кэша каталога делает вызывающий код один раз на пачку.
+    sync_generation — поколение для Product.sync_generation (по умолчанию id лога операции), чтобы
+    идущий параллельно полный синк не посчитал товар устаревшим.
+    """
     def _progress(message):
         if progress_callback:
             progress_callback(message)
 
-    sync_log = _start_sync_log(
-        operation="single_product_sync",
-        sync_source=sync_source,
-        initiated_by=initiated_by,
-        target_product=product,
-        sync_log=sync_log,
-    )
+    if write_log:
+        sync_log = _start_sync_log(
+            operation="single_product_sync",
+            sync_source=sync_source,
+            initiated_by=initiated_by,
+            target_product=product,
+            sync_log=sync_log,
+        )
     if should_stop and should_stop():
         _finish_sync_log(sync_log, status="stopped", stats={}, error="Операция остановлена пользователем.")
         raise SyncStoppedError("Операция остановлена пользователем.")
@@ -420,7 +683,8 @@ def sync_single_product(
     try:
         client = MoySkladClient()
         category = _ensure_site_category()
-        row = client.get_assortment_item(product.moysklad_id)
+        if row is None:
+            row = client.get_assortment_item(product.moysklad_id)
         if not row:
             result = {"updated": False, "detail": "Товар не найден в МойСклад."}
             _finish_sync_log(sync_log, status="error", stats=result, error=result["detail"])
@@ -469,6 +733,8 @@ def sync_single_product(
 
         image_url_changed = product.external_image_url != image_url
         if product.external_image_url != image_url:
+            image_cache.discard(product.external_image_url)
+            image_cache.discard_negative(product.id)
             product.external_image_url = image_url
             fields_to_update.append("external_image_url")
 
@@ -480,11 +746,25 @@ def sync_single_product(
         ):
             fields_to_update.append("image")
 
-        if fields_to_update:
+        content_hash = (
+            _row_content_hash(category.id, name, _sanitize_text(row.get("description")), new_price, stock, image_url)
+            if new_price > 0
+            else ""
+        )
+        bookkeeping_fields = []
+        if product.moysklad_hash != content_hash:
+            product.moysklad_hash = content_hash
+            bookkeeping_fields.append("moysklad_hash")
+        generation = sync_generation or (sync_log.id if sync_log else None)
+        if generation and product.sync_generation < generation:
+            product.sync_generation = generation
+            bookkeeping_fields.append("sync_generation")
+
+        if fields_to_update or bookkeeping_fields:
             if should_stop and should_stop():
                 _finish_sync_log(sync_log, status="stopped", stats={}, error="Операция остановлена пользователем.")
                 raise SyncStoppedError("Операция остановлена пользователем.")
-            product.save(update_fields=fields_to_update)
+            product.save(update_fields=fields_to_update + bookkeeping_fields)
 
         if (
             run_openai_enrichment
@@ -498,6 +778,10 @@ def sync_single_product(
             _progress(f"OpenAI-обогащение товара ID={product.id}...")
             enrich_product(product)
 
+        if refresh_indexes:
+            refresh_search_index([product.id])
+            bump_catalog_generation()
+
         result = {
             "updated": bool(fields_to_update),
             "updated_fields": fields_to_update,
@@ -534,47 +818,73 @@ def sync_product_stocks(
         Product.objects.filter(
             category__slug=category_slug,
             moysklad_id__isnull=False,
-        ).only("id", "stock", "moysklad_id")
+        ).only("id", "stock", "moysklad_id", "moysklad_hash")
     )
     try:
         client = MoySkladClient()
+        # Остатки запрашиваются пачками id (filter=id=a;id=b;...), а не по товару на запрос;
+        # пачка — не больше, чем клиент отправляет одним запросом.
+        batch_size = max(
+            1, min(int(getattr(settings, "MOYSKLAD_STOCK_BATCH_SIZE", 100)), MoySkladClient.MAX_IDS_PER_REQUEST)
+        )
+        products_by_moysklad_id = {product.moysklad_id: product for product in products}
+        moysklad_ids = list(products_by_moysklad_id)
+        started = time.monotonic()
 
         updated = 0
         unchanged = 0
         missing = 0
         errors = 0
+        requests = 0
         to_update = []
 
-        for idx, product in enumerate(products, start=1):
+        for offset in range(0, len(moysklad_ids), batch_size):
             if should_stop and should_stop():
                 raise SyncStoppedError("Операция остановлена пользователем.")
+            batch = moysklad_ids[offset : offset + batch_size]
+            requests += 1
             try:
-                row = client.get_assortment_item(product.moysklad_id)
-            except Exception:
-                errors += 1
-                continue
-            if not row:
-                missing += 1
-                continue
-            new_stock = _extract_stock(row)
-            if int(product.stock or 0) == new_stock:
-                unchanged += 1
+                rows = client.get_assortment_by_ids(batch)
+            except Exception as exc:
+                logger.warning("Failed to fetch MoySklad stock batch at offset %s: %s", offset, exc)
+                errors += len(batch)
                 continue
-            product.stock = new_stock
-            to_update.append(product)
-            updated += 1
-            if idx % 50 == 0:
-                _progress(f"Проверено {idx}/{len(products)} товаров, обновлено остатков: {updated}.")
+            rows_by_id = {row.get("id"): row for row in rows}
+            for moysklad_id in batch:
+                row = rows_by_id.get(moysklad_id)
+                if not row:
+                    missing += 1
+                    continue
+                product = products_by_moysklad_id[moysklad_id]
+                new_stock = _extract_stock(row)
+                if int(product.stock or 0) == new_stock:
+                    unchanged += 1
+                    continue
+                product.stock = new_stock
+                # Остаток записан в обход полного синка — его хэш строки больше не описывает товар.
+                product.moysklad_hash = ""
+                to_update.append(product)
+                updated += 1
+            _progress(
+                f"Проверено {min(offset + batch_size, len(moysklad_ids))}/{len(moysklad_ids)} товаров "
+                f"({requests} запросов), обновлено остатков: {updated}."
+            )
 
         if to_update:
-            Product.objects.bulk_update(to_update, ["stock"], batch_size=200)
+            Product.objects.bulk_update(to_update, ["stock", "moysklad_hash"], batch_size=200)
+            bump_catalog_generation()
+            export_static_catalog_after_sync(_progress)
 
+        wall_seconds = time.monotonic() - started
         result = {
             "processed": len(products),
             "updated": updated,
             "unchanged": unchanged,
             "missing": missing,
             "errors": errors,
+            "requests": requests,
+            "requests_per_product": round(requests / len(products), 3) if products else 0,
+            "wall_seconds": round(wall_seconds, 2),
         }
         _finish_sync_log(sync_log, status="success", stats=result)
         return result
@@ -594,14 +904,25 @@ def sync_site_products(
     initiated_by="",
     should_stop=None,
     sync_log=None,
+    incremental=False,
 ):
+    """
+    Синк товаров категории сайта из ассортимента МойСклад.
+    incremental=True — запрашиваются только строки с updated>= начала последнего успешного синка
+    (см. _delta_sync_since), устаревшие товары не удаляются; если полная сверка не проводилась
+    дольше MOYSKLAD_FULL_RECONCILE_HOURS, выполняется полный синк.
+    """
     global _last_sync_at, _last_sync_attempt_at, _last_sync_failed
 
     def _progress(message):
         if progress_callback:
             progress_callback(message)
 
-    operation = "full_sync" if run_openai_enrichment else "full_sync_no_openai"
+    delta_since = _delta_sync_since() if incremental else None
+    if delta_since is not None:
+        operation = "delta_sync"
+    else:
+        operation = "full_sync" if run_openai_enrichment else "full_sync_no_openai"
     sync_log = _start_sync_log(
         operation=operation,
         sync_source=sync_source,
@@ -618,6 +939,8 @@ def sync_site_products(
             "prepared_rows": 0,
             "created": 0,
             "updated": 0,
+            "changed": 0,
+            "unchanged": 0,
             "deleted": 0,
             "categorized": 0,
             "categorize_skipped": 0,
@@ -628,6 +951,8 @@ def sync_site_products(
         _finish_sync_log(sync_log, status="success", stats=skipped_stats)
         return skipped_stats
     _last_sync_attempt_at = timezone.now()
+    if incremental and delta_since is None:
+        _progress("Инкрементальный синк: нет свежей полной сверки, выполняем полный синк.")
 
     category_name = getattr(settings, "MOYSKLAD_SITE_CATEGORY_NAME", "САЙТ КОКОССИМО")
     category_slug = getattr(settings, "MOYSKLAD_SITE_CATEGORY_SLUG", "site-kokossimo")
@@ -667,8 +992,12 @@ def sync_site_products(
     allowed_folder_ids = set()
     trust_search_results = False
     assortment_filter_expr = ""
+    # Серверный фильтр по productFolder: только тогда локальную проверку папки можно не делать.
+    server_folder_filter = False
     stats = {
         "skipped": False,
+        "mode": "delta" if delta_since is not None else "full",
+        "delta_since": delta_since.isoformat() if delta_since is not None else "",
         "processed_pages": 0,
         "processed_rows": 0,
         "prepared_rows": 0,
@@ -677,9 +1006,10 @@ def sync_site_products(
         "skipped_zero_price": 0,
         "created": 0,
         "updated": 0,
+        "changed": 0,
+        "unchanged": 0,
         "deleted": 0,
         "hidden_protected": 0,
-        "delete_skipped_protected": 0,
         "target_category_name": category_name,
         "sample_paths": [],
         "sample_folder_names": [],
@@ -691,6 +1021,13 @@ def sync_site_products(
         "descriptions_skipped": 0,
         "local_images_saved": 0,
     }
+    image_stage = None
+    if bool(getattr(settings, "MOYSKLAD_SYNC_SAVE_LOCAL_IMAGES", False)):
+        image_stage = _LocalImageStage(
+            client,
+            stats,
+            workers=int(getattr(settings, "MOYSKLAD_SYNC_IMAGE_WORKERS", 4)),
+        )
 
     try:
         if use_folder_tree_filter:
@@ -731,6 +1068,7 @@ def sync_site_products(
                 # без подпапок. Поэтому используем его только когда подпапок нет (одна папка).
                 if strict_category_only and resolved_target_folder_id and len(allowed_folder_ids) == 1:
                     assortment_filter_expr = f"productFolder=https://api.moysklad.ru/api/remap/1.2/entity/productfolder/{resolved_target_folder_id}"
+                    server_folder_filter = True
                     _progress("Включен серверный фильтр assortment по productFolder (одна папка, без подпапок).")
                 elif strict_category_only and len(allowed_folder_ids) > 1:
                     _progress(
@@ -751,10 +1089,16 @@ def sync_site_products(
                     allowed_folder_ids = set()
                     trust_search_results = True
 
+        if delta_since is not None:
+            updated_filter = f"updated>={_moysklad_datetime(delta_since)}"
+            assortment_filter_expr = ";".join(part for part in (assortment_filter_expr, updated_filter) if part)
+            _progress(f"Инкрементальный синк: строки с {updated_filter}, удаление устаревших пропускается.")
+
         offset = 0
         limit = int(getattr(settings, "MOYSKLAD_SYNC_PAGE_SIZE", 50))
         limit = max(10, min(limit, 100))
-        synced_ids = set()
+        # Каждая увиденная в этом запуске строка получает поколение запуска — устаревшие останутся со старым.
+        generation = sync_log.id
         consecutive_empty_pages = 0
         _progress(
             f"Параметры синка: page_size={limit}, "
@@ -816,7 +1160,7 @@ def sync_site_products(
                     raise SyncStoppedError("Операция остановлена пользователем.")
                 folder_id = _extract_folder_id_from_row(row)
                 if allowed_folder_ids:
-                    if assortment_filter_expr:
+                    if server_folder_filter:
                         # Когда сервер уже фильтрует по целевой папке, не дублируем
                         # жесткий фильтр локально (иначе можно потерять вложенные папки).
                         pass
@@ -877,8 +1221,21 @@ def sync_site_products(
 
                 to_create = []
                 to_update = []
+                unchanged_ids = []
                 for item in prepared_rows:
                     existing = existing_map.get(item["moysklad_id"])
+                    content_hash = _row_content_hash(
+                        category.id,
+                        item["name"],
+                        item["description"],
+                        item["price"],
+                        item["stock"],
+                        item["external_image_url"],
+                    )
+                    if existing is not None and existing.moysklad_hash == content_hash:
+                        stats["unchanged"] += 1
+                        unchanged_ids.append(existing.id)
+                        continue
                     if existing is None:
                         to_create.append(
                             Product(
@@ -889,6 +1246,8 @@ def sync_site_products(
                                 price=item["price"],
                                 stock=item["stock"],
                                 external_image_url=item["external_image_url"] or None,
+                                moysklad_hash=content_hash,
+                                sync_generation=generation,
                                 is_bestseller=False,
                                 is_new=False,
                                 discount=0,
@@ -907,7 +1266,11 @@ def sync_site_products(
                         new_external_url = item["external_image_url"] or None
                         if existing.external_image_url != new_external_url:
                             external_image_changed_ids.add(item["moysklad_id"])
+                            image_cache.discard(existing.external_image_url)
+                            image_cache.discard_negative(existing.id)
                         existing.external_image_url = new_external_url
+                        existing.moysklad_hash = content_hash
+                        existing.sync_generation = generation
                         # Важно: эти поля редактируются вручную в админке.
                         # Синк должен обновлять данные МойСклада, но не перетирать ручные пометки.
                         to_update.append(existing)
@@ -925,40 +1288,40 @@ def sync_site_products(
                             "price",
                             "stock",
                             "external_image_url",
+                            "moysklad_hash",
+                            "sync_generation",
                         ],
                         batch_size=200,
                     )
                     stats["updated"] += len(to_update)
-                if bool(getattr(settings, "MOYSKLAD_SYNC_SAVE_LOCAL_IMAGES", False)):
-                    page_products = Product.objects.filter(moysklad_id__in=external_ids).only(
+                if unchanged_ids:
+                    Product.objects.filter(id__in=unchanged_ids).update(sync_generation=generation)
+                stats["changed"] += len(to_create) + len(to_update)
+                if image_stage is not None:
+                    page_products = Product.objects.filter(moysklad_id__in=external_ids).values_list(
                         "id",
                         "moysklad_id",
                         "image",
-                        "external_image_url",
                     )
-                    for page_product in page_products:
-                        if should_stop and should_stop():
-                            raise SyncStoppedError("Операция остановлена пользователем.")
-                        target_image_url = image_url_map.get(page_product.moysklad_id, "")
+                    for product_id, moysklad_id, image_name in page_products:
+                        target_image_url = image_url_map.get(moysklad_id, "")
                         if not target_image_url:
                             continue
-                        if _save_local_product_image(
-                            page_product,
-                            client,
-                            target_image_url,
-                            force=(
-                                page_product.moysklad_id in external_image_changed_ids
-                                or not bool(page_product.image)
-                            ),
-                        ):
-                            page_product.save(update_fields=["image"])
-                            stats["local_images_saved"] += 1
-                synced_ids.update(external_ids)
+                        if image_name and moysklad_id not in external_image_changed_ids:
+                            continue
+                        image_stage.submit(product_id, moysklad_id, target_image_url, image_name)
+                    # Готовые загрузки предыдущих страниц — в БД, не дожидаясь текущих.
+                    image_stage.drain()
+                changed_external_ids = [product.moysklad_id for product in to_create + to_update]
+                if changed_external_ids:
+                    refresh_search_index(
+                        Product.objects.filter(moysklad_id__in=changed_external_ids).values_list("id", flat=True)
+                    )
             _progress(
                 f"Страница {stats['processed_pages']}: получено {len(rows)}, "
                 f"к загрузке {len(prepared_rows)}, отфильтровано {stats['filtered_out']}, "
                 f"без id/названия {stats['skipped_no_id_or_name']}, нулевая цена {stats['skipped_zero_price']}, "
-                f"создано {stats['created']}, обновлено {stats['updated']}."
+                f"создано {stats['created']}, обновлено {stats['updated']}, без изменений {stats['unchanged']}."
             )
             if (
                 fail_fast_empty_pages > 0
@@ -975,37 +1338,37 @@ def sync_site_products(
                 break
             offset += limit
 
-        if synced_ids:
+        if image_stage is not None:
+            image_stage.finish()
+            _progress(
+                f"Локальные фото: сохранено {stats['local_images_saved']}, без изменений "
+                f"{stats['local_images_unchanged']}, ошибок {stats['local_images_failed']} за "
+                f"{stats['local_images_seconds']} с ({stats['local_images_per_second']} фото/с, "
+                f"{stats['local_images_mb_per_second']} МБ/с, HTTP-запросов на фото "
+                f"{stats['local_images_attempts_per_image']})."
+            )
+
+        # В инкрементальном синке выдача неполная — устаревшие определяет только полный синк.
+        if stats["prepared_rows"] and delta_since is None:
             stale_qs = Product.objects.filter(
                 category=category,
                 moysklad_id__isnull=False,
-            ).exclude(moysklad_id__in=synced_ids)
-            protected_qs = stale_qs.filter(order_items__isnull=False).distinct()
-            protected_count = protected_qs.count()
-            if protected_count:
-                # Товар участвовал в заказах (OrderItem.product = PROTECT), поэтому удалить нельзя.
-                # Скрываем его с витрины, чтобы не показывать удаленные из МойСклад позиции.
-                protected_qs.update(moysklad_id=None, stock=0)
-                stats["hidden_protected"] = int(protected_count)
+                sync_generation__lt=generation,
+            )
+            has_orders = Exists(OrderItem.objects.filter(product=OuterRef("pk")))
+            # Товар участвовал в заказах (OrderItem.product = PROTECT), поэтому удалить нельзя.
+            # Скрываем его с витрины, чтобы не показывать удаленные из МойСклад позиции.
+            hidden_count = stale_qs.filter(has_orders).update(moysklad_id=None, stock=0)
+            stats["hidden_protected"] = int(hidden_count)
+            if hidden_count:
                 _progress(
                     "Скрыто товаров, связанных с заказами "
-                    f"(удалены в МойСклад, PROTECT): {protected_count}."
+                    f"(удалены в МойСклад, PROTECT): {hidden_count}."
                 )
-            # OrderItem.product использует PROTECT, поэтому такие товары
-            # нельзя удалять и нужно безопасно пропускать.
-            deletable_qs = stale_qs.exclude(order_items__isnull=False).distinct()
-            stale_count = stale_qs.count()
-            deletable_count = deletable_qs.count()
-            protected_count = max(0, stale_count - deletable_count)
-            deleted_count, _ = deletable_qs.delete()
-            stats["deleted"] = int(deleted_count)
-            stats["delete_skipped_protected"] = int(protected_count)
+            # Скрытые выпали из выборки (moysklad_id=None); exclude — на случай заказа, оформленного между запросами.
+            _, deleted_by_model = stale_qs.exclude(has_orders).delete()
+            stats["deleted"] = int(deleted_by_model.get(Product._meta.label, 0))
             _progress(f"Удалено устаревших товаров: {stats['deleted']}.")
-            if protected_count:
-                _progress(
-                    "Пропущено удаление товаров, связанных с заказами "
-                    f"(PROTECT): {protected_count}."
-                )
 
         # Один вызов OpenAI на товар: сначала описание, затем категория
         if (
@@ -1019,6 +1382,7 @@ def sync_site_products(
                 .order_by("id")
             )
             to_enrich = [p for p in candidates if needs_category(p) or needs_description(p)]
+            enriched_ids = []
             if to_enrich:
                 _progress(
                     f"Обогащение через OpenAI (описание + категория): товаров {len(to_enrich)}."
@@ -1033,6 +1397,8 @@ def sync_site_products(
                     f"нужна_категория={need_cat}, нужно_описание={need_desc}."
                 )
                 ok, cat_updated, desc_updated = enrich_product(product)
+                if desc_updated:
+                    enriched_ids.append(product.id)
                 if ok:
                     _progress(
                         f"[{idx}/{len(to_enrich)}] Результат: "
@@ -1050,6 +1416,7 @@ def sync_site_products(
                         stats["categorize_skipped"] += 1
                     if need_desc:
                         stats["descriptions_skipped"] += 1
+            refresh_search_index(enriched_ids)
             if to_enrich:
                 _progress(
                     f"Категоризовано {stats['categorized']}, описаний сгенерировано {stats['descriptions_generated']}, не удалось {stats['categorize_skipped']}."
@@ -1074,9 +1441,9 @@ def sync_site_products(
             f"страниц {stats['processed_pages']}, строк {stats['processed_rows']}, "
             f"подготовлено {stats['prepared_rows']}, отфильтровано {stats['filtered_out']}, "
             f"пропущено без id/названия {stats['skipped_no_id_or_name']}, с нулевой ценой {stats['skipped_zero_price']}, "
-            f"создано {stats['created']}, обновлено {stats['updated']}, удалено {stats['deleted']}, "
+            f"создано {stats['created']}, обновлено {stats['updated']}, без изменений {stats['unchanged']}, "
+            f"удалено {stats['deleted']}, "
             f"скрыто (были в заказах) {stats['hidden_protected']}, "
-            f"пропущено удаление (PROTECT) {stats['delete_skipped_protected']}, "
             f"категоризовано {stats['categorized']}, описаний сгенерировано {stats['descriptions_generated']}."
         )
         if stats["prepared_rows"] == 0:
@@ -1084,15 +1451,24 @@ def sync_site_products(
                 f"Внимание: не найдено товаров по категории '{category_name}'. "
                 "Проверьте sample_paths/sample_folder_names в итоге команды."
             )
+        bump_catalog_generation()
+        export_static_catalog_after_sync(_progress)
         _finish_sync_log(sync_log, status="success", stats=stats)
         return stats
     except SyncStoppedError as exc:
         _last_sync_failed = False
+        if image_stage is not None:
+            image_stage.abort()
         _progress("Синк остановлен пользователем.")
+        # Часть страниц уже записана — ответы каталога нужно пересчитать.
+        bump_catalog_generation()
         _finish_sync_log(sync_log, status="stopped", stats={}, error=str(exc))
         raise
     except Exception as exc:
         _last_sync_failed = True
+        if image_stage is not None:
+            image_stage.abort()
         _progress("Синк завершился с ошибкой.")
+        bump_catalog_generation()
         _finish_sync_log(sync_log, status="error", stats={}, error=str(exc))
         raise
@@ -0,0 +1,413 @@
+"""
+Приём вебхуков МойСклад об изменении товаров и остатков и применение изменений на сайте.
+
+Эндпоинт POST /api/integrations/moysklad/webhook/?secret=<MOYSKLAD_WEBHOOK_SECRET>: МойСклад не подписывает
+вебхуки, поэтому секрет передаётся в адресе вебхука (или заголовком X-Moysklad-Webhook-Secret).
+Повторные доставки одного события отбрасываются по ключу в кэше Django (MOYSKLAD_WEBHOOK_DEDUP_SECONDS).
+
+События складываются в MoySkladWebhookItem — одна строка на товар: серия правок одного товара
+превращается в один upsert. Обработчик берёт строки, по которым MOYSKLAD_WEBHOOK_DEBOUNCE_SECONDS
+не было новых событий, загружает их пачкой (filter=id=a;id=b) и применяет через sync_single_product.
+Товар удаляется (или скрывается, если есть заказы) только по событию DELETE либо если отдельный запрос
+сущности подтвердил удаление (404) или архивацию: строка могла просто не попасть в ответ пачкой.
+Вебхук об остатках (webhookstock) даёт ссылку на отчёт об изменившихся остатках — они пишутся одним bulk_update.
+
+Обработчик запускается в фоне после приёма вебхука (MOYSKLAD_WEBHOOK_PROCESS_INLINE) и командой
+process_moysklad_webhooks (для отдельного процесса или cron, подбирает и повторы после ошибок).
+"""
+import hashlib
+import hmac
+import logging
+import re
+import threading
+import time
+from datetime import timedelta
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .catalog_cache import bump_catalog_generation
+from .models import MoySkladWebhookItem, Product
+from .moysklad import MoySkladClient, MoySkladError
+from .moysklad_sync import (
+    _ensure_site_category,
+    _extract_price,
+    _extract_stock,
+    _finish_sync_log,
+    _row_matches_target_name,
+    _sanitize_text,
+    _start_sync_log,
+    sync_single_product,
+)
+from .search import refresh_search_index
+
+logger = logging.getLogger(__name__)
+
+ENTITY_TYPES = ("product", "variant", "bundle", "service")
+STOCK_REPORT_KEY = "stock-report"
+_DEDUP_KEY = "moysklad:webhook:event:"
+_ENTITY_ID_RE = re.compile(r"^[0-9a-fA-F-]{8,64}$")
+_ASSORTMENT_EXPAND = "images,productFolder"
+
+
+class WebhookSecretError(Exception):
+    pass
+
+
+def verify_secret(provided):
+    """Сверяет секрет из запроса с MOYSKLAD_WEBHOOK_SECRET за постоянное время."""
+    expected = (getattr(settings, "MOYSKLAD_WEBHOOK_SECRET", "") or "").strip()
+    if not expected:
+        raise WebhookSecretError("MOYSKLAD_WEBHOOK_SECRET не задан: приём вебхуков выключен.")
+    return hmac.compare_digest((provided or "").strip().encode("utf-8"), expected.encode("utf-8"))
+
+
+def _entity_id_from_href(href):
+    entity_id = urlparse(href or "").path.rstrip("/").rsplit("/", 1)[-1]
+    return entity_id if _ENTITY_ID_RE.match(entity_id) else ""
+
+
+def parse_events(payload):
+    """
+    Разбирает тело вебхука в список событий {key, entity_type, action, report_url, dedup}.
+    Неизвестные типы сущностей и события без id пропускаются.
+    """
+    if not isinstance(payload, dict):
+        return []
+    report_url = (payload.get("reportUrl") or "").strip()
+    if report_url:
+        if "/report/stock/" not in urlparse(report_url).path:
+            return []
+        return [
+            {
+                "key": STOCK_REPORT_KEY,
+                "entity_type": "stock",
+                "action": "UPDATE",
+                "report_url": report_url,
+                "dedup": report_url,
+            }
+        ]
+    audit_href = ((payload.get("auditContext") or {}).get("meta") or {}).get("href") or ""
+    events = []
+    for event in payload.get("events") or []:
+        meta = (event or {}).get("meta") or {}
+        entity_type = (meta.get("type") or "").strip().lower()
+        entity_id = _entity_id_from_href(meta.get("href"))
+        if entity_type not in ENTITY_TYPES or not entity_id:
+            continue
+        action = (event.get("action") or "UPDATE").strip().upper()[:20]
+        events.append(
+            {
+                "key": entity_id,
+                "entity_type": entity_type,
+                "action": action,
+                "report_url": "",
+                "dedup": f"{audit_href}|{entity_id}|{action}",
+            }
+        )
+    return events
+
+
+def dedup_cache_key(event):
+    return f"{_DEDUP_KEY}{hashlib.sha256(event['dedup'].encode('utf-8')).hexdigest()}"
+
+
+def enqueue(payload):
+    """Кладёт события вебхука в очередь с дедупликацией повторных доставок; возвращает счётчики."""
+    events = parse_events(payload)
+    dedup_ttl = max(0, int(getattr(settings, "MOYSKLAD_WEBHOOK_DEDUP_SECONDS", 86400)))
+    result = {"events": len(events), "queued": 0, "duplicates": 0}
+    now = timezone.now()
+    for event in events:
+        dedup_key = dedup_cache_key(event) if dedup_ttl else None
+        if dedup_key and not cache.add(dedup_key, 1, timeout=dedup_ttl):
+            result["duplicates"] += 1
+            continue
+        try:
+            _enqueue_event(event, now)
+        except Exception:
+            # Строка очереди не записалась — повторная доставка МойСклад не должна считаться дублем.
+            if dedup_key:
+                cache.delete(dedup_key)
+            raise
+        result["queued"] += 1
+    return result
+
+
+def _enqueue_event(event, now):
+    # Ссылка на отчёт об остатках не перезаписывается: более ранний changedSince покрывает и новые изменения.
+    updates = {"events": F("events") + 1, "action": event["action"], "received_at": now}
+    if MoySkladWebhookItem.objects.filter(key=event["key"]).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            MoySkladWebhookItem.objects.create(
+                key=event["key"],
+                entity_type=event["entity_type"],
+                action=event["action"],
+                report_url=event["report_url"],
+                received_at=now,
+            )
+    except IntegrityError:
+        MoySkladWebhookItem.objects.filter(key=event["key"]).update(**updates)
+
+
+def _claim(limit, debounce_seconds, lease_seconds):
+    """Забирает готовые строки очереди: выставляет locked_until, чтобы их не взял другой обработчик."""
+    now = timezone.now()
+    free = Q(locked_until__isnull=True) | Q(locked_until__lte=now)
+    candidates = list(
+        MoySkladWebhookItem.objects.filter(free, received_at__lte=now - timedelta(seconds=debounce_seconds))
+        .order_by("received_at")[:limit]
+    )
+    claimed = []
+    for item in candidates:
+        if (
+            MoySkladWebhookItem.objects.filter(free, id=item.id, received_at=item.received_at)
+            .update(locked_until=now + timedelta(seconds=lease_seconds))
+        ):
+            claimed.append(item)
+    return claimed
+
+
+def _complete(item):
+    """Удаляет обработанную строку; если пока шла обработка пришли новые события — возвращает её в очередь."""
+    if not MoySkladWebhookItem.objects.filter(id=item.id, received_at=item.received_at).delete()[0]:
+        MoySkladWebhookItem.objects.filter(id=item.id).update(locked_until=None, attempts=0, last_error="")
+
+
+def _fail(item, exc, stats):
+    attempts = item.attempts + 1
+    max_attempts = max(1, int(getattr(settings, "MOYSKLAD_WEBHOOK_MAX_ATTEMPTS", 5)))
+    stats["failed"] += 1
+    if attempts >= max_attempts:
+        # Изменение подберёт ближайший полный или инкрементальный синк.
+        logger.warning("Вебхук МойСклад %s %s отброшен после %s попыток: %s", item.entity_type, item.key, attempts, exc)
+        MoySkladWebhookItem.objects.filter(id=item.id, received_at=item.received_at).delete()
+        MoySkladWebhookItem.objects.filter(id=item.id).update(locked_until=None, attempts=0, last_error="")
+        return
+    MoySkladWebhookItem.objects.filter(id=item.id).update(
+        attempts=attempts,
+        last_error=_sanitize_text(str(exc))[:2000],
+        locked_until=timezone.now() + timedelta(seconds=min(300, 10 * 2 ** attempts)),
+    )
+
+
+def _remove_product(product, stats):
+    """Товар удалён или архивирован в МойСклад: как в полном синке — скрыть, если есть заказы, иначе удалить."""
+    if product.order_items.exists():
+        Product.objects.filter(id=product.id).update(moysklad_id=None, stock=0)
+        stats["hidden_protected"] += 1
+    else:
+        product.delete()
+        stats["deleted"] += 1
+
+
+def _is_removed(client, item, stats):
+    """Товара нет в пачке ассортимента: удалён (404) или архивирован ли он на самом деле."""
+    entity = client.get_entity(item.entity_type, item.key)
+    stats["requests"] += 1
+    return entity is None or bool(entity.get("archived"))
+
+
+def _create_product(row, category, category_name):
+    """Новый товар из МойСклад: создаётся, только если строка из папки сайта и у неё есть цена."""
+    name = _sanitize_text(row.get("name"))
+    price = _extract_price(row)
+    if not name or price <= 0 or not _row_matches_target_name(row, category_name):
+        return None
+    max_name_len = Product._meta.get_field("name").max_length
+    if len(name) > max_name_len:
+        name = name[: max_name_len - 3] + "..."
+    return Product.objects.create(
+        moysklad_id=row["id"],
+        category=category,
+        name=name,
+        price=price,
+        stock=_extract_stock(row),
+        is_bestseller=False,
+        is_new=False,
+        discount=0,
+    )
+
+
+def _apply_entities(client, items, stats, changed_ids, generation):
+    category = _ensure_site_category()
+    category_name = getattr(settings, "MOYSKLAD_SITE_CATEGORY_NAME", "САЙТ КОКОССИМО")
+    products = Product.objects.filter(moysklad_id__in=[item.key for item in items]).in_bulk(field_name="moysklad_id")
+    fetch_ids = [item.key for item in items if item.action != "DELETE"]
+    rows = {}
+    batch_size = MoySkladClient.MAX_IDS_PER_REQUEST
+    try:
+        for start in range(0, len(fetch_ids), batch_size):
+            for row in client.get_assortment_by_ids(fetch_ids[start : start + batch_size], expand=_ASSORTMENT_EXPAND):
+                rows[row.get("id")] = row
+            stats["requests"] += 1
+    except Exception as exc:
+        for item in items:
+            _fail(item, exc, stats)
+        return
+
+    for item in items:
+        try:
+            product = products.get(item.key)
+            row = rows.get(item.key)
+            if not row:
+                if product is None:
+                    stats["ignored"] += 1
+                elif item.action == "DELETE" or _is_removed(client, item, stats):
+                    _remove_product(product, stats)
+                else:
+                    # Строки нет в ответе, хотя товар в МойСклад есть (неполная пачка) — повторим позже.
+                    raise MoySkladError(f"{item.entity_type} {item.key} не пришёл в пачке ассортимента")
+                _complete(item)
+                continue
+            if product is None:
+                product = _create_product(row, category, category_name)
+                if product is None:
+                    stats["ignored"] += 1
+                    _complete(item)
+                    continue
+                stats["created"] += 1
+                changed_ids.append(product.id)
+            result = sync_single_product(
+                product, row=row, write_log=False, refresh_indexes=False, sync_generation=generation
+            )
+            if result.get("updated"):
+                stats["updated"] += 1
+                changed_ids.append(product.id)
+            _complete(item)
+        except Exception as exc:
+            _fail(item, exc, stats)
+
+
+def _apply_stock_report(client, item, stats):
+    path, query = client._path_from_href(item.report_url)
+    payload = client._request("GET", path, query=query or None)
+    stats["requests"] += 1
+    rows = payload if isinstance(payload, list) else (payload or {}).get("rows") or []
+    stocks = {row.get("assortmentId"): _extract_stock(row) for row in rows if row.get("assortmentId")}
+    to_update = []
+    for product in Product.objects.filter(moysklad_id__in=list(stocks)).only("id", "moysklad_id", "stock", "moysklad_hash"):
+        stock = stocks[product.moysklad_id]
+        if int(product.stock or 0) != stock:
+            product.stock = stock
+            product.moysklad_hash = ""
+            to_update.append(product)
+    if to_update:
+        Product.objects.bulk_update(to_update, ["stock", "moysklad_hash"], batch_size=500)
+    stats["stock_updated"] += len(to_update)
+    return bool(to_update)
+
+
+def process_queue(limit=500, debounce_seconds=None, progress_callback=None, sync_source="webhook"):
+    """
+    Применяет накопленные изменения из очереди вебхуков. Возвращает статистику; SyncLog пишется,
+    только если было что обрабатывать.
+    """
+    if debounce_seconds is None:
+        debounce_seconds = float(getattr(settings, "MOYSKLAD_WEBHOOK_DEBOUNCE_SECONDS", 2))
+    lease_seconds = max(60, int(getattr(settings, "MOYSKLAD_TIMEOUT_SECONDS", 15)) * 4)
+    items = _claim(max(1, limit), max(0.0, debounce_seconds), lease_seconds)
+    stats = {
+        "items": len(items),
+        "events": sum(item.events for item in items),
+        "created": 0,
+        "updated": 0,
+        "deleted": 0,
+        "hidden_protected": 0,
+        "stock_updated": 0,
+        "ignored": 0,
+        "failed": 0,
+        "requests": 0,
+    }
+    if not items:
+        return stats
+
+    started = time.monotonic()
+    oldest = min(item.first_received_at for item in items)
+    sync_log = _start_sync_log(operation="webhook_sync", sync_source=sync_source, initiated_by="moysklad_webhook")
+    try:
+        client = MoySkladClient()
+        changed_ids = []
+        stock_changed = False
+        for item in items:
+            if item.key != STOCK_REPORT_KEY:
+                continue
+            try:
+                stock_changed = _apply_stock_report(client, item, stats) or stock_changed
+                _complete(item)
+            except Exception as exc:
+                _fail(item, exc, stats)
+        entity_items = [item for item in items if item.key != STOCK_REPORT_KEY]
+        if entity_items:
+            _apply_entities(client, entity_items, stats, changed_ids, sync_log.id)
+
+        if changed_ids:
+            refresh_search_index(sorted(set(changed_ids)))
+        if changed_ids or stock_changed or stats["deleted"] or stats["hidden_protected"]:
+            bump_catalog_generation()
+    except Exception as exc:
+        # Необработанные строки снова доступны обработчику (например, после исправления MOYSKLAD_TOKEN).
+        MoySkladWebhookItem.objects.filter(id__in=[item.id for item in items]).update(locked_until=None)
+        stats["wall_seconds"] = round(time.monotonic() - started, 3)
+        _finish_sync_log(sync_log, status="error", stats=stats, error=str(exc))
+        raise
+
+    stats["wall_seconds"] = round(time.monotonic() - started, 3)
+    # От первого события в пачке до применения на сайте (включая ожидание debounce).
+    stats["lag_seconds"] = round((timezone.now() - oldest).total_seconds(), 3)
+    if progress_callback:
+        progress_callback(
+            f"Вебхуки МойСклад: строк очереди {stats['items']} (событий {stats['events']}), создано {stats['created']}, "
+            f"обновлено {stats['updated']}, остатков {stats['stock_updated']}, удалено {stats['deleted']}, "
+            f"скрыто {stats['hidden_protected']}, ошибок {stats['failed']}, запросов {stats['requests']}, "
+            f"задержка {stats['lag_seconds']} с."
+        )
+    _finish_sync_log(sync_log, status="error" if stats["failed"] else "success", stats=stats)
+    return stats
+
+
+_worker_lock = threading.Lock()
+_worker_running = False
+_worker_wakeups = 0
+
+
+def process_queue_in_background():
+    """Будит фоновый обработчик очереди процесса (один поток на процесс)."""
+    global _worker_running, _worker_wakeups
+    with _worker_lock:
+        _worker_wakeups += 1
+        if _worker_running:
+            return
+        _worker_running = True
+    threading.Thread(target=_background_worker, name="moysklad-webhooks", daemon=True).start()
+
+
+def _background_worker():
+    global _worker_running
+    debounce_seconds = max(0.0, float(getattr(settings, "MOYSKLAD_WEBHOOK_DEBOUNCE_SECONDS", 2)))
+    try:
+        while True:
+            with _worker_lock:
+                seen_wakeups = _worker_wakeups
+            # Ждём, пока утихнет серия правок: события одного товара сольются в один upsert.
+            time.sleep(debounce_seconds)
+            try:
+                process_queue(debounce_seconds=debounce_seconds)
+            except Exception:
+                logger.warning("Ошибка обработки очереди вебхуков МойСклад", exc_info=True)
+            with _worker_lock:
+                if _worker_wakeups == seen_wakeups:
+                    _worker_running = False
+                    return
+    except BaseException:
+        with _worker_lock:
+            _worker_running = False
+        raise
+    finally:
+        connection.close()
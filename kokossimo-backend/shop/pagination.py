@@ -0,0 +1,199 @@
+"""
+Keyset-пагинация каталога (бесконечная прокрутка).
+
+Включается параметром ?pagination=cursor (или наличием ?cursor=). Вместо COUNT(*) + OFFSET
+страница выбирается условием по ключу сортировки последней показанной строки
+(например created_at < X OR (created_at = X AND id < Y)), поэтому стоимость не зависит от глубины.
+Ключ — поля из ordering запроса плюс id для однозначности. Курсор непрозрачный (подписанный).
+
+Если порядок задан не полями (релевантность поиска ?q=), курсор хранит смещение:
+по релевантности упорядочены не больше CATALOG_SEARCH_MAX_RESULTS совпадений, и глубокие
+страницы поиска редки, поэтому OFFSET там приемлем.
+"""
+import json
+from collections import OrderedDict
+
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connection
+from django.db.models import F, Q
+from django.db.models.expressions import OrderBy
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+CURSOR_SALT = "kokossimo-catalog-cursor"
+
+
+def _order_fields(queryset):
+    """
+    [(имя_поля, по_убыванию), ...] из order_by выборки; None — если порядок задан выражением.
+    id добавляется в конец, чтобы ключ был уникальным.
+    """
+    fields = []
+    for item in queryset.query.order_by or queryset.model._meta.ordering:
+        if isinstance(item, str):
+            descending = item.startswith("-")
+            name = item.lstrip("-")
+        elif isinstance(item, OrderBy) and isinstance(item.expression, F):
+            descending = item.descending
+            name = item.expression.name
+        else:
+            return None
+        if name == "pk":
+            name = "id"
+        if "__" in name:
+            return None
+        fields.append((name, descending))
+        if name == "id":
+            return fields
+    fields.append(("id", fields[-1][1] if fields else True))
+    return fields
+
+
+def estimate_count(queryset):
+    """
+    Дешёвая оценка количества строк: на PostgreSQL — из плана запроса (EXPLAIN, без выполнения),
+    на остальных СУБД — обычный COUNT(*).
+    """
+    if connection.vendor != "postgresql":
+        return queryset.count()
+    sql, params = queryset.order_by().values("id").query.sql_with_params()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+    except DatabaseError:
+        return queryset.count()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class CatalogCursorPagination(BasePagination):
+    page_size = 30
+    page_size_query_param = "page_size"
+    max_page_size = 60
+    cursor_query_param = "cursor"
+    total_query_param = "with_total"
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param) or self.page_size)
+        except (TypeError, ValueError):
+            size = self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def _decode_cursor(self, request):
+        raw = request.query_params.get(self.cursor_query_param)
+        if not raw:
+            return None
+        try:
+            return signing.loads(raw, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            raise NotFound("Некорректный курсор.")
+
+    def _encode_cursor(self, payload):
+        url = self.request.build_absolute_uri()
+        token = signing.dumps(payload, salt=CURSOR_SALT, compress=True)
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def _key_values(self, obj):
+        """Значения ключа строки (модель или dict из .values()) в строковом виде для курсора."""
+        values = []
+        for name, _ in self.fields:
+            if isinstance(obj, dict):
+                value = obj[name]
+                values.append(value.isoformat() if hasattr(value, "isoformat") else str(value))
+            else:
+                values.append(obj._meta.get_field(name).value_to_string(obj))
+        return values
+
+    def _keyset_filter(self, values, reverse):
+        """Строки строго после (или до, reverse=True) ключа values в порядке self.fields."""
+        condition = Q()
+        equal = Q()
+        for (name, descending), raw in zip(self.fields, values):
+            value = self.queryset.model._meta.get_field(name).to_python(raw)
+            lookup = "lt" if descending != reverse else "gt"
+            condition |= equal & Q(**{f"{name}__{lookup}": value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.queryset = queryset
+        self.page_size = self.get_page_size(request)
+        self.fields = _order_fields(queryset)
+        cursor = self._decode_cursor(request) or {}
+        self.reverse = bool(cursor.get("r"))
+
+        self.estimated_count = None
+        if str(request.query_params.get(self.total_query_param, "")).lower() in ("1", "true"):
+            self.estimated_count = estimate_count(queryset)
+
+        if self.fields is None:
+            return self._paginate_by_offset(queryset, cursor)
+
+        page_qs = queryset
+        if cursor.get("k") is not None:
+            try:
+                page_qs = page_qs.filter(self._keyset_filter(cursor["k"], self.reverse))
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound("Некорректный курсор.")
+        if self.reverse:
+            page_qs = page_qs.order_by(
+                *[(name if descending else f"-{name}") for name, descending in self.fields]
+            )
+        else:
+            page_qs = page_qs.order_by(
+                *[(f"-{name}" if descending else name) for name, descending in self.fields]
+            )
+        rows = list(page_qs[: self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if self.reverse:
+            rows.reverse()
+
+        has_following = has_more if not self.reverse else cursor.get("k") is not None
+        has_preceding = cursor.get("k") is not None if not self.reverse else has_more
+        self.next_payload = {"k": self._key_values(rows[-1])} if rows and has_following else None
+        self.previous_payload = (
+            {"k": self._key_values(rows[0]), "r": 1} if rows and has_preceding else None
+        )
+        return rows
+
+    def _paginate_by_offset(self, queryset, cursor):
+        try:
+            offset = max(0, int(cursor.get("p", 0)))
+        except (TypeError, ValueError):
+            raise NotFound("Некорректный курсор.")
+        rows = list(queryset[offset: offset + self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        self.next_payload = {"p": offset + self.page_size} if has_more else None
+        self.previous_payload = {"p": max(0, offset - self.page_size)} if offset > 0 else None
+        return rows
+
+    def get_next_link(self):
+        return self._encode_cursor(self.next_payload) if self.next_payload else None
+
+    def get_previous_link(self):
+        if not self.previous_payload:
+            return None
+        if self.previous_payload.get("p") == 0:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self._encode_cursor(self.previous_payload)
+
+    def get_paginated_response(self, data):
+        payload = OrderedDict(
+            [
+                ("next", self.get_next_link()),
+                ("previous", self.get_previous_link()),
+            ]
+        )
+        if self.estimated_count is not None:
+            payload["estimated_count"] = self.estimated_count
+        payload["results"] = data
+        return Response(payload)
@@ -0,0 +1,132 @@
+"""
+Денормализованные агрегаты оценок товаров.
+
+Product.rating_avg / rating_count / rating_histogram хранятся прямо в строке товара:
+каталог читает плоские строки без JOIN + GROUP BY по ProductRating.
+Агрегаты пересчитываются сигналами при сохранении/удалении оценки
+и массово — командой rebuild_rating_summaries. Удаления оценок (в том числе каскадные —
+вместе с пользователем или товаром) копятся до коммита транзакции и пересчитываются одним проходом.
+"""
+import threading
+
+from django.db import connection, transaction
+from django.db.models import Count
+
+from .catalog_cache import bump_catalog_generation
+from .models import Product, ProductRating
+
+RATING_VALUES = (1, 2, 3, 4, 5)
+
+
+def _summary_from_counts(counts):
+    """counts: {оценка: количество} -> поля Product с агрегатами."""
+    histogram = [int(counts.get(value, 0) or 0) for value in RATING_VALUES]
+    total = sum(histogram)
+    if total:
+        rating_avg = sum(value * n for value, n in zip(RATING_VALUES, histogram)) / total
+    else:
+        rating_avg = None
+    return {
+        "rating_avg": rating_avg,
+        "rating_count": total,
+        "rating_histogram": histogram,
+    }
+
+
+def refresh_product_rating_summary(product_id):
+    """Пересчитывает агрегаты одного товара (один небольшой GROUP BY по его оценкам)."""
+    if not product_id:
+        return None
+    rows = (
+        ProductRating.objects.filter(product_id=product_id)
+        .values("rating")
+        .annotate(n=Count("id"))
+        .order_by()
+    )
+    summary = _summary_from_counts({row["rating"]: row["n"] for row in rows})
+    Product.objects.filter(id=product_id).update(**summary)
+    return summary
+
+
+def refresh_rating_summaries(product_ids):
+    """
+    Пересчитывает агрегаты нескольких товаров одним GROUP BY.
+    Товары, которых уже нет (оценки удалены каскадом вместе с товаром), пропускаются.
+    """
+    ids = set(Product.objects.filter(id__in=list(product_ids)).values_list("id", flat=True))
+    if not ids:
+        return 0
+    counts_by_product = {}
+    rows = (
+        ProductRating.objects.filter(product_id__in=ids)
+        .values("product_id", "rating")
+        .annotate(n=Count("id"))
+        .order_by()
+    )
+    for row in rows:
+        counts_by_product.setdefault(row["product_id"], {})[row["rating"]] = row["n"]
+    for product_id in ids:
+        Product.objects.filter(id=product_id).update(**_summary_from_counts(counts_by_product.get(product_id, {})))
+    return len(ids)
+
+
+_pending = threading.local()
+
+
+def schedule_rating_summary_refresh(product_id):
+    """
+    Пересчёт агрегатов товара после коммита: удаления оценок в одной транзакции
+    дают один пересчёт на товар и одну смену поколения каталога.
+    """
+    if not product_id:
+        return
+    flush = getattr(_pending, "flush", None)
+    # После отката транзакции (или точки сохранения) Django забывает колбэк — тогда начинаем заново.
+    if flush is not None and any(entry[1] is flush for entry in connection.run_on_commit):
+        flush.product_ids.add(product_id)
+        return
+
+    def flush():
+        _pending.flush = None
+        if refresh_rating_summaries(flush.product_ids):
+            bump_catalog_generation()
+
+    flush.product_ids = {product_id}
+    _pending.flush = flush
+    transaction.on_commit(flush)
+
+
+def rebuild_rating_summaries(batch_size=500):
+    """
+    Массовый пересчёт агрегатов для всех товаров: один сгруппированный запрос по оценкам
+    и bulk_update только тех строк, где значения разошлись.
+    """
+    counts_by_product = {}
+    rows = ProductRating.objects.values("product_id", "rating").annotate(n=Count("id")).order_by()
+    for row in rows:
+        counts_by_product.setdefault(row["product_id"], {})[row["rating"]] = row["n"]
+
+    checked = 0
+    to_update = []
+    products = Product.objects.only("id", "rating_avg", "rating_count", "rating_histogram").order_by("id")
+    for product in products.iterator(chunk_size=batch_size):
+        checked += 1
+        summary = _summary_from_counts(counts_by_product.get(product.id, {}))
+        if (
+            product.rating_count == summary["rating_count"]
+            and list(product.rating_histogram or []) == summary["rating_histogram"]
+            and product.rating_avg == summary["rating_avg"]
+        ):
+            continue
+        for field, value in summary.items():
+            setattr(product, field, value)
+        to_update.append(product)
+
+    if to_update:
+        Product.objects.bulk_update(
+            to_update,
+            ["rating_avg", "rating_count", "rating_histogram"],
+            batch_size=batch_size,
+        )
+        bump_catalog_generation()
+    return {"checked": checked, "updated": len(to_update)}
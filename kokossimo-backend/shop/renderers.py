@@ -0,0 +1,32 @@
+"""
+JSON-рендерер API на orjson (если установлен) с откатом на стандартный JSONRenderer DRF.
+
+Вывод совместим с JSONRenderer: компактный JSON в UTF-8; типы, которых orjson не знает
+(Decimal, lazy-строки, а также datetime — ради формата DRF с «Z»), отдаются кодировщику DRF.
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson необязателен
+    orjson = None
+
+_drf_encoder = JSONEncoder()
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Отступы (?indent / Accept: ...; indent=4) — редкий отладочный случай, отдаём DRF.
+        if self.get_indent(accepted_media_type or "", renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            return orjson.dumps(
+                data,
+                default=_drf_encoder.default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+            )
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
@@ -0,0 +1,192 @@
+"""
+Полнотекстовый поиск по товарам для параметра каталога `q`.
+
+PostgreSQL: таблица shop_product_search с предвычисленным tsvector (русский стемминг,
+название весомее описания) и GIN-индексом; ранжирование ts_rank_cd.
+SQLite: виртуальная таблица FTS5 shop_product_fts (rowid = id товара), ранжирование bm25.
+
+Индекс обновляется явно: синк МойСклад, сохранение в админке, импорт обогащения,
+команда rebuild_search_index. Если индекс недоступен (нет таблицы, нет FTS5) —
+search_product_ids возвращает None и каталог откатывается на icontains.
+"""
+import logging
+import re
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models.expressions import RawSQL
+
+logger = logging.getLogger(__name__)
+
+PG_TABLE = "shop_product_search"
+SQLITE_TABLE = "shop_product_fts"
+PG_CONFIG = "russian"
+_MAX_QUERY_TERMS = 8
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _normalize_text(value):
+    return str(value or "").replace("ё", "е").replace("Ё", "Е")
+
+
+def query_terms(query):
+    """Токены поискового запроса: нижний регистр, ё → е, только буквы/цифры."""
+    terms = _TOKEN_RE.findall(_normalize_text(query).lower())
+    return [term for term in terms if term.strip("_")][:_MAX_QUERY_TERMS]
+
+
+def _chunks(values, size=500):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def search_results_cap():
+    """Сколько совпадений ранжируется по релевантности (CATALOG_SEARCH_MAX_RESULTS)."""
+    return max(1, int(getattr(settings, "CATALOG_SEARCH_MAX_RESULTS", 500)))
+
+
+def _match_sql(terms):
+    """(sql, params, rank_sql, rank_params) совпадений с запросом; None — СУБД без индекса."""
+    if connection.vendor == "postgresql":
+        # Каждое слово — префикс (поиск по мере набора), слова объединяются через AND.
+        tsquery = " & ".join(f"{term}:*" for term in terms)
+        return (
+            f"SELECT product_id FROM {PG_TABLE} WHERE document @@ to_tsquery(%s, %s)",
+            [PG_CONFIG, tsquery],
+            "ts_rank_cd(document, to_tsquery(%s, %s)) DESC, product_id DESC",
+            [PG_CONFIG, tsquery],
+        )
+    if connection.vendor == "sqlite":
+        match = " ".join(f'"{term}"*' for term in terms)
+        return (
+            f"SELECT rowid FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH %s",
+            [match],
+            f"bm25({SQLITE_TABLE}, 10.0, 1.0), rowid DESC",
+            [],
+        )
+    return None
+
+
+def search_product_ids(query, limit=None, within=None):
+    """
+    Id товаров по релевантности (лучшие первыми).
+    limit — не больше стольких id (по умолчанию CATALOG_SEARCH_MAX_RESULTS; 0 — без ограничения).
+    within — выборка товаров (категория, фильтры): лимит применяется к совпадениям внутри неё,
+    а не к глобальному индексу.
+    None — поисковый индекс недоступен, вызывающий код должен использовать icontains.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+    if limit is None:
+        limit = search_results_cap()
+    limit = max(0, int(limit))
+
+    built = _match_sql(terms)
+    if built is None:
+        return None
+    sql, params, rank_sql, rank_params = built
+    if within is not None:
+        within_sql, within_params = within.order_by().values("id").query.sql_with_params()
+        key = "product_id" if connection.vendor == "postgresql" else "rowid"
+        sql = f"{sql} AND {key} IN ({within_sql})"
+        params = [*params, *within_params]
+    sql = f"{sql} ORDER BY {rank_sql}"
+    params = [*params, *rank_params]
+    if limit:
+        sql = f"{sql} LIMIT %s"
+        params.append(limit)
+
+    try:
+        # Savepoint: в PostgreSQL ошибка запроса иначе ломает всю транзакцию запроса (InFailedSqlTransaction),
+        # и откат на icontains упал бы следом.
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+    except DatabaseError as exc:
+        logger.warning("Product search index unavailable, falling back to icontains: %s", exc)
+        return None
+
+
+def search_match_subquery(query):
+    """
+    Подзапрос id всех товаров, совпавших с запросом, без лимита — для id__in,
+    когда совпадений больше, чем ранжируется. None — индекс недоступен или запрос пустой.
+    """
+    terms = query_terms(query)
+    built = _match_sql(terms) if terms else None
+    if built is None:
+        return None
+    sql, params, _, _ = built
+    return RawSQL(sql, params)
+
+
+def refresh_search_index(product_ids=None):
+    """
+    Пересобирает документы индекса для переданных товаров (None — для всего каталога).
+    Возвращает количество обработанных товаров или None, если индекс недоступен.
+    """
+    from .models import Product
+
+    if product_ids is None:
+        ids = list(Product.objects.order_by("id").values_list("id", flat=True))
+        full_rebuild = True
+    else:
+        ids = sorted({int(pk) for pk in product_ids if pk})
+        full_rebuild = False
+    if not ids and not full_rebuild:
+        return 0
+
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                if full_rebuild:
+                    cursor.execute(f"DELETE FROM {PG_TABLE}")
+                for chunk in _chunks(ids):
+                    cursor.execute(
+                        f"INSERT INTO {PG_TABLE} (product_id, document) "
+                        f"SELECT id, "
+                        f"setweight(to_tsvector(%s, translate(coalesce(name, ''), 'ёЁ', 'еЕ')), 'A') || "
+                        f"setweight(to_tsvector(%s, translate(coalesce(description, ''), 'ёЁ', 'еЕ')), 'B') "
+                        f"FROM shop_product WHERE id = ANY(%s) "
+                        f"ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+                        [PG_CONFIG, PG_CONFIG, chunk],
+                    )
+            elif connection.vendor == "sqlite":
+                if full_rebuild:
+                    cursor.execute(f"DELETE FROM {SQLITE_TABLE}")
+                for chunk in _chunks(ids):
+                    placeholders = ", ".join(["%s"] * len(chunk))
+                    if not full_rebuild:
+                        cursor.execute(f"DELETE FROM {SQLITE_TABLE} WHERE rowid IN ({placeholders})", chunk)
+                    cursor.execute(
+                        f"INSERT INTO {SQLITE_TABLE} (rowid, name, description) "
+                        f"SELECT id, "
+                        f"replace(replace(coalesce(name, ''), 'ё', 'е'), 'Ё', 'Е'), "
+                        f"replace(replace(coalesce(description, ''), 'ё', 'е'), 'Ё', 'Е') "
+                        f"FROM shop_product WHERE id IN ({placeholders})",
+                        chunk,
+                    )
+            else:
+                return None
+    except DatabaseError as exc:
+        logger.warning("Failed to refresh product search index: %s", exc)
+        return None
+    return len(ids)
+
+
+def remove_from_search_index(product_ids):
+    ids = [int(pk) for pk in product_ids if pk]
+    if not ids:
+        return
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            for chunk in _chunks(ids):
+                placeholders = ", ".join(["%s"] * len(chunk))
+                if connection.vendor == "postgresql":
+                    cursor.execute(f"DELETE FROM {PG_TABLE} WHERE product_id IN ({placeholders})", chunk)
+                elif connection.vendor == "sqlite":
+                    cursor.execute(f"DELETE FROM {SQLITE_TABLE} WHERE rowid IN ({placeholders})", chunk)
+    except DatabaseError as exc:
+        logger.warning("Failed to remove products from search index: %s", exc)
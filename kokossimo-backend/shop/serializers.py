@@ -5,6 +5,8 @@ from decimal import Decimal, ROUND_HALF_UP
 from .models import Product, Category, Profile, Order, OrderItem, ProductRating, ProductSubcategory
 from django.conf import settings
 from .delivery_cities import delivery_fee_rub
+from .catalog_cache import bump_catalog_generation
+from .fast_serializers import ProductImageUrls
 
 class CategorySerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField()
@@ -14,11 +16,10 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'slug', 'image']
     
     def get_image(self, obj):
+        """Абсолютный URL от запроса или от context['base_url'] (статический экспорт каталога)."""
         if obj.image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.image.url)
-            return f"{settings.MEDIA_URL}{obj.image}"
+            urls = ProductImageUrls(self.context.get('request'), base_url=self.context.get('base_url'))
+            return urls.media(obj.image.name)
         return None
 
 
@@ -29,11 +30,28 @@ class ProductSubcategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'code', 'name', 'parent_code']
 
 
+def build_subcategory_tree():
+    """Дерево для фильтра: большие категории (1–4) с вложенными подкатегориями (1.1, 1.2, …)."""
+    fields = ProductSubcategorySerializer.Meta.fields
+    children_map = {}
+    for sub in ProductSubcategory.objects.exclude(parent_code="").order_by("code").values(*fields):
+        children_map.setdefault(sub["parent_code"], []).append(sub)
+    return [
+        {**parent, "parent_code": parent["parent_code"] or "", "children": children_map.get(parent["code"], [])}
+        for parent in ProductSubcategory.objects.filter(parent_code="").order_by("code").values(*fields)
+    ]
+
+
 class ProductSerializer(serializers.ModelSerializer):
+    """
+    Полное представление товара (карточка товара).
+    Необязательные kwargs fields / omit — разреженный набор полей (?fields=, ?omit= в API).
+    """
     category_slug = serializers.CharField(source='category.slug', read_only=True)
     product_subcategory_code = serializers.SerializerMethodField()
     product_subcategory_name = serializers.SerializerMethodField()
     image = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
     rating_avg = serializers.FloatField(read_only=True)
     rating_count = serializers.IntegerField(read_only=True)
     user_rating = serializers.SerializerMethodField()
@@ -51,6 +69,7 @@ class ProductSerializer(serializers.ModelSerializer):
             'stock',
             'is_in_stock',
             'image',
+            'image_srcset',
             'category_slug',
             'product_subcategory_code',
             'product_subcategory_name',
@@ -59,8 +78,17 @@ class ProductSerializer(serializers.ModelSerializer):
             'discount',
             'rating_avg',
             'rating_count',
+            'rating_histogram',
             'user_rating',
         ]
+
+    def __init__(self, *args, fields=None, omit=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+        for name in omit or ():
+            self.fields.pop(name, None)
     
     def get_image(self, obj):
         if obj.image:
@@ -75,6 +103,14 @@ class ProductSerializer(serializers.ModelSerializer):
             return f"/api/products/{obj.id}/image/"
         return None
 
+    def get_image_srcset(self, obj):
+        """srcset по уменьшенным WebP/JPEG-вариантам фото (shop/image_variants.py) или None."""
+        return ProductImageUrls(self.context.get('request')).srcset(
+            obj.image.name if obj.image else "",
+            obj.external_image_url,
+            obj.image_variants,
+        )
+
     def get_product_subcategory_code(self, obj):
         if obj.product_subcategory_id:
             return obj.product_subcategory.code
@@ -99,6 +135,17 @@ class ProductSerializer(serializers.ModelSerializer):
         return int(getattr(obj, "stock", 0) or 0) > 0
 
 
+class ProductCardSerializer(ProductSerializer):
+    """Облегчённое представление для списков каталога: без длинных текстов и гистограммы оценок."""
+
+    class Meta(ProductSerializer.Meta):
+        fields = [
+            name
+            for name in ProductSerializer.Meta.fields
+            if name not in ('description', 'composition', 'usage_instructions', 'rating_histogram')
+        ]
+
+
 class ProductRatingSerializer(serializers.ModelSerializer):
     user_name = serializers.SerializerMethodField()
 
@@ -273,7 +320,9 @@ class OrderCreateSerializer(serializers.Serializer):
                     price=price,
                 )
                 product.stock = int(product.stock or 0) - quantity
-                product.save(update_fields=['stock'])
+                # Следующий синк МойСклад должен перезаписать остаток, даже если строка там не менялась.
+                product.moysklad_hash = ""
+                product.save(update_fields=['stock', 'moysklad_hash'])
                 total += price * quantity
             else:
                 amount = item.get('gift_certificate_amount')
@@ -288,6 +337,10 @@ class OrderCreateSerializer(serializers.Serializer):
                 )
                 total += amount * quantity
 
+        if locked_products:
+            # Остатки в каталоге изменились — сбрасываем кэш ответов (после коммита заказа).
+            bump_catalog_generation()
+
         delivery_fee = delivery_fee_rub(
             validated_data.get('city', ''),
             validated_data.get('delivery_method', ''),
@@ -1,10 +1,21 @@
+import logging
+
 from django.contrib.auth import get_user_model
-from django.db.models.signals import pre_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 
 from knox.models import AuthToken
 
+from . import image_cache
+from .catalog_cache import bump_catalog_generation
+from .image_variants import ensure_product_variants_in_background
+from .models import Category, Product, ProductRating, ProductSubcategory
+from .ratings import refresh_product_rating_summary, schedule_rating_summary_refresh
+from .search import remove_from_search_index
+
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 
 @receiver(pre_save, sender=User)
@@ -32,3 +43,61 @@ def invalidate_tokens_on_password_change(sender, instance, update_fields=None, *
     )
     if old_password and old_password != instance.password:
         AuthToken.objects.filter(user=instance).delete()
+
+
+@receiver(post_save, sender=ProductRating)
+def refresh_rating_summary_on_change(sender, instance, **kwargs):
+    """
+    Держим Product.rating_avg/rating_count/rating_histogram в актуальном состоянии
+    при любом изменении оценки (API, админка).
+    """
+    refresh_product_rating_summary(instance.product_id)
+    bump_catalog_generation()
+
+
+@receiver(post_delete, sender=ProductRating)
+def refresh_rating_summary_on_delete(sender, instance, **kwargs):
+    """Удаление оценки, в том числе каскадом с пользователем или товаром: один пересчёт на товар после коммита."""
+    schedule_rating_summary_refresh(instance.product_id)
+
+
+@receiver(pre_save, sender=Product)
+def reset_moysklad_hash_on_full_save(sender, instance, update_fields=None, **kwargs):
+    """Полное сохранение (админка, shell) могло поменять поля из МойСклад — следующий синк перезапишет товар."""
+    if update_fields is None and instance.pk:
+        instance.moysklad_hash = ""
+
+
+@receiver(post_save, sender=Product)
+def build_image_variants_on_save(sender, instance, update_fields=None, **kwargs):
+    """Новое локальное фото (админка, синк с сохранением фото) — уменьшенные копии строятся в фоне после коммита."""
+    if not instance.image:
+        return
+    if update_fields is not None and "image" not in update_fields:
+        return
+    product_id = instance.pk
+    transaction.on_commit(lambda: ensure_product_variants_in_background(product_id))
+
+
+@receiver(post_save, sender=Product)
+def clear_image_negative_cache_on_save(sender, instance, update_fields=None, **kwargs):
+    """Фото или ссылку на него поменяли — прокси должен снова попробовать отдать картинку."""
+    if update_fields is not None and not {"image", "external_image_url"} & set(update_fields):
+        return
+    image_cache.discard_negative(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def remove_deleted_product_from_search(sender, instance, **kwargs):
+    """Поисковый индекс живёт в отдельной таблице без FK — чистим его вручную."""
+    remove_from_search_index([instance.id])
+    bump_catalog_generation()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ProductSubcategory)
+@receiver(post_delete, sender=ProductSubcategory)
+def bump_catalog_generation_on_taxonomy_change(sender, instance, **kwargs):
+    """Категории и дерево подкатегорий отдаются из кэша каталога — сбрасываем его."""
+    bump_catalog_generation()
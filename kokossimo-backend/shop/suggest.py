@@ -0,0 +1,189 @@
+"""
+Автодополнение строки поиска без обращений к БД на каждый запрос.
+
+Индекс строится в памяти процесса из Product.name (товары витрины) и ProductSubcategory.name:
+- префиксное дерево по началу каждого слова названия — в каждом узле заранее лежит топ-N
+  записей, поэтому ответ на префикс стоит O(длина запроса);
+- триграммный индекс — добирает результаты при опечатках, когда префиксных совпадений мало.
+
+Индекс пересобирается лениво: синк, сохранение или удаление товара только поднимают поколение
+каталога (shop/catalog_cache.py), и каждый воркер строит новый индекс на первом запросе
+после этого, а в крайнем случае — по истечении SUGGEST_INDEX_TTL_SECONDS.
+"""
+import re
+import threading
+import time
+
+from django.conf import settings
+
+from .catalog_cache import get_catalog_generation
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# Сколько лучших записей хранить в каждом узле дерева (верхняя граница limit у эндпоинта).
+NODE_TOP_SIZE = 20
+# Ограничение глубины дерева: длиннее этого префиксы всё равно не набирают.
+MAX_PREFIX_LENGTH = 32
+TRIGRAM_MIN_SIMILARITY = 0.3
+
+_index = None
+_index_built_at = 0.0
+_index_generation = None
+_index_lock = threading.Lock()
+
+
+def normalize(value):
+    value = str(value or "").lower().replace("ё", "е")
+    return " ".join(_TOKEN_RE.findall(value))
+
+
+def trigrams(value):
+    padded = f"  {normalize(value)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SuggestIndex:
+    def __init__(self, entries):
+        """
+        entries: список dict с ключом name и полями ответа,
+        уже отсортированный по приоритету (лучшие первыми).
+        """
+        self.entries = entries
+        self.root = {}
+        # Триграммы считаются по каждому слову и по названию целиком («единицы» сравнения):
+        # опечатка в одном слове длинного названия не должна тонуть в остальных словах.
+        self.trigram_map = {}
+        self.unit_entry = []
+        self.unit_size = []
+        for entry_id, entry in enumerate(entries):
+            normalized = normalize(entry["name"])
+            words = normalized.split(" ")
+            seen_nodes = set()
+            for start in range(len(words)):
+                self._insert(" ".join(words[start:])[:MAX_PREFIX_LENGTH], entry_id, seen_nodes)
+            units = set(words)
+            units.add(normalized)
+            for unit in units:
+                grams = trigrams(unit)
+                unit_id = len(self.unit_entry)
+                self.unit_entry.append(entry_id)
+                self.unit_size.append(len(grams))
+                for gram in grams:
+                    self.trigram_map.setdefault(gram, []).append(unit_id)
+
+    def _insert(self, text, entry_id, seen_nodes):
+        node = self.root
+        for char in text:
+            node = node.setdefault(char, {})
+            top = node.setdefault("", [])
+            # Записи вставляются в порядке приоритета, поэтому топ узла заполняется лучшими.
+            if id(top) not in seen_nodes and len(top) < NODE_TOP_SIZE:
+                top.append(entry_id)
+            seen_nodes.add(id(top))
+
+    def _prefix_ids(self, query):
+        node = self.root
+        for char in query[:MAX_PREFIX_LENGTH]:
+            node = node.get(char)
+            if node is None:
+                return []
+        return node.get("", [])
+
+    def _fuzzy_ids(self, query, exclude, limit):
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+        shared = {}
+        for gram in query_grams:
+            for unit_id in self.trigram_map.get(gram, ()):
+                shared[unit_id] = shared.get(unit_id, 0) + 1
+        best = {}
+        for unit_id, common in shared.items():
+            entry_id = self.unit_entry[unit_id]
+            if entry_id in exclude:
+                continue
+            similarity = common / (len(query_grams) + self.unit_size[unit_id] - common)
+            if similarity >= TRIGRAM_MIN_SIMILARITY and similarity > best.get(entry_id, 0):
+                best[entry_id] = similarity
+        # При равной похожести выигрывает запись с более высоким приоритетом (меньший индекс).
+        scored = sorted((-similarity, entry_id) for entry_id, similarity in best.items())
+        return [entry_id for _, entry_id in scored[:limit]]
+
+    def suggest(self, query, limit=8):
+        query = normalize(query)
+        limit = max(1, min(int(limit), NODE_TOP_SIZE))
+        if not query:
+            return []
+        ids = list(self._prefix_ids(query)[:limit])
+        if len(ids) < limit:
+            ids.extend(self._fuzzy_ids(query, set(ids), limit - len(ids)))
+        return [self.entries[entry_id] for entry_id in ids]
+
+
+def _load_entries():
+    """Записи для индексов: (подкатегории, товары), каждая группа — в порядке приоритета."""
+    from .models import Product, ProductSubcategory
+
+    subcategories = [
+        {
+            "id": sub["id"],
+            "code": sub["code"],
+            "name": sub["name"],
+            "parent_code": sub["parent_code"] or "",
+        }
+        for sub in ProductSubcategory.objects.order_by("code").values("id", "code", "name", "parent_code")
+    ]
+
+    products = Product.objects.all()
+    if getattr(settings, "MOYSKLAD_SITE_SYNC_ENABLED", False):
+        products = products.filter(
+            moysklad_id__isnull=False,
+            category__slug=getattr(settings, "MOYSKLAD_SITE_CATEGORY_SLUG", "site-kokossimo"),
+        )
+    # Приоритет: в наличии, затем популярные (больше оценок), затем новые.
+    products = products.order_by("-rating_count", "-created_at", "-id").values("id", "name", "stock")
+    in_stock = []
+    out_of_stock = []
+    for row in products:
+        entry = {"id": row["id"], "name": row["name"]}
+        (in_stock if int(row["stock"] or 0) > 0 else out_of_stock).append(entry)
+    return subcategories, in_stock + out_of_stock
+
+
+class CatalogSuggestIndex:
+    def __init__(self, subcategory_entries, product_entries):
+        self.subcategories = SuggestIndex(subcategory_entries)
+        self.products = SuggestIndex(product_entries)
+
+    def suggest(self, query, limit=8):
+        return {
+            "products": self.products.suggest(query, limit=limit),
+            "subcategories": self.subcategories.suggest(query, limit=limit),
+        }
+
+
+def rebuild_suggest_index():
+    """Собирает новый индекс и атомарно подменяет текущий (читатели не блокируются)."""
+    global _index, _index_built_at, _index_generation
+    with _index_lock:
+        generation = get_catalog_generation()
+        index = CatalogSuggestIndex(*_load_entries())
+        _index = index
+        _index_built_at = time.monotonic()
+        _index_generation = generation
+    return index
+
+
+def get_suggest_index():
+    ttl = int(getattr(settings, "SUGGEST_INDEX_TTL_SECONDS", 300))
+    index = _index
+    expired = ttl > 0 and time.monotonic() - _index_built_at >= ttl
+    if index is None or expired or _index_generation != get_catalog_generation():
+        if _index_lock.locked() and index is not None:
+            # Индекс уже пересобирается другим потоком — отдаём предыдущую версию.
+            return index
+        return rebuild_suggest_index()
+    return index
+
+
+def suggest(query, limit=8):
+    return get_suggest_index().suggest(query, limit=limit)
@@ -1,3 +1,945 @@
-from django.test import TestCase
+"""
+Тесты магазина.
+Запуск: python manage.py test shop
+"""
+import io
+import json
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.admin.sites import site as admin_site
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from knox.models import AuthToken
+
+from .models import Category, MoySkladWebhookItem, Order, OrderItem, Product, ProductRating, ProductSubcategory
+from .moysklad import MoySkladClient, MoySkladError
+from .moysklad_rate_limit import RateLimiter
+from .moysklad_webhooks import process_queue
+from . import image_cache, image_variants, ratings, search, suggest, views
+from .admin import ProductAdmin
+from .catalog_cache import bump_catalog_generation
+from .catalog_export import export_static_catalog
+from .fast_serializers import ProductRowSerializer
+from .serializers import ProductCardSerializer, ProductSerializer
+from .moysklad_sync import _LocalImageStage, sync_product_stocks, sync_site_products
+from .ratings import rebuild_rating_summaries
+from .search import refresh_search_index, search_product_ids
+
+API = "https://api.moysklad.ru/api/remap/1.2"
+SITE_CATEGORY_NAME = "САЙТ КОКОССИМО"
+SITE_CATEGORY_SLUG = "site-kokossimo"
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "shop-tests"}}
+
+
+def assortment_row(external_id, name, price=1000, stock=0):
+    """Строка /entity/assortment в формате МойСклад (цена — рубли, в ответе копейки)."""
+    return {
+        "id": external_id,
+        "name": name,
+        "description": f"Описание: {name}",
+        "pathName": SITE_CATEGORY_NAME,
+        "stock": stock,
+        "salePrices": [{"value": price * 100}],
+    }
+
+
+class FakeMoySklad:
+    """Заглушка API МойСклад вместо MoySkladClient._request; запоминает запрошенные пути."""
+
+    def __init__(self):
+        self.rows = {}
+        self.entities = {}
+        self.stock_report = []
+        self.requests = []
+        self.queries = []
+
+    def request(self, method, path, query=None):
+        query = dict(query or {})
+        self.requests.append(path)
+        self.queries.append((path, query))
+        if path == "/entity/assortment":
+            conditions = [part.split("=", 1) for part in query.get("filter", "").split(";") if "=" in part]
+            ids = [value for key, value in conditions if key == "id"]
+            if ids:
+                rows = [self.rows[external_id] for external_id in ids if external_id in self.rows]
+            else:
+                # Постраничная выдача синка: updated>= сравнивается строкой, как даты МойСклад.
+                since = next((value for key, value in conditions if key == "updated>"), "")
+                rows = [row for row in self.rows.values() if row.get("updated", "") >= since]
+            offset = int(query.get("offset", 0))
+            return {"meta": {"size": len(rows)}, "rows": rows[offset : offset + int(query.get("limit", 1000))]}
+        if path.startswith("/report/stock/"):
+            return list(self.stock_report)
+        if path.startswith("/entity/"):
+            entity_id = path.rstrip("/").rsplit("/", 1)[-1]
+            if entity_id in self.entities:
+                return self.entities[entity_id]
+            raise MoySkladError("API МойСклад вернул HTTP 404: not found", status=404)
+        raise AssertionError(f"Неожиданный запрос к МойСклад: {path}")
+
+    def count(self, path):
+        return sum(1 for requested in self.requests if requested == path)
+
+
+def entity_event(entity_type, external_id, action="UPDATE", audit=1):
+    return {
+        "auditContext": {"meta": {"type": "audit", "href": f"{API}/audit/{audit:08d}-0000-4000-8000-000000000000"}},
+        "events": [
+            {
+                "meta": {"type": entity_type, "href": f"{API}/entity/{entity_type}/{external_id}"},
+                "action": action,
+            }
+        ],
+    }
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    MOYSKLAD_TOKEN="test-token",
+    MOYSKLAD_MAX_RETRIES=0,
+    MOYSKLAD_WEBHOOK_SECRET="webhook-secret",
+    MOYSKLAD_WEBHOOK_PROCESS_INLINE=False,
+    MOYSKLAD_IMAGE_META_FETCH=False,
+    MOYSKLAD_SYNC_SAVE_LOCAL_IMAGES=False,
+    MOYSKLAD_SITE_CATEGORY_NAME=SITE_CATEGORY_NAME,
+    MOYSKLAD_SITE_CATEGORY_SLUG=SITE_CATEGORY_SLUG,
+    CATALOG_EXPORT_ENABLED=False,
+)
+class MoySkladWebhookTests(TestCase):
+    URL = "/api/integrations/moysklad/webhook/"
+    IDS = [f"00000000-0000-4000-8000-00000000000{index}" for index in range(1, 5)]
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(slug=SITE_CATEGORY_SLUG, name=SITE_CATEGORY_NAME)
+        self.products = [
+            Product.objects.create(
+                category=self.category, name=f"Товар {index}", description="", price=100, stock=1, moysklad_id=external_id
+            )
+            for index, external_id in enumerate(self.IDS, start=1)
+        ]
+        self.moysklad = FakeMoySklad()
+        patcher = mock.patch.object(MoySkladClient, "_request", self.moysklad.request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, payload, secret="webhook-secret"):
+        return self.client.post(f"{self.URL}?secret={secret}", data=json.dumps(payload), content_type="application/json")
+
+    def process(self):
+        return process_queue(debounce_seconds=0)
+
+    def test_wrong_secret_is_rejected(self):
+        self.assertEqual(self.post(entity_event("product", self.IDS[0]), secret="wrong").status_code, 403)
+        self.assertFalse(MoySkladWebhookItem.objects.exists())
+
+    def test_redelivery_is_deduplicated_and_edits_of_one_product_coalesce(self):
+        first = self.post(entity_event("product", self.IDS[0], audit=1)).json()
+        redelivery = self.post(entity_event("product", self.IDS[0], audit=1)).json()
+        second_edit = self.post(entity_event("product", self.IDS[0], audit=2)).json()
+        variant = self.post(entity_event("variant", self.IDS[1], audit=3)).json()
+
+        self.assertEqual((first["queued"], first["duplicates"]), (1, 0))
+        self.assertEqual((redelivery["queued"], redelivery["duplicates"]), (0, 1))
+        self.assertEqual(second_edit["queued"], 1)
+        self.assertEqual(variant["queued"], 1)
+        self.assertEqual(MoySkladWebhookItem.objects.count(), 2)
+        self.assertEqual(MoySkladWebhookItem.objects.get(key=self.IDS[0]).events, 2)
+
+        self.moysklad.rows = {
+            self.IDS[0]: assortment_row(self.IDS[0], "Крем обновлённый", price=1234, stock=5),
+            self.IDS[1]: assortment_row(self.IDS[1], "Модификация", price=990, stock=2),
+        }
+        stats = self.process()
+
+        self.assertEqual(stats["updated"], 2)
+        self.assertEqual(self.moysklad.count("/entity/assortment"), 1)
+        product = Product.objects.get(moysklad_id=self.IDS[0])
+        self.assertEqual((product.name, product.price, product.stock), ("Крем обновлённый", Decimal("1234"), 5))
+        self.assertFalse(MoySkladWebhookItem.objects.exists())
+
+    def test_new_product_from_site_folder_is_created(self):
+        new_id = "00000000-0000-4000-8000-000000000009"
+        self.moysklad.rows = {new_id: assortment_row(new_id, "Новинка", price=500, stock=3)}
+        self.post(entity_event("product", new_id, action="CREATE"))
+
+        self.assertEqual(self.process()["created"], 1)
+        self.assertEqual(Product.objects.get(moysklad_id=new_id).category, self.category)
+
+    def test_stock_report_updates_changed_stock_only(self):
+        report_url = f"{API}/report/stock/all/current?changedSince=2026-10-18 11:59:00"
+        self.moysklad.stock_report = [
+            {"assortmentId": self.IDS[0], "stock": 7},
+            {"assortmentId": self.IDS[1], "stock": 1},
+        ]
+        self.post({"stockType": "stock", "reportType": "all", "reportUrl": report_url})
+        self.assertEqual(self.post({"stockType": "stock", "reportType": "all", "reportUrl": report_url}).json()["duplicates"], 1)
+
+        stats = self.process()
+
+        self.assertEqual(stats["stock_updated"], 1)
+        self.assertEqual(self.moysklad.count("/report/stock/all/current"), 1)
+        self.assertEqual(Product.objects.get(moysklad_id=self.IDS[0]).stock, 7)
+        self.assertEqual(Product.objects.get(moysklad_id=self.IDS[1]).stock, 1)
+
+    def test_delete_removes_product_and_hides_ordered_one(self):
+        order = Order.objects.create(full_name="Покупатель", phone="+70000000000", city="Москва", street="Улица", house="1")
+        OrderItem.objects.create(order=order, product=self.products[1], title="Товар 2", price=100)
+        self.post(entity_event("product", self.IDS[0], action="DELETE", audit=1))
+        self.post(entity_event("product", self.IDS[1], action="DELETE", audit=2))
+
+        stats = self.process()
+
+        self.assertEqual((stats["deleted"], stats["hidden_protected"]), (1, 1))
+        self.assertFalse(Product.objects.filter(id=self.products[0].id).exists())
+        hidden = Product.objects.get(id=self.products[1].id)
+        self.assertEqual((hidden.moysklad_id, hidden.stock), (None, 0))
+        self.assertNotIn("/entity/assortment", self.moysklad.requests)
+
+    def test_row_missing_from_batch_keeps_existing_product(self):
+        # Товар есть в МойСклад, но строка не пришла в пачке: не удаляем, а повторяем позже.
+        self.moysklad.entities[self.IDS[0]] = {"id": self.IDS[0], "archived": False}
+        self.post(entity_event("product", self.IDS[0]))
+
+        stats = self.process()
+
+        self.assertEqual((stats["deleted"], stats["failed"]), (0, 1))
+        self.assertTrue(Product.objects.filter(id=self.products[0].id).exists())
+        item = MoySkladWebhookItem.objects.get(key=self.IDS[0])
+        self.assertEqual(item.attempts, 1)
+
+    def test_row_missing_from_batch_removes_archived_or_deleted_product(self):
+        self.moysklad.entities[self.IDS[0]] = {"id": self.IDS[0], "archived": True}
+        self.post(entity_event("product", self.IDS[0], audit=1))
+        self.post(entity_event("product", self.IDS[1], audit=2))
+
+        stats = self.process()
+
+        self.assertEqual(stats["deleted"], 2)
+        self.assertFalse(Product.objects.filter(moysklad_id__in=self.IDS[:2]).exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RatingSummaryTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(slug="face", name="Лицо")
+        self.products = [
+            Product.objects.create(category=category, name=f"Товар {index}", description="", price=100) for index in range(3)
+        ]
+        self.users = [get_user_model().objects.create_user(f"user{index}", password="pw") for index in range(2)]
+
+    def test_unrated_product_has_five_zero_histogram(self):
+        product = Product.objects.get(id=self.products[0].id)
+        self.assertEqual((product.rating_histogram, product.rating_count, product.rating_avg), ([0, 0, 0, 0, 0], 0, None))
+        self.assertEqual(rebuild_rating_summaries()["updated"], 0)
+
+    def test_rating_updates_summary(self):
+        ProductRating.objects.create(product=self.products[0], user=self.users[0], rating=5)
+        ProductRating.objects.create(product=self.products[0], user=self.users[1], rating=2)
+
+        product = Product.objects.get(id=self.products[0].id)
+        self.assertEqual((product.rating_histogram, product.rating_count, product.rating_avg), ([0, 1, 0, 0, 1], 2, 3.5))
+
+    def test_cascade_delete_refreshes_each_product_once(self):
+        for product in self.products:
+            ProductRating.objects.create(product=product, user=self.users[0], rating=4)
+        ProductRating.objects.create(product=self.products[0], user=self.users[1], rating=2)
+
+        with mock.patch("shop.ratings.bump_catalog_generation") as bump, mock.patch(
+            "shop.ratings._summary_from_counts", wraps=ratings._summary_from_counts
+        ) as summary, self.captureOnCommitCallbacks(execute=True):
+            self.users[0].delete()
+
+        self.assertEqual(bump.call_count, 1)
+        self.assertEqual(summary.call_count, len(self.products))
+        self.assertEqual(Product.objects.get(id=self.products[0].id).rating_histogram, [0, 1, 0, 0, 0])
+        self.assertEqual(Product.objects.get(id=self.products[1].id).rating_count, 0)
+
+    def test_rolled_back_delete_does_not_block_later_refreshes(self):
+        ProductRating.objects.create(product=self.products[0], user=self.users[0], rating=4)
+        ProductRating.objects.create(product=self.products[1], user=self.users[0], rating=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    ProductRating.objects.filter(product=self.products[0]).delete()
+                    raise RuntimeError("откат")
+            except RuntimeError:
+                pass
+            ProductRating.objects.filter(product=self.products[1]).delete()
+
+        self.assertEqual(Product.objects.get(id=self.products[0].id).rating_count, 1)
+        self.assertEqual(Product.objects.get(id=self.products[1].id).rating_count, 0)
+
+    def test_deleting_product_skips_its_summary(self):
+        ProductRating.objects.create(product=self.products[0], user=self.users[0], rating=4)
+        with mock.patch("shop.ratings.bump_catalog_generation") as bump, self.captureOnCommitCallbacks(execute=True):
+            self.products[0].delete()
+        bump.assert_not_called()
+
+    def test_rebuild_bumps_catalog_generation_when_rows_change(self):
+        ProductRating.objects.create(product=self.products[0], user=self.users[0], rating=3)
+        Product.objects.filter(id=self.products[0].id).update(rating_count=0, rating_avg=None)
+
+        with mock.patch("shop.ratings.bump_catalog_generation") as bump:
+            self.assertEqual(rebuild_rating_summaries()["updated"], 1)
+            bump.assert_called_once()
+            self.assertEqual(rebuild_rating_summaries()["updated"], 0)
+            bump.assert_called_once()
+
+
+def png_bytes(width, height, color=(200, 100, 50)):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PRODUCT_IMAGE_VARIANT_WIDTHS="200,400")
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.category = Category.objects.create(slug="face", name="Лицо")
+
+    def _product_with_image(self, color):
+        product = Product(category=self.category, name="Крем", description="", price=100)
+        product.image.save("cream.png", ContentFile(png_bytes(800, 400, color)), save=False)
+        return product
+
+    def test_admin_save_builds_variants_in_background(self):
+        product = self._product_with_image((1, 2, 3))
+        with mock.patch("shop.signals.ensure_product_variants_in_background") as background, mock.patch(
+            "shop.image_variants.build_variants"
+        ) as build, self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        background.assert_called_once_with(product.id)
+        build.assert_not_called()
+
+    def test_new_source_removes_previous_variant_files(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            product = self._product_with_image((1, 2, 3))
+            product.save()
+        self.assertTrue(image_variants.ensure_product_variants(product.id))
+        old = Product.objects.get(id=product.id).image_variants
+        old_directory = os.path.join(self.media_root, os.path.dirname(old["webp"]["200"]))
+        self.assertTrue(os.path.isdir(old_directory))
+
+        product.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=False):
+            product.image.save("cream-new.png", ContentFile(png_bytes(600, 300, (9, 9, 9))), save=True)
+        self.assertTrue(image_variants.ensure_product_variants(product.id))
+
+        new = Product.objects.get(id=product.id).image_variants
+        self.assertNotEqual(new["source"], old["source"])
+        self.assertFalse(os.path.exists(old_directory))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, new["webp"]["200"])))
+
+
+class FakeImageClient:
+    """Клиент для _LocalImageStage: отдаёт заданные байты вместо загрузки из МойСклад."""
+
+    last_download_attempts = 1
+
+    def __init__(self, payloads):
+        self.payloads = payloads
+
+    def download_binary(self, href):
+        return self.payloads[href], "image/png"
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PRODUCT_IMAGE_VARIANT_WIDTHS="200")
+class LocalImageStageTests(TestCase):
+    URL = "https://api.moysklad.ru/api/remap/1.2/download/1"
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        category = Category.objects.create(slug="face", name="Лицо")
+        self.product = Product.objects.create(category=category, name="Крем", description="", price=100, moysklad_id="ms-1")
+
+    def _files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media_root)
+            for root, _dirs, names in os.walk(self.media_root)
+            for name in names
+        )
+
+    def _run_stage(self, payload):
+        stage = _LocalImageStage(FakeImageClient({self.URL: payload}), {}, workers=2)
+        current = Product.objects.get(id=self.product.id).image.name or ""
+        with self.captureOnCommitCallbacks(execute=True):
+            stage.submit(self.product.id, "ms-1", self.URL, current)
+            stage.finish()
+        return stage.stats
+
+    def test_redownload_replaces_file_without_duplicates(self):
+        self.assertEqual(self._run_stage(png_bytes(300, 300, (1, 1, 1)))["local_images_saved"], 1)
+        first = Product.objects.get(id=self.product.id)
+        self.assertEqual(self._run_stage(png_bytes(300, 300, (1, 1, 1)))["local_images_unchanged"], 1)
+        self.assertEqual(self._run_stage(png_bytes(300, 300, (2, 2, 2)))["local_images_saved"], 1)
+
+        second = Product.objects.get(id=self.product.id)
+        self.assertNotEqual(second.image.name, first.image.name)
+        self.assertEqual(
+            self._files(),
+            sorted([second.image.name, second.image_variants["webp"]["200"], second.image_variants["jpeg"]["200"]]),
+        )
+
+    def test_abort_removes_staged_files(self):
+        stage = _LocalImageStage(FakeImageClient({self.URL: png_bytes(300, 300)}), {}, workers=1)
+        stage.submit(self.product.id, "ms-1", self.URL, "")
+        stage.executor.shutdown(wait=True)
+        self.assertTrue(self._files())
+
+        stage.abort()
+
+        self.assertEqual(self._files(), [])
+        self.assertFalse(Product.objects.get(id=self.product.id).image)
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    MOYSKLAD_TOKEN="test-token",
+    MOYSKLAD_SITE_CATEGORY_SLUG=SITE_CATEGORY_SLUG,
+    CATALOG_EXPORT_ENABLED=False,
+)
+class AssortmentBatchTests(TestCase):
+    def setUp(self):
+        self.moysklad = FakeMoySklad()
+        patcher = mock.patch.object(MoySkladClient, "_request", self.moysklad.request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ids = [f"00000000-0000-4000-8000-{index:012d}" for index in range(250)]
+        self.moysklad.rows = {external_id: assortment_row(external_id, "Товар", stock=3) for external_id in self.ids}
+
+    def test_ids_are_chunked_to_request_limit(self):
+        rows = MoySkladClient().get_assortment_by_ids(self.ids, expand="images,productFolder")
+
+        self.assertEqual([row["id"] for row in rows], self.ids)
+        self.assertEqual(self.moysklad.count("/entity/assortment"), 3)
+
+    @override_settings(MOYSKLAD_STOCK_BATCH_SIZE=1000)
+    def test_stock_sync_caps_batch_size(self):
+        category = Category.objects.create(slug=SITE_CATEGORY_SLUG, name=SITE_CATEGORY_NAME)
+        Product.objects.bulk_create(
+            [Product(category=category, name="Товар", description="", price=100, moysklad_id=external_id) for external_id in self.ids]
+        )
+
+        result = sync_product_stocks()
+
+        self.assertEqual((result["updated"], result["missing"], result["requests"]), (250, 0, 3))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, MOYSKLAD_SITE_SYNC_ENABLED=False, CATALOG_EXPORT_ENABLED=False)
+class ProductAdminIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(slug="creams", name="Кремы")
+        self.admin = ProductAdmin(Product, admin_site)
+        self.request = RequestFactory().post("/admin/shop/product/")
+        self.request.user = get_user_model().objects.create_superuser("admin", "admin@example.com", "pass")
+
+    def _suggested_ids(self):
+        return [entry["id"] for entry in suggest.suggest("крем")["products"]]
+
+    def test_save_and_delete_refresh_search_and_suggest_lazily(self):
+        suggest.rebuild_suggest_index()
+        product = Product(category=self.category, name="Крем для рук", description="", price=100)
+        with mock.patch.object(suggest, "_load_entries", wraps=suggest._load_entries) as load_entries:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.admin.save_model(self.request, product, None, False)
+            self.assertEqual(load_entries.call_count, 0)
+            self.assertEqual(search_product_ids("крем"), [product.id])
+            self.assertEqual(self._suggested_ids(), [product.id])
+            self.assertEqual(load_entries.call_count, 1)
+
+            product_id = product.id
+            with self.captureOnCommitCallbacks(execute=True):
+                self.admin.delete_model(self.request, product)
+            self.assertEqual(load_entries.call_count, 1)
+            self.assertEqual(search_product_ids("крем"), [])
+            self.assertNotIn(product_id, self._suggested_ids())
+            self.assertEqual(load_entries.call_count, 2)
+
+
+class SearchFallbackTests(TestCase):
+    def test_index_error_keeps_transaction_usable(self):
+        category = Category.objects.create(slug="creams", name="Кремы")
+        Product.objects.create(category=category, name="Крем", description="", price=100)
+
+        with transaction.atomic(), mock.patch.object(search, "SQLITE_TABLE", "missing_fts"):
+            with self.assertLogs("shop.search", level="WARNING"):
+                self.assertIsNone(search_product_ids("крем"))
+            self.assertEqual(Product.objects.filter(name__icontains="Крем").count(), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, MOYSKLAD_SITE_SYNC_ENABLED=False)
+class CatalogExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir, True)
+
+    def _exported(self, name):
+        with open(os.path.join(self.output_dir, name), "rb") as export_file:
+            return json.loads(export_file.read())
+
+    def test_export_matches_api_responses(self):
+        Category.objects.create(slug="creams", name="Кремы", image="categories/creams.jpg")
+        Category.objects.create(slug="masks", name="Маски")
+        ProductSubcategory.objects.create(code="90", name="Уход", parent_code="")
+        ProductSubcategory.objects.create(code="90.1", name="Кремы", parent_code="90")
+
+        export_static_catalog(output_dir=self.output_dir, base_url="http://testserver")
+
+        self.assertEqual(self._exported("categories.json"), self.client.get("/api/categories/").json())
+        self.assertEqual(
+            self._exported("subcategory-tree.json"),
+            self.client.get("/api/product-subcategories/tree/").json(),
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHES, MOYSKLAD_SITE_SYNC_ENABLED=False)
+class ProductDetailFieldsTests(TestCase):
+    def test_detail_skips_heavy_columns_outside_fields(self):
+        cache.clear()
+        category = Category.objects.create(slug="creams", name="Кремы")
+        product = Product.objects.create(category=category, name="Крем", description="Длинное описание", price=100)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/api/products/{product.id}/?fields=id,name")
+
+        self.assertEqual(response.json(), {"id": product.id, "name": "Крем"})
+        product_queries = [query["sql"] for query in queries if 'FROM "shop_product"' in query["sql"]]
+        self.assertTrue(product_queries)
+        self.assertFalse([sql for sql in product_queries if '"description"' in sql])
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    PRODUCT_IMAGE_VARIANT_WIDTHS="",
+    MOYSKLAD_TOKEN="test-token",
+    MOYSKLAD_IMAGE_PROXY_REDIRECT_ONLY=False,
+)
+class ImageProxyCacheTests(TestCase):
+    URL = "https://api.moysklad.ru/api/remap/1.2/download/1"
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        cache_dir = override_settings(IMAGE_PROXY_CACHE_DIR=self.cache_dir)
+        cache_dir.enable()
+        self.addCleanup(cache_dir.disable)
+        self.payload = png_bytes(4, 4)
+
+    def test_hit_survives_eviction_after_lookup(self):
+        image_cache.put(self.URL, self.payload, "image/png")
+        body_file, content_type, _key = image_cache.get(self.URL)
+
+        image_cache.evict(limit=0)
+
+        with body_file:
+            self.assertEqual(body_file.read(), self.payload)
+        self.assertEqual(content_type, "image/png")
+        self.assertIsNone(image_cache.get(self.URL))
+
+    def test_evicted_body_is_a_miss(self):
+        category = Category.objects.create(slug="creams", name="Кремы")
+        product = Product.objects.create(category=category, name="Крем", description="", price=100, external_image_url=self.URL)
+        image_cache.put(self.URL, self.payload, "image/png")
+        # Вытеснение удалило тело, но оставило .type — запись должна считаться промахом.
+        os.remove(os.path.join(self.cache_dir, image_cache.cache_key(self.URL)[:2], image_cache.cache_key(self.URL)))
+
+        client = FakeImageClient({self.URL: self.payload})
+        with mock.patch.object(views, "MoySkladClient", lambda: client):
+            response = self.client.get(f"/api/products/{product.id}/image/")
+
+        self.assertEqual(response["X-Image-Cache"], "miss")
+        self.assertEqual(response.content, self.payload)
+        self.assertIsNone(image_cache.get_negative(product.id))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, MOYSKLAD_SITE_SYNC_ENABLED=False)
+class CatalogCursorPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(slug="creams", name="Кремы")
+        products = Product.objects.bulk_create(
+            [Product(category=category, name=f"Крем {index}", description="", price=100 + index) for index in range(7)]
+        )
+        # Одинаковый created_at у части строк: границы страниц держатся на id.
+        Product.objects.filter(id__in=[product.id for product in products[:4]]).update(created_at=products[0].created_at)
+        refresh_search_index()
+
+    def _walk(self, url):
+        ids, pages = [], []
+        while url:
+            body = self.client.get(url).json()
+            pages.append(body)
+            ids.extend(item["id"] for item in body["results"])
+            url = body["next"]
+        return ids, pages
+
+    def test_keyset_pages_cover_catalog_once(self):
+        expected = list(Product.objects.order_by("-created_at", "-id").values_list("id", flat=True))
+
+        ids, pages = self._walk("/api/products/?pagination=cursor&page_size=3")
+
+        self.assertEqual(ids, expected)
+        self.assertEqual([len(page["results"]) for page in pages], [3, 3, 1])
+        self.assertIsNone(pages[0]["previous"])
+        previous = self.client.get(pages[1]["previous"]).json()
+        self.assertEqual(previous["results"], pages[0]["results"])
+
+    def test_price_ordering_pages(self):
+        expected = list(Product.objects.order_by("price", "id").values_list("id", flat=True))
+
+        ids, _pages = self._walk("/api/products/?pagination=cursor&page_size=2&ordering=price")
+
+        self.assertEqual(ids, expected)
+
+    def test_relevance_ordering_falls_back_to_offset(self):
+        expected = search_product_ids("крем")
+
+        ids, pages = self._walk("/api/products/?pagination=cursor&page_size=3&q=%D0%BA%D1%80%D0%B5%D0%BC")
+
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(ids), 7)
+        # Первая страница по смещению — ссылка без cursor, а не курсор на смещение 0.
+        self.assertNotIn("cursor=", pages[1]["previous"])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, MOYSKLAD_SITE_SYNC_ENABLED=False, CATALOG_FACET_PRICE_BUCKETS="500,1000")
+class CatalogFacetsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(slug="creams", name="Кремы")
+        ProductSubcategory.objects.create(code="90", name="Уход", parent_code="")
+        face = ProductSubcategory.objects.create(code="90.1", name="Лицо", parent_code="90")
+        body = ProductSubcategory.objects.create(code="90.2", name="Тело", parent_code="90")
+        rows = [
+            (face, 5, True, 400),
+            (face, 0, False, 700),
+            (face, 3, False, 1200),
+            (body, 2, True, 1500),
+            (None, 1, False, 300),
+        ]
+        for index, (subcategory, stock, is_new, price) in enumerate(rows):
+            Product.objects.create(
+                category=category, product_subcategory=subcategory, name=f"Крем {index}", description="",
+                stock=stock, is_new=is_new, price=price,
+            )
+
+    def _facets(self):
+        return self.client.get("/api/products/facets/?subcategory=90.1&in_stock=true").json()
+
+    def test_each_facet_ignores_only_its_own_filter(self):
+        in_face = Product.objects.filter(product_subcategory__code="90.1")
+        in_stock = Product.objects.filter(stock__gt=0)
+
+        facets = self._facets()
+
+        self.assertEqual(facets["total"], in_face.filter(stock__gt=0).count())
+        self.assertEqual(
+            facets["subcategories"],
+            [
+                {"code": "90.1", "parent_code": "90", "count": in_stock.filter(product_subcategory__code="90.1").count()},
+                {"code": "90.2", "parent_code": "90", "count": in_stock.filter(product_subcategory__code="90.2").count()},
+            ],
+        )
+        self.assertEqual(facets["parents"], [{"code": "90", "count": in_stock.filter(product_subcategory__isnull=False).count()}])
+        self.assertEqual(facets["in_stock"], in_face.filter(stock__gt=0).count())
+        self.assertEqual(facets["is_new"], in_face.filter(stock__gt=0, is_new=True).count())
+        self.assertEqual(
+            [bucket["count"] for bucket in facets["price"]["histogram"]],
+            [
+                in_face.filter(stock__gt=0, price__lt=500).count(),
+                in_face.filter(stock__gt=0, price__gte=500, price__lt=1000).count(),
+                in_face.filter(stock__gt=0, price__gte=1000).count(),
+            ],
+        )
+
+    def test_engine_and_sql_paths_agree(self):
+        with override_settings(CATALOG_ENGINE_ENABLED=False):
+            sql_facets = self._facets()
+        cache.clear()
+        with override_settings(CATALOG_ENGINE_ENABLED=True):
+            engine_facets = self._facets()
+
+        self.assertEqual(engine_facets, sql_facets)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, MOYSKLAD_SITE_SYNC_ENABLED=False)
+class CatalogResponseCacheTests(TestCase):
+    URL = "/api/products/?page_size=10"
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(slug="creams", name="Кремы")
+        self.product = Product.objects.create(category=category, name="Крем", description="", price=100)
+
+    def test_etag_and_cache_follow_catalog_generation(self):
+        first = self.client.get(self.URL)
+        second = self.client.get(self.URL)
+        not_modified = self.client.get(self.URL, HTTP_IF_NONE_MATCH=first["ETag"])
+
+        self.assertEqual((first["X-Catalog-Cache"], second["X-Catalog-Cache"]), ("miss", "hit"))
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b"")
+
+        Product.objects.filter(id=self.product.id).update(name="Крем для рук")
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_catalog_generation()
+        changed = self.client.get(self.URL, HTTP_IF_NONE_MATCH=first["ETag"])
+
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], first["ETag"])
+        self.assertEqual(changed["X-Catalog-Cache"], "miss")
+        self.assertEqual(changed.json()["results"][0]["name"], "Крем для рук")
+
+    def test_cached_body_is_personalized_per_user(self):
+        user = get_user_model().objects.create_user("buyer", "buyer@example.com", "pass")
+        ProductRating.objects.create(product=self.product, user=user, rating=4)
+        _instance, token = AuthToken.objects.create(user)
+
+        anonymous = self.client.get(self.URL)
+        personal = self.client.get(self.URL, HTTP_AUTHORIZATION=f"Token {token}")
+
+        self.assertEqual(anonymous.json()["results"][0]["user_rating"], None)
+        self.assertEqual(personal.json()["results"][0]["user_rating"], 4)
+        self.assertNotEqual(personal["ETag"], anonymous["ETag"])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PRODUCT_IMAGE_VARIANT_WIDTHS="200,400")
+class ProductRowSerializerTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        category = Category.objects.create(slug="face", name="Лицо")
+        subcategory = ProductSubcategory.objects.create(code="90.1", name="Кремы", parent_code="90")
+        local = Product(category=category, product_subcategory=subcategory, name="Крем", description="Описание", price=Decimal("990.50"), stock=3)
+        local.image.save("cream.png", ContentFile(png_bytes(800, 400)), save=False)
+        with mock.patch("shop.signals.ensure_product_variants_in_background"), self.captureOnCommitCallbacks(execute=True):
+            local.save()
+        image_variants.ensure_product_variants(local.id)
+        Product.objects.create(
+            category=category, name="Маска", description="", price=100, discount=15,
+            external_image_url="https://api.moysklad.ru/api/remap/1.2/download/1",
+        )
+        Product.objects.create(category=category, name="Тоник", description="", price=250, is_bestseller=True)
+        self.user = get_user_model().objects.create_user("buyer", "buyer@example.com", "pass")
+        ProductRating.objects.create(product=local, user=self.user, rating=5)
+        self.queryset = Product.objects.order_by("id")
+
+    def _request(self, user=None):
+        request = RequestFactory().get("/api/products/")
+        request.user = user or mock.Mock(is_authenticated=False)
+        return request
+
+    def test_rows_match_model_serializers(self):
+        self.assertTrue(Product.objects.get(name="Крем").image_variants)
+        for serializer_class in (ProductSerializer, ProductCardSerializer):
+            for user in (None, self.user):
+                with self.subTest(serializer=serializer_class.__name__, user=user):
+                    request = self._request(user)
+                    expected = serializer_class(self.queryset, many=True, context={"request": request}).data
+                    rows = ProductRowSerializer(serializer_class.Meta.fields, request)
+                    actual = rows.serialize(rows.values(self.queryset))
+                    self.assertEqual(json.loads(json.dumps(actual)), json.loads(json.dumps(expected)))
+
+
+class FakeClock:
+    """Подменяет модуль time в ограничителе: sleep() сдвигает часы вместо ожидания."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 3))
+        self.now += seconds
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    MOYSKLAD_RATE_LIMIT_REQUESTS=2,
+    MOYSKLAD_RATE_LIMIT_INTERVAL_SECONDS=1,
+    MOYSKLAD_MAX_PARALLEL_REQUESTS=2,
+    MOYSKLAD_RATE_LIMIT_SHARED=False,
+)
+class RateLimiterTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch("shop.moysklad_rate_limit.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.limiter = RateLimiter()
+
+    def _request(self):
+        with self.limiter.slot():
+            pass
+
+    def test_bucket_paces_requests_after_burst(self):
+        for _ in range(4):
+            self._request()
+
+        # Два запроса из полного бюджета, дальше — по одному на 0.5 с (2 запроса в секунду).
+        self.assertEqual(self.clock.sleeps, [0.5, 0.5])
+        self.assertEqual(self.limiter.stats()["requests"], 4)
+        self.assertEqual(self.limiter.stats()["throttled_seconds"], 1.0)
+
+    def test_429_blocks_for_retry_after(self):
+        self._request()
+        self.assertEqual(self.limiter.observe(429, {"Retry-After": "2"}), 2.0)
+
+        self._request()
+
+        self.assertEqual(sum(self.clock.sleeps), 2.0)
+        self.assertEqual(self.limiter.stats()["rate_limited"], 1)
+
+    def test_429_falls_back_to_lognex_headers(self):
+        self.assertEqual(self.limiter.observe(429, {"X-Lognex-Retry-After": "1500"}), 1.5)
+        self.assertEqual(self.limiter.observe(429, {"X-Lognex-Reset": "700"}), 0.7)
+
+    def test_headers_refine_budget(self):
+        self._request()
+        self.assertIsNone(
+            self.limiter.observe(
+                200,
+                {
+                    "X-RateLimit-Limit": "10",
+                    "X-Lognex-Retry-TimeInterval": "5000",
+                    "X-RateLimit-Remaining": "0",
+                    "X-Lognex-Reset": "1200",
+                },
+            )
+        )
+
+        self._request()
+
+        stats = self.limiter.stats()
+        self.assertEqual((stats["limit"], stats["interval_seconds"]), (10, 5.0))
+        # Остаток 0 — ждём сброса окна, хотя своих запросов сделано меньше лимита.
+        self.assertEqual(sum(self.clock.sleeps), 1.2)
+
+    @override_settings(MOYSKLAD_TOKEN="test-token", MOYSKLAD_MAX_RETRIES=2)
+    def test_client_retries_429_after_retry_after_only(self):
+        responses = [
+            (429, "Too Many Requests", {"Retry-After": "1"}, b""),
+            (200, "OK", {"X-RateLimit-Remaining": "40"}, b'{"rows": []}'),
+        ]
+        with mock.patch("shop.moysklad.rate_limiter", self.limiter), mock.patch.object(
+            MoySkladClient, "_send", side_effect=responses
+        ) as send, mock.patch("shop.moysklad.time.sleep") as fixed_delay:
+            self.assertEqual(MoySkladClient()._request("GET", "/entity/assortment"), {"rows": []})
+
+        self.assertEqual(send.call_count, 2)
+        self.assertEqual(self.clock.sleeps, [1.0])
+        fixed_delay.assert_not_called()
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    MOYSKLAD_TOKEN="test-token",
+    MOYSKLAD_MAX_RETRIES=0,
+    MOYSKLAD_SITE_CATEGORY_NAME=SITE_CATEGORY_NAME,
+    MOYSKLAD_SITE_CATEGORY_SLUG=SITE_CATEGORY_SLUG,
+    MOYSKLAD_USE_FOLDER_TREE_FILTER=False,
+    MOYSKLAD_SYNC_SAVE_LOCAL_IMAGES=False,
+    MOYSKLAD_FULL_RECONCILE_HOURS=24,
+    OPENAI_CATEGORIZE_ENABLED=False,
+    CATALOG_EXPORT_ENABLED=False,
+)
+class SiteSyncTests(TestCase):
+    IDS = [f"00000000-0000-4000-8000-00000000000{index}" for index in range(1, 4)]
+    OLD = "2000-01-01 00:00:00.000"
+    NEW = "2999-01-01 00:00:00.000"
+
+    def setUp(self):
+        cache.clear()
+        self.moysklad = FakeMoySklad()
+        patcher = mock.patch.object(MoySkladClient, "_request", self.moysklad.request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for index, external_id in enumerate(self.IDS, start=1):
+            self.moysklad.rows[external_id] = dict(assortment_row(external_id, f"Товар {index}", stock=index), updated=self.OLD)
+
+    def sync(self, incremental=False):
+        with self.captureOnCommitCallbacks(execute=True):
+            return sync_site_products(force=True, run_openai_enrichment=False, incremental=incremental)
+
+    def _assortment_filters(self):
+        return [query.get("filter", "") for path, query in self.moysklad.queries if path == "/entity/assortment"]
+
+    def test_unchanged_rows_are_skipped_by_content_hash(self):
+        first = self.sync()
+        second = self.sync()
+
+        self.assertEqual((first["created"], first["unchanged"]), (3, 0))
+        self.assertEqual((second["created"], second["updated"], second["unchanged"]), (0, 0, 3))
+        generations = set(Product.objects.values_list("sync_generation", flat=True))
+        self.assertEqual(len(generations), 1)
+
+    def test_delta_requests_only_rows_after_watermark(self):
+        self.sync()
+        self.moysklad.rows[self.IDS[0]].update(salePrices=[{"value": 150000}], updated=self.NEW)
+        del self.moysklad.rows[self.IDS[2]]
+        self.moysklad.queries.clear()
+
+        delta = self.sync(incremental=True)
+
+        self.assertEqual(delta["mode"], "delta")
+        self.assertTrue(all(value.startswith("updated>=") for value in self._assortment_filters()))
+        self.assertEqual((delta["processed_rows"], delta["updated"], delta["unchanged"]), (1, 1, 0))
+        self.assertEqual(Product.objects.get(moysklad_id=self.IDS[0]).price, Decimal("1500"))
+        # Пропавшая строка не удаляется: выдача дельты неполная.
+        self.assertEqual(delta["deleted"], 0)
+        self.assertTrue(Product.objects.filter(moysklad_id=self.IDS[2]).exists())
+
+    def test_delta_falls_back_to_full_without_recent_reconcile(self):
+        delta = self.sync(incremental=True)
+
+        self.assertEqual(delta["mode"], "full")
+        self.assertEqual(self._assortment_filters(), [""])
+
+    def test_full_reconcile_removes_stale_rows(self):
+        self.sync()
+        ordered = Product.objects.get(moysklad_id=self.IDS[1])
+        order = Order.objects.create(full_name="Покупатель", phone="+70000000000", city="Москва", street="Улица", house="1")
+        OrderItem.objects.create(order=order, product=ordered, title="Товар 2", price=100)
+        del self.moysklad.rows[self.IDS[1]]
+        del self.moysklad.rows[self.IDS[2]]
+
+        full = self.sync()
+
+        self.assertEqual((full["deleted"], full["hidden_protected"]), (1, 1))
+        self.assertFalse(Product.objects.filter(moysklad_id=self.IDS[2]).exists())
+        ordered.refresh_from_db()
+        self.assertEqual((ordered.moysklad_id, ordered.stock), (None, 0))
+        self.assertEqual(list(Product.objects.filter(moysklad_id__isnull=False).values_list("moysklad_id", flat=True)), [self.IDS[0]])
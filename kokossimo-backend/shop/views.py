@@ -9,15 +9,19 @@ from django.contrib.auth import authenticate, get_user_model
 from django.conf import settings
 from django.core.mail import send_mail
 from django.core import signing
+from django.core.cache import cache
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
 import secrets
-from django.db.models import Q, Avg, Count, Min, Max, Prefetch
+from django.db.models import Q, Min, Max, Count, Prefetch, Case, When, Value, IntegerField
 from django.db import transaction
 from decimal import Decimal, InvalidOperation
 from django.shortcuts import get_object_or_404
-from django.http import JsonResponse, HttpResponse, HttpResponseRedirect
+from django.http import FileResponse, JsonResponse, HttpResponse, HttpResponseRedirect
+from django.utils.cache import get_conditional_response
 import base64
+import json
+import os
 import logging
 import uuid
 from decimal import ROUND_HALF_UP
@@ -25,7 +29,23 @@ from decimal import ROUND_HALF_UP
 from yookassa import Configuration, Payment
 
 from .models import Product, Category, Profile, Order, EmailVerificationCode, ProductRating, ProductSubcategory, Cart, CartItem, FavoriteList, FavoriteItem
+from . import delivery_cities
+from . import image_cache
+from . import image_variants
 from .delivery_cities import DELIVERY_CITIES
+from .search import search_match_subquery, search_product_ids, search_results_cap
+from .suggest import suggest as suggest_catalog
+from .pagination import CatalogCursorPagination, _order_fields
+from .facets import build_facets, filter_signature, price_bucket_bounds
+from .catalog_engine import get_catalog_engine
+from .fast_serializers import ProductRowSerializer, ProductImageUrls, CART_PRODUCT_COLUMNS, FAVORITE_PRODUCT_COLUMNS
+from .catalog_cache import (
+    cached_catalog_response,
+    conditional_catalog_response,
+    conditional_response,
+    get_catalog_generation,
+    make_etag,
+)
 
 logger = logging.getLogger(__name__)
 # Миниатюра 1×1 прозрачный GIF — чтобы при ошибках отдавать изображение, а не JSON,
@@ -51,11 +71,15 @@ def _placeholder_image_response(reason=""):
     if reason:
         resp["X-Image-Proxy-Reason"] = reason
     return resp
-from .moysklad import MoySkladClient, MoySkladError, MoySkladConfigError
+from .moysklad import MoySkladClient, MoySkladError, MoySkladConfigError, http_pool_stats
+from .moysklad_rate_limit import rate_limiter
+from . import moysklad_webhooks
 from .serializers import (
     ProductSerializer,
+    ProductCardSerializer,
     CategorySerializer,
     ProductSubcategorySerializer,
+    build_subcategory_tree,
     RegisterSerializer,
     LoginSerializer,
     EmailCodeSendSerializer,
@@ -169,43 +193,33 @@ def _create_yookassa_payment(order, request):
     return payment, confirmation_url
 
 
-def _cart_item_image_url(product, request):
-    if not product:
-        return None
-    if product.image:
-        if request:
-            return request.build_absolute_uri(product.image.url)
-        return f"{settings.MEDIA_URL}{product.image}"
-    if getattr(product, "external_image_url", ""):
-        if request:
-            return request.build_absolute_uri(f"/api/products/{product.id}/image/")
-        return f"/api/products/{product.id}/image/"
-    return None
-
-
-def _cart_item_public_payload(item, request):
-    if item.product_id:
-        product = item.product
+def _cart_item_public_payload(row, image_urls):
+    """row — строка CartItem из .values() с колонками товара (CART_PRODUCT_COLUMNS)."""
+    if row["product_id"]:
         return {
-            "id": product.id,
-            "name": product.name,
-            "price": str(product.price),
-            "discount": int(product.discount or 0),
-            "image": _cart_item_image_url(product, request),
-            "quantity": int(item.quantity or 0),
-            "stock": int(product.stock or 0),
+            "id": row["product_id"],
+            "name": row["product__name"],
+            "price": str(row["product__price"]),
+            "discount": int(row["product__discount"] or 0),
+            "image": image_urls.image(row["product_id"], row["product__image"], row["product__external_image_url"]),
+            "image_srcset": image_urls.srcset(
+                row["product__image"], row["product__external_image_url"], row["product__image_variants"]
+            ),
+            "quantity": int(row["quantity"] or 0),
+            "stock": int(row["product__stock"] or 0),
             "is_gift_certificate": False,
         }
 
-    gift_title = (item.title or "Подарочный сертификат").strip() or "Подарочный сертификат"
-    gift_id = (item.external_id or "").strip() or f"gift-{int(item.unit_price)}"
+    gift_title = (row["title"] or "Подарочный сертификат").strip() or "Подарочный сертификат"
+    gift_id = (row["external_id"] or "").strip() or f"gift-{int(row['unit_price'])}"
     return {
         "id": gift_id,
         "name": gift_title,
-        "price": str(item.unit_price),
+        "price": str(row["unit_price"]),
         "discount": 0,
         "image": None,
-        "quantity": int(item.quantity or 0),
+        "image_srcset": None,
+        "quantity": int(row["quantity"] or 0),
         "stock": None,
         "is_gift_certificate": True,
     }
@@ -351,40 +365,44 @@ def _upsert_user_cart(user, incoming_items, merge=False):
 @transaction.atomic
 def _get_user_cart_payload(user, request):
     cart, _ = Cart.objects.select_for_update().get_or_create(user=user)
-    items = list(cart.items.select_related("product"))
-    touched = False
+    items = list(
+        cart.items.values(
+            "id", "product_id", "quantity", "title", "unit_price", "external_id", *CART_PRODUCT_COLUMNS
+        )
+    )
 
     # Корректируем устаревшие строки корзины (товар удален / остаток уменьшился).
     for row in items:
-        if not row.product_id:
+        if not row["product_id"]:
             continue
-        stock = max(0, int(row.product.stock or 0))
-        if int(row.quantity or 0) > stock:
+        stock = max(0, int(row["product__stock"] or 0))
+        if int(row["quantity"] or 0) > stock:
             # Не удаляем позиции с нулевым остатком — UI должен подсветить их как недоступные.
             # При частичном остатке корректируем количество, чтобы не превышало доступное.
             if stock > 0:
-                row.quantity = stock
-                row.save(update_fields=["quantity", "updated_at"])
-                touched = True
-
-    if touched:
-        items = list(cart.items.select_related("product"))
+                CartItem.objects.filter(id=row["id"]).update(quantity=stock, updated_at=timezone.now())
+                row["quantity"] = stock
 
+    image_urls = ProductImageUrls(request)
     return {
         "user_id": user.id,
-        "items": [_cart_item_public_payload(row, request) for row in items],
+        "items": [_cart_item_public_payload(row, image_urls) for row in items],
     }
 
 
-def _favorite_item_public_payload(product, request):
+def _favorite_item_public_payload(row, image_urls):
+    """row — строка FavoriteItem из .values() с колонками товара (FAVORITE_PRODUCT_COLUMNS)."""
     return {
-        "id": product.id,
-        "name": product.name,
-        "price": str(product.price),
-        "image": _cart_item_image_url(product, request),
-        "description": product.description,
-        "is_new": bool(product.is_new),
-        "discount": int(product.discount or 0),
+        "id": row["product_id"],
+        "name": row["product__name"],
+        "price": str(row["product__price"]),
+        "image": image_urls.image(row["product_id"], row["product__image"], row["product__external_image_url"]),
+        "image_srcset": image_urls.srcset(
+            row["product__image"], row["product__external_image_url"], row["product__image_variants"]
+        ),
+        "description": row["product__description"],
+        "is_new": bool(row["product__is_new"]),
+        "discount": int(row["product__discount"] or 0),
         "is_gift_certificate": False,
     }
 
@@ -422,15 +440,16 @@ def _upsert_user_favorites(user, incoming_product_ids, merge=False):
 
 def _get_user_favorites_payload(user, request):
     favorite_list, _ = FavoriteList.objects.get_or_create(user=user)
-    items = (
+    rows = (
         favorite_list.items
-        .select_related("product")
+        .filter(product__isnull=False)
         .order_by("-created_at")
+        .values("product_id", *FAVORITE_PRODUCT_COLUMNS)
     )
-    products = [item.product for item in items if item.product_id]
+    image_urls = ProductImageUrls(request)
     return {
         "user_id": user.id,
-        "items": [_favorite_item_public_payload(product, request) for product in products],
+        "items": [_favorite_item_public_payload(row, image_urls) for row in rows],
     }
 
 
@@ -443,6 +462,20 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
             return Category.objects.filter(slug=getattr(settings, "MOYSKLAD_SITE_CATEGORY_SLUG", "site-kokossimo"))
         return Category.objects.all()
 
+    def list(self, request, *args, **kwargs):
+        return conditional_catalog_response(
+            request,
+            "categories",
+            lambda: cached_catalog_response(request, "categories", lambda: super(CategoryViewSet, self).list(request, *args, **kwargs)),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return conditional_catalog_response(
+            request,
+            "category",
+            lambda: cached_catalog_response(request, "category", lambda: super(CategoryViewSet, self).retrieve(request, *args, **kwargs)),
+        )
+
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['request'] = self.request
@@ -457,25 +490,11 @@ class ProductSubcategoryViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=False, methods=["get"], url_path="tree")
     def tree(self, request):
         """Дерево: большие категории (1–4) с вложенными подкатегориями (1.1, 1.2, …)."""
-        parents = ProductSubcategory.objects.filter(parent_code="").order_by("code")
-        children_map = {}
-        for sub in ProductSubcategory.objects.exclude(parent_code="").order_by("code"):
-            children_map.setdefault(sub.parent_code, []).append({
-                "id": sub.id,
-                "code": sub.code,
-                "name": sub.name,
-                "parent_code": sub.parent_code,
-            })
-        result = []
-        for p in parents:
-            result.append({
-                "id": p.id,
-                "code": p.code,
-                "name": p.name,
-                "parent_code": p.parent_code or "",
-                "children": children_map.get(p.code, []),
-            })
-        return Response(result)
+        return conditional_catalog_response(
+            request,
+            "subcategory-tree",
+            lambda: cached_catalog_response(request, "subcategory-tree", lambda: Response(build_subcategory_tree())),
+        )
 
 
 class ProductViewSet(viewsets.ReadOnlyModelViewSet):
@@ -484,13 +503,106 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         page_size_query_param = "page_size"
         max_page_size = 60
 
-    queryset = Product.objects.annotate(
-        rating_avg=Avg('ratings__rating'),
-        rating_count=Count('ratings')
-    )
+    queryset = Product.objects.all()
     serializer_class = ProductSerializer
     pagination_class = CatalogPagination
 
+    @property
+    def paginator(self):
+        """?pagination=cursor (или ?cursor=...) — keyset-пагинация без COUNT/OFFSET, иначе постраничная."""
+        if not hasattr(self, "_paginator"):
+            params = self.request.query_params
+            if params.get("pagination") == "cursor" or params.get("cursor"):
+                self._paginator = CatalogCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    @staticmethod
+    def _response_items(data):
+        """Товары в теле ответа списка: постраничный dict с results или просто список."""
+        if isinstance(data, dict):
+            return data.get("results") or []
+        return data or []
+
+    def _strip_user_ratings(self, data):
+        for item in self._response_items(data):
+            if "user_rating" in item:
+                item["user_rating"] = None
+        return data
+
+    def _apply_user_ratings(self, data, request):
+        """Дополняет закэшированный анонимный ответ оценками текущего пользователя (один запрос)."""
+        items = [item for item in self._response_items(data) if "user_rating" in item and "id" in item]
+        if not items:
+            return data
+        ratings = dict(
+            ProductRating.objects.filter(
+                user_id=request.user.id,
+                product_id__in=[item["id"] for item in items],
+            ).values_list("product_id", "rating")
+        )
+        for item in items:
+            item["user_rating"] = ratings.get(item["id"])
+        return data
+
+    def list(self, request, *args, **kwargs):
+        return conditional_catalog_response(
+            request,
+            "products",
+            lambda: cached_catalog_response(
+                request,
+                "products",
+                lambda: self._fast_list(request),
+                anonymize=self._strip_user_ratings,
+                personalize=self._apply_user_ratings,
+            ),
+            personal=True,
+        )
+
+    def _fast_list(self, request):
+        """
+        Список через ProductRowSerializer (shop/fast_serializers.py): строки из .values(),
+        без создания моделей и полей DRF. Результат совпадает с get_serializer(many=True).
+        """
+        fields, omit = self._sparse_fieldset()
+        base_fields = ProductSerializer.Meta.fields if fields else self.get_serializer_class().Meta.fields
+        output = [name for name in base_fields if (not fields or name in fields) and name not in omit]
+        row_serializer = ProductRowSerializer(output, request)
+        filters = self._catalog_filters()
+        engine = None if isinstance(self.paginator, CatalogCursorPagination) else self._catalog_engine(filters)
+        if engine is not None:
+            # Выборка и сортировка — в снимке; из БД только строки страницы по первичным ключам.
+            engine, ranked_ids = engine
+            ids = engine.ordered_ids(filters, ranked_ids)
+            page_ids = self.paginate_queryset(ids)
+            wanted = ids if page_ids is None else page_ids
+            rows = row_serializer.values(Product.objects.filter(id__in=wanted), extra_columns=("id",))
+            by_id = {row["id"]: row for row in rows}
+            data = row_serializer.serialize(by_id[pk] for pk in wanted if pk in by_id)
+            if page_ids is None:
+                return Response(data)
+            return self.get_paginated_response(data)
+
+        queryset = self._filtered_queryset(filters)
+        # Колонки ключа keyset-пагинации (сортировка + id, который _order_fields добавляет всегда).
+        order_columns = [name for name, _ in _order_fields(queryset) or []]
+        if "id" not in order_columns:
+            order_columns.append("id")
+        rows = row_serializer.values(queryset, extra_columns=order_columns)
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(row_serializer.serialize(rows))
+        return self.get_paginated_response(row_serializer.serialize(page))
+
+    def retrieve(self, request, *args, **kwargs):
+        return conditional_catalog_response(
+            request,
+            "product",
+            lambda: super(ProductViewSet, self).retrieve(request, *args, **kwargs),
+            personal=True,
+        )
+
     def _with_user_rating_prefetch(self, queryset):
         if not self.request.user.is_authenticated:
             return queryset
@@ -504,16 +616,53 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
             Prefetch("ratings", queryset=user_ratings_qs, to_attr="current_user_ratings")
         )
 
-    def get_queryset(self):
-        subcategory_codes = self.request.query_params.getlist('subcategory')
-        parent_codes = self.request.query_params.getlist('parent')
-        price_min = self.request.query_params.get("price_min")
-        price_max = self.request.query_params.get("price_max")
-        search_q = (self.request.query_params.get("q") or "").strip()
-        ordering = (self.request.query_params.get("ordering") or "").strip()
-        is_new = self.request.query_params.get('is_new', None)
-        is_bestseller = self.request.query_params.get('is_bestseller', None)
-        in_stock = self.request.query_params.get('in_stock', None)
+    def _apply_search(self, queryset, search_q, rank=True):
+        """
+        Полнотекстовый поиск (shop/search.py) с сортировкой по релевантности.
+        Явный ?ordering= имеет приоритет над релевантностью.
+        Если индекс недоступен — прежний icontains по названию и описанию.
+        """
+        if not search_q:
+            return queryset
+        # Лимит ранжирования применяется к совпадениям внутри уже отфильтрованной выборки.
+        ranked_ids = search_product_ids(search_q, within=queryset)
+        if ranked_ids is None:
+            return queryset.filter(
+                Q(name__icontains=search_q) | Q(description__icontains=search_q)
+            )
+        if len(ranked_ids) >= search_results_cap():
+            # Совпадений больше лимита: выборка — все совпадения, по релевантности идут первые ranked_ids.
+            queryset = queryset.filter(id__in=search_match_subquery(search_q))
+        else:
+            queryset = queryset.filter(id__in=ranked_ids)
+        if rank and ranked_ids:
+            relevance = Case(
+                *[When(id=product_id, then=Value(position)) for position, product_id in enumerate(ranked_ids)],
+                default=Value(len(ranked_ids)),
+                output_field=IntegerField(),
+            )
+            queryset = queryset.order_by(relevance, '-id')
+        return queryset
+
+    def _catalog_engine(self, filters):
+        """
+        (engine, ranked_ids) для ответа из колоночного снимка каталога (shop/catalog_engine.py)
+        или None — тогда выборка идёт через SQL (движок выключен, поиск без индекса).
+        """
+        engine = get_catalog_engine()
+        if engine is None:
+            return None
+        ranked_ids = None
+        if filters["search_q"]:
+            # Снимок фильтрует в памяти, поэтому нужны все совпадения, а не первые CATALOG_SEARCH_MAX_RESULTS.
+            ranked_ids = search_product_ids(filters["search_q"], limit=0)
+            if ranked_ids is None:
+                return None
+        return engine, ranked_ids
+
+    def _catalog_filters(self):
+        """Разбор query-параметров каталога (общий для списка, price-range и facets)."""
+        params = self.request.query_params
 
         def _parse_decimal(value):
             if value is None:
@@ -526,13 +675,34 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
             except (InvalidOperation, ValueError):
                 return None
 
+        return {
+            "subcategory_codes": params.getlist('subcategory'),
+            "parent_codes": params.getlist('parent'),
+            "category_slugs": params.getlist('category'),
+            "price_min": _parse_decimal(params.get("price_min")),
+            "price_max": _parse_decimal(params.get("price_max")),
+            "search_q": (params.get("q") or "").strip(),
+            "ordering": (params.get("ordering") or "").strip(),
+            "is_new": params.get('is_new', None) == 'true',
+            "is_bestseller": params.get('is_bestseller', None) == 'true',
+            "in_stock": params.get('in_stock', None) == 'true',
+        }
+
+    def _filtered_queryset(self, filters, facet_filters=True):
+        """
+        Выборка каталога по разобранным фильтрам.
+        facet_filters=False — без фильтров, по которым считаются фасеты
+        (подкатегории, флаги, цена): их применяет shop/facets.py по сгруппированным строкам.
+        """
+        subcategory_codes = filters["subcategory_codes"]
+        parent_codes = filters["parent_codes"]
+        ordering = filters["ordering"]
+
         def _apply_price_filters(qs):
-            min_val = _parse_decimal(price_min)
-            max_val = _parse_decimal(price_max)
-            if min_val is not None:
-                qs = qs.filter(price__gte=min_val)
-            if max_val is not None:
-                qs = qs.filter(price__lte=max_val)
+            if filters["price_min"] is not None:
+                qs = qs.filter(price__gte=filters["price_min"])
+            if filters["price_max"] is not None:
+                qs = qs.filter(price__lte=filters["price_max"])
             return qs
 
         def _apply_ordering(qs):
@@ -553,17 +723,21 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
             queryset = Product.objects.filter(
                 moysklad_id__isnull=False,
                 category__slug=getattr(settings, "MOYSKLAD_SITE_CATEGORY_SLUG", "site-kokossimo"),
-            ).select_related('category', 'product_subcategory').annotate(
-                rating_avg=Avg('ratings__rating'),
-                rating_count=Count('ratings')
-            ).order_by('-created_at', '-id')
+            ).select_related('category', 'product_subcategory').order_by('-created_at', '-id')
+        else:
+            # Фильтрация товаров через параметры URL
+            # Пример: /api/products/?is_new=true&category=face&category=body&subcategory=1.1
+            queryset = Product.objects.select_related('category', 'product_subcategory').order_by('-created_at', '-id')
+            if filters["category_slugs"]:
+                queryset = queryset.filter(category__slug__in=filters["category_slugs"])
 
+        if facet_filters:
             # В режиме МойСклад также должны работать фильтры "новинки/бестселлеры"
-            if is_new == 'true':
+            if filters["is_new"]:
                 queryset = queryset.filter(is_new=True)
-            if is_bestseller == 'true':
+            if filters["is_bestseller"]:
                 queryset = queryset.filter(is_bestseller=True)
-            if in_stock == 'true':
+            if filters["in_stock"]:
                 queryset = queryset.filter(stock__gt=0)
 
             # Важно: если выбраны подкатегории, они должны быть приоритетнее родителя.
@@ -572,48 +746,56 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
                 queryset = queryset.filter(product_subcategory__isnull=False, product_subcategory__code__in=subcategory_codes)
             elif parent_codes:
                 queryset = queryset.filter(product_subcategory__isnull=False, product_subcategory__parent_code__in=parent_codes)
-            if search_q:
-                queryset = queryset.filter(
-                    Q(name__icontains=search_q) | Q(description__icontains=search_q)
-                )
+
+        if facet_filters:
             queryset = _apply_price_filters(queryset)
-            queryset = _apply_ordering(queryset)
-            queryset = self._with_user_rating_prefetch(queryset)
-            return queryset
+        queryset = self._apply_search(queryset, filters["search_q"], rank=not ordering)
+        queryset = _apply_ordering(queryset)
+        return queryset
 
-        # Фильтрация товаров через параметры URL
-        # Пример: /api/products/?is_new=true&category=face&category=body&subcategory=1.1
-        queryset = Product.objects.select_related('category', 'product_subcategory').annotate(
-            rating_avg=Avg('ratings__rating'),
-            rating_count=Count('ratings')
-        ).order_by('-created_at', '-id')
-        
-        category_slugs = self.request.query_params.getlist('category')
-
-        if is_new == 'true':
-            queryset = queryset.filter(is_new=True)
-        
-        if is_bestseller == 'true':
-            queryset = queryset.filter(is_bestseller=True)
-        if in_stock == 'true':
-            queryset = queryset.filter(stock__gt=0)
-
-        if category_slugs:
-            queryset = queryset.filter(category__slug__in=category_slugs)
-
-        # Важно: если выбраны подкатегории, они должны быть приоритетнее родителя.
-        if subcategory_codes:
-            queryset = queryset.filter(product_subcategory__isnull=False, product_subcategory__code__in=subcategory_codes)
-        elif parent_codes:
-            queryset = queryset.filter(product_subcategory__isnull=False, product_subcategory__parent_code__in=parent_codes)
-
-        if search_q:
-            queryset = queryset.filter(
-                Q(name__icontains=search_q) | Q(description__icontains=search_q)
-            )
+    # Тяжёлые колонки карточки товара, которые не читаются из БД, если их нет в ответе
+    # (список и так выбирает только колонки ответа — см. _fast_list).
+    HEAVY_FIELDS = ("description", "composition", "usage_instructions", "rating_histogram")
 
-        queryset = _apply_price_filters(queryset)
-        queryset = _apply_ordering(queryset)
+    def _sparse_fieldset(self):
+        """(fields, omit) из ?fields=a,b и ?omit=c; неизвестные имена игнорируются."""
+        known = set(ProductSerializer.Meta.fields)
+
+        def _names(param):
+            raw = ",".join(self.request.query_params.getlist(param))
+            return [name for name in (part.strip() for part in raw.split(",")) if name in known]
+
+        return _names("fields"), _names("omit")
+
+    def _output_fields(self):
+        fields, omit = self._sparse_fieldset()
+        if not fields:
+            fields = self.get_serializer_class().Meta.fields
+        return set(fields) - set(omit)
+
+    def get_serializer_class(self):
+        # Списку — облегчённая карточка; ?fields= выбирает из полного набора полей.
+        if self.action == "list" and not self._sparse_fieldset()[0]:
+            return ProductCardSerializer
+        return ProductSerializer
+
+    def get_serializer(self, *args, **kwargs):
+        fields, omit = self._sparse_fieldset()
+        if fields:
+            kwargs.setdefault("fields", fields)
+        if omit:
+            kwargs.setdefault("omit", omit)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        queryset = self._filtered_queryset(self._catalog_filters())
+        if self.action == "retrieve":
+            output = self._output_fields()
+            skipped = [name for name in self.HEAVY_FIELDS if name not in output]
+            if skipped:
+                queryset = queryset.defer(*skipped)
+            if "user_rating" not in output:
+                return queryset
         queryset = self._with_user_rating_prefetch(queryset)
         return queryset
 
@@ -624,16 +806,59 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         ВАЖНО: фронт вызывает этот эндпоинт без price_min/price_max,
         чтобы подсказки "от/до" всегда показывали минимальную/максимальную цену товаров в выборке.
         """
-        qs = self.get_queryset()
-        agg = qs.aggregate(min_price=Min("price"), max_price=Max("price"))
-        min_price = agg.get("min_price")
-        max_price = agg.get("max_price")
-        return Response(
-            {
-                "min_price": str(min_price) if min_price is not None else None,
-                "max_price": str(max_price) if max_price is not None else None,
-            }
-        )
+        def _build():
+            filters = self._catalog_filters()
+            engine = self._catalog_engine(filters)
+            if engine is not None:
+                min_price, max_price = engine[0].price_range(filters, engine[1])
+                return Response({"min_price": min_price, "max_price": max_price})
+            qs = self.get_queryset()
+            agg = qs.aggregate(min_price=Min("price"), max_price=Max("price"))
+            min_price = agg.get("min_price")
+            max_price = agg.get("max_price")
+            return Response(
+                {
+                    "min_price": str(min_price) if min_price is not None else None,
+                    "max_price": str(max_price) if max_price is not None else None,
+                }
+            )
+
+        return cached_catalog_response(request, "price-range", _build)
+
+    @action(detail=False, methods=["get"], url_path="facets")
+    def facets(self, request):
+        """
+        Счётчики для фильтров каталога: подкатегории и родители, наличие, новинки/бестселлеры,
+        гистограмма цен. Те же параметры, что у списка; один сгруппированный запрос (shop/facets.py).
+        Ответ кэшируется по нормализованному набору фильтров и поколению каталога.
+        """
+        filters = self._catalog_filters()
+        cache_key = f"catalog-facets:{get_catalog_generation()}:{filter_signature(filters)}"
+        data = cache.get(cache_key)
+        if data is None:
+            engine = self._catalog_engine(filters)
+            if engine is not None:
+                data = engine[0].facets(filters, engine[1], price_bucket_bounds())
+            else:
+                data = build_facets(self._filtered_queryset(filters, facet_filters=False), filters)
+            cache.set(cache_key, data, int(getattr(settings, "CATALOG_FACETS_CACHE_SECONDS", 60)))
+        return Response(data)
+
+    @action(detail=False, methods=["get"], url_path="suggest")
+    def suggest(self, request):
+        """
+        Подсказки для строки поиска по мере набора: товары и подкатегории.
+        Отвечает из индекса в памяти (shop/suggest.py), без запросов к БД.
+        """
+        query = (request.query_params.get("q") or "").strip()
+        try:
+            limit = int(request.query_params.get("limit") or 8)
+        except (TypeError, ValueError):
+            limit = 8
+        limit = max(1, min(limit, 20))
+        if not query:
+            return Response({"products": [], "subcategories": []})
+        return Response(suggest_catalog(query, limit=limit))
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -644,16 +869,42 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def product_ratings(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    ratings = ProductRating.objects.filter(product=product).select_related('user')
-    return Response(ProductRatingSerializer(ratings, many=True).data, status=status.HTTP_200_OK)
+    # Версия списка отзывов — по updated_at и количеству строк (один агрегат до сериализации).
+    state = ProductRating.objects.filter(product_id=product_id).aggregate(
+        last_updated=Max("updated_at"),
+        total=Count("id"),
+        last_id=Max("id"),
+    )
+    if not state["total"]:
+        get_object_or_404(Product, id=product_id)
+
+    def _build():
+        ratings = ProductRating.objects.filter(product_id=product_id).select_related('user')
+        return Response(ProductRatingSerializer(ratings, many=True).data, status=status.HTTP_200_OK)
+
+    return conditional_response(
+        request,
+        _build,
+        etag=make_etag("product-ratings", product_id, state["total"], state["last_id"], state["last_updated"]),
+        last_modified=state["last_updated"],
+    )
+
+
+# Конфиг городов задан в коде (shop/delivery_cities.py) — его версия меняется только с деплоем.
+_DELIVERY_CITIES_ETAG = make_etag(json.dumps(DELIVERY_CITIES, sort_keys=True, ensure_ascii=False, default=str))
+_DELIVERY_CITIES_MODIFIED = datetime.fromtimestamp(os.path.getmtime(delivery_cities.__file__), tz=dt_timezone.utc)
 
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def delivery_cities_config(request):
     """Публичный конфиг городов доставки для оформления заказа (единый источник с расчётом суммы)."""
-    return Response(DELIVERY_CITIES, status=status.HTTP_200_OK)
+    return conditional_response(
+        request,
+        lambda: Response(DELIVERY_CITIES, status=status.HTTP_200_OK),
+        etag=_DELIVERY_CITIES_ETAG,
+        last_modified=_DELIVERY_CITIES_MODIFIED,
+    )
 
 
 @api_view(['POST'])
@@ -674,16 +925,14 @@ def rate_product(request, product_id):
         defaults={'rating': rating_value, 'comment': comment},
     )
 
-    stats = ProductRating.objects.filter(product=product).aggregate(
-        rating_avg=Avg('rating'),
-        rating_count=Count('id'),
-    )
+    # Агрегаты уже пересчитаны сигналом post_save (shop/ratings.py).
+    stats = Product.objects.filter(id=product.id).values('rating_avg', 'rating_count').first() or {}
 
     return Response(
         {
             "rating": ProductRatingSerializer(rating_obj).data,
-            "rating_avg": stats['rating_avg'] or 0,
-            "rating_count": stats['rating_count'] or 0,
+            "rating_avg": stats.get('rating_avg') or 0,
+            "rating_count": stats.get('rating_count') or 0,
         },
         status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
     )
@@ -1267,7 +1516,24 @@ def product_image_proxy(request, product_id):
         return _placeholder_image_response(reason)
 
 
+def _negative_placeholder(request, product_id):
+    """Плейсхолдер из негативного кэша или None (?debug=1 — кэш не используется, проверить заново)."""
+    if request.GET.get("debug"):
+        return None
+    negative = image_cache.get_negative(product_id)
+    if negative is None:
+        return None
+    resp = _placeholder_image_response(f"negative_cache:{negative.get('reason', '')}")
+    resp["X-Image-Cache"] = "negative"
+    return resp
+
+
 def _product_image_proxy_impl(request, product_id):
+    # Негативный кэш: недавно не удалось отдать фото — плейсхолдер без БД и МойСклад.
+    negative = _negative_placeholder(request, product_id)
+    if negative is not None:
+        return negative
+
     product = Product.objects.filter(id=product_id).first()
     if not product:
         return _placeholder_or_debug(request, "product_not_found")
@@ -1279,20 +1545,57 @@ def _product_image_proxy_impl(request, product_id):
         if bool(getattr(settings, "MOYSKLAD_IMAGE_PROXY_REDIRECT_ONLY", False)):
             return HttpResponseRedirect(product.external_image_url)
 
-        try:
-            client = MoySkladClient()
-            payload, content_type = client.download_binary(product.external_image_url)
-        except (MoySkladConfigError, MoySkladError) as exc:
-            return _placeholder_or_debug(request, f"moysklad_error:{str(exc)[:60]}")
+        url = product.external_image_url
+        etag = f'"{image_cache.cache_key(url)[:32]}"'
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return _image_proxy_headers(not_modified, etag, "revalidated")
+
+        # Дисковый кэш (shop/image_cache.py): попадание отдаётся файлом без обращения к МойСклад.
+        cached = image_cache.get(url)
+        if cached is not None:
+            body_file, content_type, _key = cached
+            return _image_proxy_headers(FileResponse(body_file, content_type=content_type), etag, "hit")
+
+        # Single-flight: одну картинку качает один воркер, остальные ждут и читают её из кэша.
+        with image_cache.fill_lock(url):
+            cached = image_cache.get(url)
+            if cached is not None:
+                body_file, content_type, _key = cached
+                return _image_proxy_headers(FileResponse(body_file, content_type=content_type), etag, "coalesced")
+            # Пока ждали блокировку, воркер-лидер мог получить ошибку и записать негативный кэш.
+            negative = _negative_placeholder(request, product.id)
+            if negative is not None:
+                return negative
+            try:
+                client = MoySkladClient()
+                payload, content_type = client.download_binary(url)
+            except MoySkladConfigError as exc:
+                return _placeholder_or_debug(request, f"moysklad_error:{str(exc)[:60]}")
+            except MoySkladError as exc:
+                reason = f"moysklad_error:{str(exc)[:60]}"
+                image_cache.put_negative(product.id, url, reason)
+                return _placeholder_or_debug(request, reason)
+            image_cache.put(url, payload, content_type)
+            image_cache.discard_negative(product.id)
+        image_variants.ensure_product_variants_in_background(product.id, payload)
 
         resp = HttpResponse(payload, content_type=content_type or "application/octet-stream")
-        # Картинки меняются редко; даём кэшировать, но оставляем возможность быстро сбросить через CDN.
-        resp["Cache-Control"] = "public, max-age=3600"
-        resp["Access-Control-Allow-Origin"] = "*"
-        return resp
+        resp["X-Image-Download-Attempts"] = str(client.last_download_attempts)
+        return _image_proxy_headers(resp, etag, "miss")
+    image_cache.put_negative(product.id, "", "no_image_available")
     return _placeholder_or_debug(request, "no_image_available")
 
 
+def _image_proxy_headers(resp, etag, cache_status):
+    # Картинки меняются редко; даём кэшировать, но оставляем возможность быстро сбросить через CDN.
+    resp["Cache-Control"] = "public, max-age=3600"
+    resp["Access-Control-Allow-Origin"] = "*"
+    resp["ETag"] = etag
+    resp["X-Image-Cache"] = cache_status
+    return resp
+
+
 @api_view(['GET'])
 @authentication_classes([TokenAuthentication])
 @permission_classes([IsAdminUser])
@@ -1312,11 +1615,34 @@ def moysklad_status(request):
             "rows_count": rows_count,
             "offset": result.get("meta", {}).get("offset", 0),
             "limit": result.get("meta", {}).get("limit", 1),
+            "http_pool": http_pool_stats(),
+            "rate_limit": rate_limiter.stats(),
         },
         status=status.HTTP_200_OK,
     )
 
 
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def moysklad_webhook(request):
+    """
+    Вебхуки МойСклад (product/variant/bundle/service, webhookstock): события ставятся в очередь
+    и применяются фоновым обработчиком, ответ не ждёт запросов к API МойСклад.
+    """
+    provided = request.query_params.get("secret") or request.headers.get("X-Moysklad-Webhook-Secret", "")
+    try:
+        if not moysklad_webhooks.verify_secret(provided):
+            return Response({"detail": "Invalid secret."}, status=status.HTTP_403_FORBIDDEN)
+    except moysklad_webhooks.WebhookSecretError as exc:
+        return Response({"detail": str(exc)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    result = moysklad_webhooks.enqueue(request.data)
+    if result["queued"] and getattr(settings, "MOYSKLAD_WEBHOOK_PROCESS_INLINE", True):
+        moysklad_webhooks.process_queue_in_background()
+    return Response({"detail": "ok", **result}, status=status.HTTP_200_OK)
+
+
 @api_view(['GET'])
 @authentication_classes([TokenAuthentication])
 @permission_classes([IsAdminUser])
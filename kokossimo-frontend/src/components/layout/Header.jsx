@@ -92,7 +92,12 @@ const Header = () => {
 
   const loadAllProducts = async () => {
     if (allProductsRef.current.length > 0) return allProductsRef.current;
-    const response = await getProducts({ page: 1, page_size: 120 });
+    const response = await getProducts({
+      page: 1,
+      page_size: 120,
+      // Список каталога по умолчанию без описания — для поиска по описанию запрашиваем его явно.
+      fields: 'id,name,description',
+    });
     const data = Array.isArray(response.data)
       ? response.data
       : response.data?.results || [];
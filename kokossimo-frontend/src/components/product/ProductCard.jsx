@@ -45,6 +45,9 @@ const ProductCard = ({ product, className = '' }) => {
   const [imageError, setImageError] = React.useState(false);
   const imageUrl = resolveMediaUrl(product.image, placeholderImage);
   const displayImageUrl = imageError ? placeholderImage : imageUrl;
+  // Уменьшенные WebP/JPEG-копии с бэкенда (image_srcset); при ошибке загрузки — только плейсхолдер.
+  const imageSrcset = !imageError ? product.image_srcset : null;
+  const imageSizes = '(max-width: 768px) 50vw, 300px';
   const favorite = isFavorite(product.id);
 
   const handleAddToCart = (e) => {
@@ -152,15 +155,23 @@ const ProductCard = ({ product, className = '' }) => {
         >
           <div className="product-card__image">
             {displayImageUrl && (
-              <img
-                src={displayImageUrl}
-                alt={product.name}
-                onError={() => setImageError(true)}
-                onLoad={(e) => {
-                  const img = e.target;
-                  if (img.naturalWidth === 1 && img.naturalHeight === 1) setImageError(true);
-                }}
-              />
+              <picture>
+                {imageSrcset?.webp && (
+                  <source type="image/webp" srcSet={imageSrcset.webp} sizes={imageSizes} />
+                )}
+                <img
+                  src={displayImageUrl}
+                  srcSet={imageSrcset?.jpeg || undefined}
+                  sizes={imageSrcset?.jpeg ? imageSizes : undefined}
+                  alt={product.name}
+                  loading="lazy"
+                  onError={() => setImageError(true)}
+                  onLoad={(e) => {
+                    const img = e.target;
+                    if (img.naturalWidth === 1 && img.naturalHeight === 1) setImageError(true);
+                  }}
+                />
+              </picture>
             )}
           </div>
         </Link>